@@ -4,30 +4,167 @@ from ranked values.
 """
 
 import argparse
+import concurrent.futures
+import os
 import time
 
+import psycopg2.extras
+import psycopg2.sql
+
 import util
 
+# Tables --workers runs have finished with, so a killed run picks up where it left off
+CHECKPOINT_FILE_PATH = os.path.join(util.TEMP_DIR, "example_vals_checkpoint.tsv")
+# Outcomes that are checkpointed. Other failures (lock or connection trouble) may not happen
+# again, so those tables are retried on the next run.
+CHECKPOINTED_STATUSES = ("done", "over_budget")
+# Tables skipped by runs without --workers, for reviewing. Never read back.
+SKIP_LOG_FILE_PATH = os.path.join(util.TEMP_DIR, "example_vals_skipped.tsv")
+WORK_LIST_PAGE_SIZE = 1000
+# Used when a table's size can't be found, same as the old fixed sample
+DEFAULT_SAMPLE_PERCENT = 10
+# Rough rows per 8kB page, for turning tables.rows_count into pages
+ROWS_PER_PAGE_GUESS = 50
+# How many pages each sample should read, and how long each sampling query may take.
+# Overridden by command line flags.
+SAMPLE_BUDGET = {"target_pages": 1000, "timeout_ms": 60000}
+
+
+class OverBudgetError(Exception):
+    """
+    Exception for when a sampling query runs past its statement_timeout
+    """
+    pass # pylint: disable=unnecessary-pass
 
-def autoselect_column():
-    """Find a record from columns table without example values"""
+
+def autoselect_column(after=None):
+    """
+    Find a record from columns table without example values.
+    `after` is the (schema, table, column) last handled, so skipped columns aren't picked again.
+    """
+    after = after or ("", "", "")
     util.cursor.execute("""
         SELECT * FROM columns
         WHERE table_name != 'tables'
         AND example_vals IS NULL
-        ORDER BY table_name, column_name
+        AND (table_schema, table_name, column_name) > (%s, %s, %s)
+        ORDER BY table_schema, table_name, column_name
         LIMIT 1
-    """)
+    """, after)
+    row = util.cursor.fetchone()
+    return row
+
+
+def autoselect_table(after=None):
+    """
+    Find the next table (in schema, name order) that has columns without example values.
+    `after` is the (schema, table) pair last handled, so skipped tables aren't picked again.
+    """
+    after = after or ("", "")
+    util.cursor.execute("""
+        SELECT table_schema, table_name FROM columns
+        WHERE table_name != 'tables'
+        AND example_vals IS NULL
+        AND (table_schema, table_name) > (%s, %s)
+        ORDER BY table_schema, table_name
+        LIMIT 1
+    """, after)
     row = util.cursor.fetchone()
     return row
 
 
+def get_undocumented_cols(schema, table):
+    """Names of the columns of a table that don't have example values yet"""
+    util.cursor.execute("""
+        SELECT column_name FROM columns
+        WHERE table_schema = %s AND table_name = %s
+        AND example_vals IS NULL
+        ORDER BY column_name
+    """, (schema, table))
+    return [row["column_name"] for row in util.cursor.fetchall()]
+
+
+def truncate_val(raw_val):
+    """Keep long values from swamping the example list"""
+    raw_val = str(raw_val)
+    if len(raw_val) > 80:
+        return raw_val[0:80] + '...[truncated]'
+    return raw_val
+
+
+def pick_examples(sampled_vals):
+    """Keep a few spaced-out items from a list of values ranked by frequency"""
+    if len(sampled_vals) <= 5:
+        return sampled_vals
+    if len(sampled_vals) < 10:
+        return sampled_vals[0:4] + [sampled_vals[-1]]
+
+    return [
+        sampled_vals[0], sampled_vals[2], sampled_vals[4], sampled_vals[6], sampled_vals[8]]
+
+
+def get_sample_percent(schema, table, cursor=None):
+    """
+    Pick a TABLESAMPLE SYSTEM percentage so that the sample reads about
+    SAMPLE_BUDGET["target_pages"] pages, whatever the size of the table.
+    Uses pg_class.relpages, falling back to reltuples or tables.rows_count if never vacuumed.
+    """
+    cursor = cursor or util.cursor
+    cursor.execute("""
+        SELECT c.relpages, c.reltuples, t.rows_count
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN tables t ON t.table_schema = n.nspname AND t.table_name = c.relname
+        WHERE n.nspname = %s AND c.relname = %s
+    """, (schema, table))
+    row = cursor.fetchone()
+    if not row:
+        return DEFAULT_SAMPLE_PERCENT
+
+    num_pages = row["relpages"]
+    if not num_pages or num_pages <= 0:
+        num_rows = row["reltuples"] if row["reltuples"] and row["reltuples"] > 0 \
+            else row["rows_count"]
+        if not num_rows:
+            return DEFAULT_SAMPLE_PERCENT
+        num_pages = max(1, num_rows / ROWS_PER_PAGE_GUESS)
+
+    percent = 100.0 * SAMPLE_BUDGET["target_pages"] / num_pages
+    return min(100.0, max(0.0001, percent))
+
+
+def run_sample_query(cursor, query, params=None):
+    """
+    Run a sampling query under the per-query statement_timeout.
+    Raises OverBudgetError (after rolling back) if it runs too long.
+    """
+    try:
+        cursor.execute("SET LOCAL statement_timeout = %s", (SAMPLE_BUDGET["timeout_ms"],))
+        cursor.execute(query, params)
+    except psycopg2.extensions.QueryCanceledError as e:
+        cursor.connection.rollback()
+        raise OverBudgetError(
+            "sample took longer than %ims" % SAMPLE_BUDGET["timeout_ms"]) from e
+    return cursor.fetchall()
+
+
+def record_skip(schema, table, status, detail):
+    """
+    Log a table that couldn't be sampled outside --workers mode. Kept apart from the workers'
+    checkpoint, which would otherwise never sample it.
+    """
+    util.make_temp_dir()
+    with open(SKIP_LOG_FILE_PATH, "a") as skip_log_f:
+        skip_log_f.write("%s\t%s\t%s\t%s\n" % (schema, table, status, detail))
+
+
 def get_examples(schema, table, column):
     """Sample, rank, keep a few spaced-out items from ranked list"""
-    util.cursor.execute(f"""
+    sample_percent = get_sample_percent(schema, table)
+    rows = run_sample_query(util.cursor, psycopg2.sql.SQL("""
         WITH first_sample AS (
             SELECT coalesce({column}::text, 'NULL') AS val
-            FROM {schema}.{table} TABLESAMPLE SYSTEM (10)
+            FROM {schema}.{table} TABLESAMPLE SYSTEM ({sample_percent})
             LIMIT 10000
         ),
         ranked AS (
@@ -36,48 +173,352 @@ def get_examples(schema, table, column):
             GROUP BY val
         )
         SELECT * FROM ranked ORDER BY rnk
-    """)
-    sampled_vals = []
-    for row in util.cursor.fetchall():
-        raw_val = str(row['val'])
-        final_val = raw_val
-        if len(raw_val) > 80:
-            final_val = raw_val[0:80] + '...[truncated]'
-        sampled_vals.append(final_val)
+    """).format(
+        column=psycopg2.sql.Identifier(column),
+        schema=psycopg2.sql.Identifier(schema),
+        table=psycopg2.sql.Identifier(table),
+        sample_percent=psycopg2.sql.Literal(sample_percent)))
+    sampled_vals = [truncate_val(row['val']) for row in rows]
+    return pick_examples(sampled_vals)
 
-    if len(sampled_vals) <= 5:
-        return sampled_vals
-    if len(sampled_vals) < 10:
-        return sampled_vals[0:4] + [sampled_vals[-1]]
 
-    return [
-        sampled_vals[0], sampled_vals[2], sampled_vals[4], sampled_vals[6], sampled_vals[8]]
+def get_table_examples(schema, table, columns, cursor=None):
+    """
+    Sample the table's blocks once, and rank values for every given column from that one sample.
+    Returns a dict of column name to picked example values.
+    """
+    cursor = cursor or util.cursor
+    sample_percent = get_sample_percent(schema, table, cursor)
+    select_list = psycopg2.sql.SQL(", ").join(
+        psycopg2.sql.SQL("{col}::text AS {col}").format(col=psycopg2.sql.Identifier(col))
+        for col in columns)
+    # Unpivot the sample so every column is ranked by the same GROUP BY. The %s are the column
+    # names as values, passed as parameters.
+    unpivot_list = psycopg2.sql.SQL(", ").join(
+        psycopg2.sql.SQL("(%s, s.{col})").format(col=psycopg2.sql.Identifier(col))
+        for col in columns)
+    rows = run_sample_query(cursor, psycopg2.sql.SQL("""
+        WITH first_sample AS (
+            SELECT {select_list}
+            FROM {schema}.{table} TABLESAMPLE SYSTEM ({sample_percent})
+            LIMIT 10000
+        ),
+        ranked AS (
+            SELECT
+            u.col, coalesce(u.val, 'NULL') AS val, count(1),
+            row_number() OVER (PARTITION BY u.col ORDER BY count(1) DESC) AS rnk
+            FROM first_sample s, LATERAL (VALUES {unpivot_list}) AS u(col, val)
+            GROUP BY u.col, coalesce(u.val, 'NULL')
+        )
+        SELECT col, val FROM ranked
+        WHERE rnk <= 10
+        ORDER BY col, rnk
+    """).format(
+        select_list=select_list,
+        schema=psycopg2.sql.Identifier(schema),
+        table=psycopg2.sql.Identifier(table),
+        sample_percent=psycopg2.sql.Literal(sample_percent),
+        unpivot_list=unpivot_list), tuple(columns))
+    ranked_vals = {col: [] for col in columns}
+    for row in rows:
+        ranked_vals[row["col"]].append(truncate_val(row["val"]))
+    return {col: pick_examples(vals) for col, vals in ranked_vals.items()}
 
 
 def set_examples(schema, table, column, vals):
     """Update the example_vals column"""
     column_string = " ; ".join(vals)
-    util.cursor.execute(f"""
+    util.cursor.execute("""
         UPDATE columns SET example_vals = %s
         WHERE table_schema = %s AND table_name = %s AND column_name = %s
     """, (column_string, schema, table, column))
     util.db_conn.commit()
 
 
+def set_table_examples(schema, table, examples_by_col, cursor=None):
+    """Update the example_vals column for many columns of one table in a single statement"""
+    set_many_examples(
+        [(schema, table, column, vals) for column, vals in examples_by_col.items()], cursor)
+
+
+def set_many_examples(examples, cursor=None):
+    """
+    Update the example_vals column for any number of columns in a single statement.
+    `examples` is a list of (schema, table, column, vals).
+    """
+    cursor = cursor or util.cursor
+    update_rows = [
+        (schema, table, column, " ; ".join(vals)) for schema, table, column, vals in examples]
+    psycopg2.extras.execute_values(cursor, """
+        UPDATE columns c SET example_vals = v.example_vals
+        FROM (VALUES %s) AS v(table_schema, table_name, column_name, example_vals)
+        WHERE c.table_schema = v.table_schema
+        AND c.table_name = v.table_name
+        AND c.column_name = v.column_name
+    """, update_rows, page_size=1000)
+    cursor.connection.commit()
+
+
+def examples_from_stats(stats_row):
+    """
+    Pick example values out of a pg_stats row, or None if the stats don't have any.
+    Most common values are already ranked; NULL is ranked among them by null_frac, the same way
+    sampling would count it. Columns that are nearly all distinct have no most common values,
+    so their histogram bounds (spread over the whole distribution) are used instead.
+    """
+    null_frac = stats_row["null_frac"] or 0
+    if stats_row["mcv"]:
+        ranked = list(zip(stats_row["mcv_freqs"], stats_row["mcv"]))
+        if null_frac:
+            ranked.append((null_frac, "NULL"))
+        ranked.sort(key=lambda freq_and_val: freq_and_val[0], reverse=True)
+        return pick_examples([truncate_val(val) for _, val in ranked])
+    if stats_row["histogram"]:
+        histogram = stats_row["histogram"]
+        step = max(1, len(histogram) // 10)
+        return pick_examples([truncate_val(val) for val in histogram[::step]])
+    if null_frac == 1:
+        return ["NULL"]
+    return None
+
+
+def fill_from_stats(no_confirmation):
+    """
+    Fill example values for every column the planner has statistics for, using one bulk query
+    over pg_stats instead of reading any table data. Columns without stats are left alone.
+    """
+    util.cursor.execute("""
+        SELECT DISTINCT ON (c.table_schema, c.table_name, c.column_name)
+        c.table_schema, c.table_name, c.column_name,
+        s.null_frac,
+        s.most_common_vals::text::text[] AS mcv,
+        s.most_common_freqs AS mcv_freqs,
+        s.histogram_bounds::text::text[] AS histogram
+        FROM columns c
+        JOIN pg_stats s
+        ON s.schemaname = c.table_schema
+        AND s.tablename = c.table_name
+        AND s.attname = c.column_name
+        WHERE c.table_name != 'tables'
+        AND c.example_vals IS NULL
+        ORDER BY c.table_schema, c.table_name, c.column_name, s.inherited DESC
+    """)
+    examples = []
+    for row in util.cursor:
+        vals = examples_from_stats(row)
+        if vals:
+            examples.append((row["table_schema"], row["table_name"], row["column_name"], vals))
+    util.db_conn.commit()
+
+    print("Found example values in pg_stats for %i columns" % len(examples))
+    if not examples:
+        return
+    for schema, table, column, vals in examples[0:10]:
+        print("%s.%s.%s: %s" % (schema, table, column, vals))
+    user_response = None
+    if not no_confirmation:
+        user_response = input("Use these values for all %i columns? (y/n)" % len(examples))
+    if user_response == "y" or no_confirmation:
+        print("Updating DB...")
+        set_many_examples(examples)
+
+
+def run_by_table(no_confirmation):
+    """Sample each table once and fill in all of its undocumented columns together"""
+    last_table = None
+    while True:
+        table_row = autoselect_table(last_table)
+        if not table_row:
+            break
+        schema, table = table_row["table_schema"], table_row["table_name"]
+        last_table = (schema, table)
+        columns = get_undocumented_cols(schema, table)
+        print("*" * 40)
+        print("Getting sample vals for %i columns of %s.%s" % (len(columns), schema, table))
+        try:
+            examples_by_col = get_table_examples(schema, table, columns)
+        except OverBudgetError as e:
+            print("skipping %s.%s: %s" % (schema, table, e))
+            record_skip(schema, table, "over_budget", str(e))
+            continue
+        except Exception as e: # pylint: disable=broad-except
+            util.db_conn.rollback()
+            print("couldn't sample %s.%s, skipping: %s" % (schema, table, e))
+            continue
+        for column, vals in examples_by_col.items():
+            print("%s: %s" % (column, vals))
+        user_response = None
+        if not no_confirmation:
+            user_response = input("Use sample values? (y/n)")
+        if user_response == "y" or no_confirmation:
+            print("Updating DB...")
+            set_table_examples(schema, table, examples_by_col)
+        else:
+            print("skipping this table at user's request.")
+
+
+def build_work_list():
+    """
+    Get every table with columns lacking example values, along with those columns.
+    Pages through with a keyset so each page is an index range rather than a rescan.
+    """
+    work_list = []
+    last_table = ("", "")
+    while True:
+        util.cursor.execute("""
+            SELECT table_schema, table_name, array_agg(column_name ORDER BY column_name) AS cols
+            FROM columns
+            WHERE table_name != 'tables'
+            AND example_vals IS NULL
+            AND (table_schema, table_name) > (%s, %s)
+            GROUP BY table_schema, table_name
+            ORDER BY table_schema, table_name
+            LIMIT %s
+        """, last_table + (WORK_LIST_PAGE_SIZE,))
+        page = [(row["table_schema"], row["table_name"], row["cols"]) for row in util.cursor]
+        work_list += page
+        if len(page) < WORK_LIST_PAGE_SIZE:
+            break
+        last_table = page[-1][0:2]
+    util.db_conn.commit()
+    return work_list
+
+
+def read_checkpoint():
+    """
+    Tables already handled by an earlier run, as a set of (schema, table). Failures other than
+    CHECKPOINTED_STATUSES, which older runs recorded too, don't count.
+    """
+    if not os.path.exists(CHECKPOINT_FILE_PATH):
+        return set()
+    with open(CHECKPOINT_FILE_PATH) as checkpoint_f:
+        lines = [line.rstrip("\n").split("\t") for line in checkpoint_f if line.strip()]
+    return {
+        tuple(fields[0:2]) for fields in lines
+        if len(fields) > 2 and fields[2] in CHECKPOINTED_STATUSES}
+
+
+def sample_table_worker(schema, table, columns):
+    """Runs in a pool thread, using that thread's own connection"""
+    cursor = util.thread_cursor()
+    try:
+        examples_by_col = get_table_examples(schema, table, columns, cursor=cursor)
+        set_table_examples(schema, table, examples_by_col, cursor=cursor)
+    except OverBudgetError as e:
+        return "over_budget", str(e)
+    except Exception as e: # pylint: disable=broad-except
+        cursor.connection.rollback()
+        return "failed", str(e).strip().replace("\n", " ")
+    return "done", ""
+
+
+def run_workers(num_workers, restart):
+    """
+    Sample tables in parallel over `num_workers` connections. Finished and over-budget tables
+    are checkpointed, so a killed run picks up where it left off, and tables that failed for
+    other reasons are tried again.
+    """
+    if restart and os.path.exists(CHECKPOINT_FILE_PATH):
+        os.remove(CHECKPOINT_FILE_PATH)
+    already_handled = read_checkpoint()
+    full_work_list = build_work_list()
+    work_list = [item for item in full_work_list if item[0:2] not in already_handled]
+    # Not len(already_handled): the checkpoint can list tables that no longer need sampling
+    print("%i tables to sample (%i skipped from checkpoint)" % (
+        len(work_list), len(full_work_list) - len(work_list)))
+
+    start_time = time.time()
+    num_tables, num_cols, num_failed = 0, 0, 0
+    util.make_temp_dir()
+    with open(CHECKPOINT_FILE_PATH, "a") as checkpoint_f, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            executor.submit(sample_table_worker, schema, table, columns): (schema, table, columns)
+            for schema, table, columns in work_list
+        }
+        for future in concurrent.futures.as_completed(futures):
+            schema, table, columns = futures[future]
+            status, detail = future.result()
+            if status in CHECKPOINTED_STATUSES:
+                checkpoint_f.write("%s\t%s\t%s\t%s\n" % (schema, table, status, detail))
+                checkpoint_f.flush()
+            num_tables += 1
+            if status == "done":
+                num_cols += len(columns)
+            else:
+                num_failed += 1
+                print("couldn't sample %s.%s (%s): %s" % (schema, table, status, detail))
+            if num_tables % 50 == 0 or num_tables == len(work_list):
+                elapsed = time.time() - start_time
+                print("%i/%i tables, %i columns, %i failed, %.1f columns/sec" % (
+                    num_tables, len(work_list), num_cols, num_failed, num_cols / elapsed))
+
+
 def main():
     """main"""
     argument_parser = argparse.ArgumentParser()
     argument_parser.add_argument("--no-confirmation", action="store_true")
+    argument_parser.add_argument(
+        "--by-table",
+        action="store_true",
+        help="sample each table once and fill all of its columns from that one sample")
+    argument_parser.add_argument(
+        "--workers",
+        type=int,
+        help="sample tables in parallel over this many connections (implies --by-table)")
+    argument_parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="with --workers, ignore the checkpoint left by an earlier run")
+    argument_parser.add_argument(
+        "--from-stats",
+        action="store_true",
+        help="take example values from pg_stats first, then sample only the columns without "
+        "stats (by table, unless --workers is given)")
+    argument_parser.add_argument(
+        "--target-pages",
+        type=int,
+        default=SAMPLE_BUDGET["target_pages"],
+        help="about how many pages each table sample should read")
+    argument_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=SAMPLE_BUDGET["timeout_ms"] / 1000,
+        help="seconds a sampling query may run before its table is skipped and recorded")
     cli_args = argument_parser.parse_args()
+    # Check every combination of flags before doing any work
+    if cli_args.workers and not cli_args.no_confirmation:
+        argument_parser.error("--workers can't ask for confirmation, pass --no-confirmation")
+    SAMPLE_BUDGET["target_pages"] = cli_args.target_pages
+    SAMPLE_BUDGET["timeout_ms"] = int(cli_args.timeout * 1000)
+
+    if cli_args.from_stats:
+        fill_from_stats(cli_args.no_confirmation)
+        cli_args.by_table = True
+
+    if cli_args.workers:
+        run_workers(cli_args.workers, cli_args.restart)
+        return
+
+    if cli_args.by_table:
+        run_by_table(cli_args.no_confirmation)
+        return
 
+    last_column = None
     while True:
-        col_row = autoselect_column()
+        col_row = autoselect_column(last_column)
         if not col_row:
             break
+        last_column = (col_row["table_schema"], col_row["table_name"], col_row["column_name"])
         print("*" * 40)
         print("Getting sample vals for %s.%s" % (col_row["table_name"], col_row["column_name"]))
-        sampled_vals = get_examples(
-            col_row["table_schema"], col_row["table_name"], col_row["column_name"])
+        try:
+            sampled_vals = get_examples(
+                col_row["table_schema"], col_row["table_name"], col_row["column_name"])
+        except OverBudgetError as e:
+            print("skipping this column: %s" % e)
+            record_skip(col_row["table_schema"], col_row["table_name"], "over_budget", str(e))
+            continue
         print("Sampled vals are:", sampled_vals)
         user_response = None
         if not cli_args.no_confirmation:
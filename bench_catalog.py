@@ -0,0 +1,337 @@
+"""
+Builds a synthetic catalog in a throwaway database and times se commands against it, so changes
+can be checked at scale without going near production.
+
+    # Uses PGHOST/PGUSER like se. Creates (and afterwards drops) database se_bench_10k.
+    python bench_catalog.py run --size 10k --output after.json
+    python bench_catalog.py compare before.json after.json
+
+Only databases whose names start with "se_bench" are ever created or dropped. psycopg2 is only
+imported for `run`, so results can be compared anywhere.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+SE_PATH = os.path.join(THIS_DIR, "se")
+DATABASE_PREFIX = "se_bench"
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000}
+DEFAULT_CONFIG = {
+    "schemas": 20,
+    "columns_per_table": 25,
+    "wide_tables": 10,
+    "wide_columns": 1000,
+    "orphan_percent": 10,
+    "tables_with_rows": 20,
+    "rows_per_table": 10000,
+    "repeat": 5,
+}
+# Tables are created this many per round trip
+DDL_BATCH_SIZE = 500
+# Column names are made from these, so searches and rename matching have something to find
+COLUMN_WORDS = (
+    "customer", "order", "email", "amount", "status", "created", "updated", "account", "product",
+    "price", "quantity", "address", "city", "country", "phone", "invoice", "payment", "shipping",
+    "discount", "currency", "region", "channel", "campaign", "session", "device", "score")
+TABLE_WORDS = (
+    "orders", "customers", "events", "payments", "invoices", "sessions", "products", "shipments",
+    "accounts", "campaigns", "refunds", "visits", "signups", "subscriptions", "carts", "reviews")
+COLUMN_TYPES = ("text", "int", "bigint", "numeric", "timestamp", "boolean", "date")
+# How rows are filled in, for tables that get some
+TYPE_EXPRESSIONS = {
+    "text": "md5((g %% 997)::text)",
+    "int": "(g %% 100)",
+    "bigint": "(g * 7919)::bigint",
+    "numeric": "(g %% 1000) / 10.0",
+    "timestamp": "timestamp '2020-01-01' + g * interval '1 minute'",
+    "boolean": "(g %% 3 = 0)",
+    "date": "date '2020-01-01' + (g %% 1000)",
+}
+
+
+def get_admin_connection():
+    """Connection to the maintenance database, for creating and dropping the bench database"""
+    import psycopg2 # pylint: disable=import-outside-toplevel
+    conn = psycopg2.connect(dbname=os.environ.get("PGMAINTENANCEDB", "postgres"))
+    conn.autocommit = True
+    return conn
+
+
+def recreate_database(database):
+    """Drop and create the bench database"""
+    if not database.startswith(DATABASE_PREFIX):
+        raise ValueError("Refusing to touch database %s, not a bench database" % database)
+    admin_conn = get_admin_connection()
+    with admin_conn.cursor() as cursor:
+        cursor.execute("DROP DATABASE IF EXISTS " + database)
+        cursor.execute("CREATE DATABASE " + database)
+    admin_conn.close()
+
+
+def drop_database(database):
+    """Drop the bench database"""
+    if not database.startswith(DATABASE_PREFIX):
+        raise ValueError("Refusing to touch database %s, not a bench database" % database)
+    admin_conn = get_admin_connection()
+    with admin_conn.cursor() as cursor:
+        cursor.execute("DROP DATABASE IF EXISTS " + database)
+    admin_conn.close()
+
+
+def make_columns(rng, num_columns):
+    """Random but plausible (column name, type) pairs, with an id first"""
+    columns = [("id", "bigint")]
+    used_names = {"id"}
+    while len(columns) < num_columns:
+        name = "_".join(rng.sample(COLUMN_WORDS, rng.choice((1, 2, 2, 3))))
+        if name in used_names:
+            name = "%s_%i" % (name, len(columns))
+        used_names.add(name)
+        columns.append((name, rng.choice(COLUMN_TYPES)))
+    return columns
+
+
+def build_catalog(conn, config, rng):
+    """
+    Create the schemas and tables: config["tables"] tables spread over config["schemas"] schemas,
+    of which config["wide_tables"] have config["wide_columns"] columns. The first
+    config["tables_with_rows"] get rows, so there's something to sample and count.
+    Returns a list of (schema, table, columns).
+    """
+    tables = []
+    for table_num in range(config["tables"]):
+        schema = "bench_%i" % (table_num % config["schemas"])
+        table = "%s_%i" % (rng.choice(TABLE_WORDS), table_num)
+        if table_num < config["wide_tables"]:
+            table = "wide_%i" % table_num
+            num_columns = config["wide_columns"]
+        else:
+            num_columns = max(2, int(rng.gauss(config["columns_per_table"], 5)))
+        tables.append((schema, table, make_columns(rng, num_columns)))
+
+    with conn.cursor() as cursor:
+        for schema_num in range(config["schemas"]):
+            cursor.execute("CREATE SCHEMA bench_%i" % schema_num)
+        for batch_start in range(0, len(tables), DDL_BATCH_SIZE):
+            cursor.execute(";\n".join(
+                'CREATE TABLE "%s"."%s" (%s)' % (
+                    schema, table, ", ".join('"%s" %s' % column for column in columns))
+                for schema, table, columns in tables[batch_start:batch_start + DDL_BATCH_SIZE]))
+            conn.commit()
+
+        for schema, table, columns in tables[:config["tables_with_rows"]]:
+            select_list = ", ".join(TYPE_EXPRESSIONS[column_type] for _, column_type in columns)
+            cursor.execute(
+                'INSERT INTO "%s"."%s" SELECT %s FROM generate_series(1, %%s) g' % (
+                    schema, table, select_list),
+                (config["rows_per_table"],))
+            conn.commit()
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    conn.autocommit = False
+    return tables
+
+
+def make_orphans(conn, config, rng, tables):
+    """
+    Rename config["orphan_percent"] of the tables, and drop a column from as many others, so the
+    next refresh finds orphans (and rename candidates)
+    """
+    num_orphans = len(tables) * config["orphan_percent"] // 100
+    picked = rng.sample(tables[config["wide_tables"]:], min(2 * num_orphans, len(tables)))
+    with conn.cursor() as cursor:
+        for schema, table, _ in picked[:num_orphans]:
+            cursor.execute('ALTER TABLE "%s"."%s" RENAME TO "%s_v2"' % (schema, table, table))
+        for schema, table, columns in picked[num_orphans:]:
+            cursor.execute('ALTER TABLE "%s"."%s" DROP COLUMN "%s"' % (
+                schema, table, columns[-1][0]))
+    conn.commit()
+
+
+def time_command(command, env):
+    """Wall time of one run in ms. Raises if the command fails."""
+    start_time = time.perf_counter()
+    subprocess.run(
+        command, env=env, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - start_time) * 1000
+
+
+def time_step(results, name, command, env, repeat=1):
+    """Run a command `repeat` times and record its timings under `name`"""
+    runs = [time_command(command, env) for _ in range(repeat)]
+    results[name] = {
+        "runs_ms": runs, "min_ms": min(runs), "median_ms": statistics.median(runs)}
+    print("%-40s median %9.1fms  min %9.1fms" % (name, results[name]["median_ms"], min(runs)))
+
+
+def se_command(*args):
+    """An se command line, bypassing any running daemon"""
+    return [sys.executable, SE_PATH, "--direct"] + list(args)
+
+
+def get_git_version():
+    """The commit being benchmarked"""
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=THIS_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(config, keep_database=False):
+    """
+    Build the catalog and time each step. Returns the results as a dict, ready for JSON.
+    """
+    database = "%s_%s" % (DATABASE_PREFIX, config["size"])
+    rng = random.Random(config["seed"])
+    env = dict(os.environ, PGDATABASE=database)
+    os.environ["PGDATABASE"] = database
+
+    print("Building %i tables in %s" % (config["tables"], database))
+    start_time = time.time()
+    recreate_database(database)
+    import psycopg2 # pylint: disable=import-outside-toplevel
+    conn = psycopg2.connect(dbname=database)
+    tables = build_catalog(conn, config, rng)
+    num_columns = sum(len(columns) for _, _, columns in tables)
+    print("Built %i tables, %i columns in %.0fs" % (
+        len(tables), num_columns, time.time() - start_time))
+
+    # Start without a local cache for this database
+    import local_cache # pylint: disable=import-outside-toplevel
+    for cache_path in glob.glob(os.path.splitext(local_cache.get_cache_path())[0] + "*"):
+        os.remove(cache_path)
+
+    repeat = config["repeat"]
+    steps = {}
+    wide_table = "%s.%s" % tables[0][0:2]
+    try:
+        time_step(steps, "migrate", se_command("migrate"), env)
+        time_step(steps, "refresh --all (first)", se_command("refresh", "--all"), env)
+        time_step(steps, "refresh --all (unchanged)", se_command("refresh", "--all"), env, repeat)
+        time_step(steps, "refresh --row-counts", se_command("refresh", "--row-counts"), env, repeat)
+        time_step(steps, "local cache first load", se_command("search", "no_such_table"), env)
+        for source, flags in (("cache", []), ("server", ["--fresh"])):
+            time_step(
+                steps, "search tables (%s)" % source, se_command(*flags, "search", "."), env,
+                repeat)
+            time_step(
+                steps, "search columns (%s)" % source,
+                se_command(*flags, "search", ".", "email"), env, repeat)
+            time_step(
+                steps, "find (%s)" % source, se_command(*flags, "find", "customer", "email"),
+                env, repeat)
+            time_step(
+                steps, "describe wide table (%s)" % source,
+                se_command(*flags, "describe", wide_table), env, repeat)
+        time_step(steps, "stats", se_command("stats"), env, repeat)
+
+        make_orphans(conn, config, rng, tables)
+        time_step(steps, "refresh --all (with orphans)", se_command("refresh", "--all"), env)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            time_step(
+                steps, "resolve-orphans --plan",
+                se_command("resolve-orphans", "--plan", os.path.join(temp_dir, "plan.tsv")),
+                env, repeat)
+        time_step(
+            steps, "example values (4 workers)",
+            [sys.executable, os.path.join(THIS_DIR, "auto_add_example_vals.py"),
+             "--no-confirmation", "--workers", "4", "--restart"],
+            env)
+        time_step(
+            steps, "refresh --row-counts --exact",
+            se_command("refresh", "--row-counts", "--exact"), env)
+    finally:
+        conn.close()
+        if not keep_database:
+            drop_database(database)
+
+    return {
+        "version": get_git_version(),
+        "python": platform.python_version(),
+        "config": config,
+        "catalog": {"tables": len(tables), "columns": num_columns},
+        "steps": steps,
+    }
+
+
+def compare(old_path, new_path, threshold):
+    """
+    Print each step's median before and after. Returns False if any step got slower by more
+    than `threshold` (e.g. 1.2 for 20%).
+    """
+    with open(old_path) as old_f:
+        old_results = json.load(old_f)
+    with open(new_path) as new_f:
+        new_results = json.load(new_f)
+    if old_results["catalog"] != new_results["catalog"]:
+        print("Warning: catalogs differ: %s vs %s" % (
+            old_results["catalog"], new_results["catalog"]))
+
+    ok = True
+    print("%-40s %12s %12s %7s" % ("step", old_results["version"], new_results["version"], "ratio"))
+    for name, new_step in new_results["steps"].items():
+        old_step = old_results["steps"].get(name)
+        if not old_step:
+            print("%-40s %12s %10.1fms" % (name, "-", new_step["median_ms"]))
+            continue
+        ratio = new_step["median_ms"] / max(old_step["median_ms"], 0.001)
+        regressed = ratio > threshold
+        ok = ok and not regressed
+        print("%-40s %10.1fms %10.1fms %6.2fx%s" % (
+            name, old_step["median_ms"], new_step["median_ms"], ratio,
+            "  REGRESSED" if regressed else ""))
+    return ok
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    subparsers = argument_parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="build a catalog and time se against it")
+    run_parser.add_argument("--size", choices=SIZES, default="1k", help="number of tables")
+    run_parser.add_argument("--output", help="write results to this JSON file")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed for the random catalog")
+    run_parser.add_argument(
+        "--keep", action="store_true", help="don't drop the bench database afterwards")
+    for option, default in DEFAULT_CONFIG.items():
+        run_parser.add_argument("--" + option.replace("_", "-"), type=int, default=default)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two results files, failing on regressions")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="fail if a step's median is more than this times slower")
+
+    args = argument_parser.parse_args()
+    if args.command == "compare":
+        if not compare(args.old, args.new, args.threshold):
+            sys.exit(1)
+        return
+
+    config = {option: getattr(args, option) for option in DEFAULT_CONFIG}
+    config.update({"size": args.size, "tables": SIZES[args.size], "seed": args.seed})
+    results = run_benchmark(config, args.keep)
+    if args.output:
+        with open(args.output, "w") as output_f:
+            json.dump(results, output_f, indent=4)
+        print("Wrote %s" % args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Times `se --help`, which shouldn't import psycopg2, read config or touch the network.
+Runs with the PG* variables removed, so any accidental connection attempt fails loudly.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+SE_PATH = os.path.join(THIS_DIR, "se")
+DEFAULT_RUNS = 20
+DEFAULT_LIMIT_MS = 50
+
+
+def time_run(command, env):
+    """Wall time of one run in ms. Raises if the command fails."""
+    start_time = time.perf_counter()
+    subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - start_time) * 1000
+
+
+def main():
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument(
+        "--runs", type=int, default=DEFAULT_RUNS, help="number of timed runs")
+    argument_parser.add_argument(
+        "--limit-ms",
+        type=float,
+        default=DEFAULT_LIMIT_MS,
+        help="exit non-zero if the median run is slower than this")
+    args = argument_parser.parse_args()
+
+    env = {key: val for key, val in os.environ.items() if not key.startswith("PG")}
+    command = [sys.executable, SE_PATH, "--help"]
+
+    # Warm up the OS file cache and .pyc files
+    time_run(command, env)
+    baseline = [time_run([sys.executable, "-c", "pass"], env) for _ in range(args.runs)]
+    timings = [time_run(command, env) for _ in range(args.runs)]
+
+    median = statistics.median(timings)
+    print("se --help over %i runs: min %.1fms, median %.1fms (bare interpreter: %.1fms)" % (
+        args.runs, min(timings), median, statistics.median(baseline)))
+    if median > args.limit_ms:
+        print("Slower than the %.0fms limit" % args.limit_ms)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Optional resident process (`se daemon`) that keeps the database connection and the local cache
+open, and runs read-only commands for `se` over a Unix socket.
+
+The protocol is one JSON line each way: the client sends {"argv": [...]}, and gets back
+{"stdout": ..., "stderr": ..., "exit_code": ...}.
+
+Requests are handled one at a time, on one connection. Commands print to sys.stdout and use the
+module-level connection in util and the local cache's sqlite connection, so running two at once
+would mix their output and transactions. A client that arrives during a slow request (say an
+`se find` without a local cache) waits its turn; `se --direct` skips the queue.
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import socket
+import sys
+import time
+import traceback
+
+import util
+
+# How long a client waits to connect before falling back to running the command itself
+CONNECT_TIMEOUT = 0.5
+
+
+def get_socket_path():
+    """
+    One daemon per server, database, user and docs schema. The key is hashed to stay under
+    the length limit for socket paths.
+    """
+    daemon_key = "%s_%s_%s_%s" % (
+        os.environ.get("PGHOST"), os.environ.get("PGDATABASE"), os.environ.get("PGUSER"),
+        util.USER_CONFIG["schema"])
+    return os.path.join(
+        util.TEMP_DIR, "se_%s.sock" % hashlib.md5(daemon_key.encode("utf-8")).hexdigest()[:12])
+
+
+def send(sock, message):
+    """Write one JSON line"""
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def receive(sock):
+    """Read one JSON line, or None if the other end hung up first"""
+    with sock.makefile("rb") as sock_f:
+        line = sock_f.readline()
+    return json.loads(line) if line else None
+
+
+def request(message):
+    """
+    Send a message to the running daemon and return its response, or None if no daemon is
+    listening
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(get_socket_path())
+        sock.settimeout(None)
+        send(sock, message)
+        return receive(sock)
+    except (FileNotFoundError, ConnectionRefusedError, socket.timeout):
+        return None
+    finally:
+        sock.close()
+
+
+def run_captured(handler, argv):
+    """
+    Run one command in-process, capturing what it prints. Returns the response message.
+    """
+    import local_cache # pylint: disable=import-outside-toplevel
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    exit_code = 0
+    local_cache.USE_CACHE = True
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            # Catch up with changes made since the last request (at most every cache_max_age)
+            if local_cache.is_enabled():
+                local_cache.get_connection()
+                local_cache.refresh()
+            handler(argv)
+        except SystemExit as e:
+            # Same as the interpreter: None is success, anything else that isn't an int is a
+            # message for stderr
+            if e.code is None:
+                exit_code = 0
+            elif isinstance(e.code, int):
+                exit_code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                exit_code = 1
+            # The command may have exited mid-transaction. Start clean next time.
+            util.reset_connection()
+        except Exception: # pylint: disable=broad-except
+            traceback.print_exc()
+            exit_code = 1
+            # The connection may be mid-transaction or gone. Start clean next time.
+            util.reset_connection()
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "exit_code": exit_code}
+
+
+def listen(socket_path):
+    """
+    Bind the socket, clearing out a stale one left by a daemon that died. Only the current
+    user can connect, since commands run with this process's database credentials.
+    """
+    if os.path.exists(socket_path):
+        if request({"ping": True}) is not None:
+            sys.exit("A daemon is already running on %s" % socket_path)
+        os.remove(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    return server
+
+
+def serve(handler):
+    """
+    Serve requests until stopped. `handler` takes the argv of an `se` command and runs it.
+    Requests are served in turn, see the module docstring for why.
+    """
+    socket_path = get_socket_path()
+    util.make_temp_dir()
+    server = listen(socket_path)
+
+    # Warm up everything a request would otherwise pay for
+    util.USE_PAGER = False
+    if util.USER_CONFIG["local_cache"]:
+        import local_cache # pylint: disable=import-outside-toplevel
+        local_cache.get_connection()
+    else:
+        util.cursor.execute("SELECT 1")
+        util.db_conn.commit()
+    print("Listening on %s" % socket_path)
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                message = receive(conn)
+                if message is None:
+                    continue
+                if message.get("stop"):
+                    send(conn, {"stopped": True})
+                    break
+                if message.get("ping"):
+                    send(conn, {"pong": True})
+                    continue
+                start_time = time.time()
+                response = run_captured(handler, message["argv"])
+                try:
+                    send(conn, response)
+                except BrokenPipeError:
+                    pass
+                print("%.1fms: se %s" % ((time.time() - start_time) * 1000,
+                                         " ".join(message["argv"])))
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+
+def stop():
+    """Ask the running daemon to exit"""
+    if request({"stop": True}) is None:
+        print("No daemon running")
+    else:
+        print("Stopped")
@@ -3,20 +3,32 @@ Functions for walking the user through an editor-driven documentation flow
 and then making the updates.
 """
 
+import json
 import os
-import subprocess
+import re
 
+import psycopg2.extras
+
+import local_cache
 import util
 
-UNEDITABLE_FIELDS = ("id", "table_schema", "table_name", "column_name", "data_type", "orphaned")
+UNEDITABLE_FIELDS = (
+    "id", "table_schema", "table_name", "column_name", "data_type", "orphaned", "updated_at")
 EDIT_FILE_PATH = os.path.join(util.THIS_DIR, "temp_files/col_edit_file.tmp")
+BATCH_EDIT_FILE_PATH = os.path.join(util.THIS_DIR, "temp_files/table_cols_edit_file.tmp")
+# Starts each column's section in the batch file
+BATCH_SECTION_PATTERN = r"^#### column (.+?) \(.*\)$"
+BATCH_HEADER = """\
+# Edit the fields under each column, save and quit. Only changed fields are written.
+# Lines starting with # are ignored. Leave a field blank to clear it.
+"""
 
 
 def try_edit_update(row_id, file_path):
     """
     Start editor for inputting docs, validate, and possibly update in DB
     """
-    subprocess.call([os.environ.get("EDITOR", "vim"), file_path])
+    util.open_editor(file_path)
     update_data = util.parse_editable_file(file_path)
     util.update_db_from_dict(row_id, update_data, table="columns")
 
@@ -26,3 +38,112 @@ def doc_col(name):
     Delegate to edit_loop
     """
     util.edit_loop(name, UNEDITABLE_FIELDS, try_edit_update, EDIT_FILE_PATH)
+
+
+def write_batch_file(rows, file_path):
+    """
+    Write the editable fields of every column in rows into one file, a section per column
+    """
+    with open(file_path, "w") as edit_f:
+        edit_f.write(BATCH_HEADER)
+        for row in rows:
+            edit_f.write("\n#### column %s (%s)\n" % (row["column_name"], row["data_type"]))
+            for field, value in row.items():
+                if field not in UNEDITABLE_FIELDS:
+                    edit_f.write("___%s: %s\n" % (field, "" if value is None else value))
+
+
+def parse_batch_file(file_path):
+    """
+    Get {column_name: {field: value}} back out of a batch file
+    """
+    with open(file_path) as edit_f:
+        sections = re.split(BATCH_SECTION_PATTERN, edit_f.read(), flags=re.MULTILINE)
+    # re.split gives [header, name, body, name, body, ...]
+    return {
+        column_name: util.parse_editable_text(body)
+        for column_name, body in zip(sections[1::2], sections[2::2])
+    }
+
+
+def get_batch_changes(rows, edited):
+    """
+    Compare edited values to the original rows. Returns [(id, {field: new value})] for the
+    columns that changed, with blank values as None.
+    """
+    rows_by_name = {row["column_name"]: row for row in rows}
+    unknown_cols = set(edited) - set(rows_by_name)
+    if unknown_cols:
+        raise ValueError("Unknown columns in file: %s" % ", ".join(sorted(unknown_cols)))
+
+    changes = []
+    for column_name, update_data in edited.items():
+        row = rows_by_name[column_name]
+        patch = {}
+        for field, value in update_data.items():
+            if field not in row or field in UNEDITABLE_FIELDS:
+                raise ValueError("Can't edit field %s of column %s" % (field, column_name))
+            old_value = "" if row[field] is None else str(row[field]).strip()
+            if value != old_value:
+                patch[field] = value if value.strip() else None
+        if patch:
+            changes.append((row["id"], patch))
+    return changes
+
+
+def apply_batch_changes(changes, editable_fields):
+    """
+    Write every column's changed fields in one UPDATE. Fields missing from a column's patch
+    keep their current values, via jsonb_populate_record on the existing row.
+    """
+    field_list = ", ".join(editable_fields)
+    psycopg2.extras.execute_values(util.cursor, f"""
+        UPDATE columns c
+        SET ({field_list}) = (
+            SELECT {field_list} FROM jsonb_populate_record(c, v.patch)
+        )
+        FROM (VALUES %s) AS v (id, patch)
+        WHERE c.id = v.id
+    """, [(row_id, json.dumps(patch)) for row_id, patch in changes],
+        template="(%s, %s::jsonb)", page_size=len(changes))
+    util.db_conn.commit()
+    for row_id, _ in changes:
+        local_cache.invalidate("columns", row_id)
+
+
+def doc_table_cols(name):
+    """
+    Document every column of a table in one editor session, then save all changes at once
+    """
+    table_row, object_type = util.get_record_from_name(name)
+    if object_type != "table":
+        raise ValueError("%s is a column, not a table" % name)
+    # The name may have been resolved from the local cache, but edit the latest values
+    rows = util.fetch_all("""
+        SELECT * FROM columns
+        WHERE table_schema = %s AND table_name = %s
+        ORDER BY column_name
+    """, (table_row["table_schema"], table_row["table_name"]))
+    util.db_conn.commit()
+    if not rows:
+        print("No columns found for %s" % name)
+        return
+    editable_fields = [field for field in rows[0].keys() if field not in UNEDITABLE_FIELDS]
+
+    util.make_temp_dir()
+    write_batch_file(rows, BATCH_EDIT_FILE_PATH)
+    while True:
+        util.open_editor(BATCH_EDIT_FILE_PATH)
+        try:
+            changes = get_batch_changes(rows, parse_batch_file(BATCH_EDIT_FILE_PATH))
+            if changes:
+                apply_batch_changes(changes, editable_fields)
+            print("Updated %i of %i columns" % (len(changes), len(rows)))
+            break
+        except Exception as e: # pylint: disable=broad-except
+            print("oops, hit a problem:")
+            util.db_conn.rollback()
+            print(str(e))
+            user_response = input("Try again? (y/n)")
+            if user_response == "n":
+                break
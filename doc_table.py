@@ -5,13 +5,12 @@ and then making the updates.
 
 import datetime
 import os
-import subprocess
 
 import util
 
 UNEDITABLE_FIELDS = (
     "id", "table_schema", "table_name", "last_approval_at", "orphaned", "rows_count",
-    "rows_count_as_of")
+    "rows_count_as_of", "rows_counted_at", "updated_at")
 EDIT_FILE_PATH = os.path.join(util.THIS_DIR, "temp_files/table_edit_file.tmp")
 UPDATE_FREQUENCIES = ("hourly", "sub-hourly", "daily", "weekly", "ad-hoc", "never-again")
 
@@ -20,7 +19,7 @@ def try_edit_update(row_id, file_path):
     """
     Start editor for inputting docs, validate, and possibly update in DB
     """
-    subprocess.call([os.environ.get("EDITOR", "vim"), file_path])
+    util.open_editor(file_path)
     update_data = util.parse_editable_file(file_path)
 
     if str(update_data["docs_approved"]).lower() in ["true", "yes"]:
@@ -0,0 +1,289 @@
+"""
+Move documentation between docs schemas (staging to prod, or into a new SE_SCHEMA) with COPY.
+
+An export file is gzipped text: a header line, then for each of tables and columns a line naming
+its fields, the rows in COPY's text format, and an end marker. Import COPYs each section into a
+temp staging table, then upserts it into the docs table with one INSERT ... ON CONFLICT, keyed on
+schema, table (and column) name, and reports where existing docs were different.
+"""
+
+import gzip
+import json
+import sys
+import time
+
+import local_cache
+import util
+
+FILE_FORMAT = "se-docs"
+FILE_FORMAT_VERSION = 1
+# COPY's text format escapes backslashes, so no data line can be just this
+END_MARKER = b"\\.\n"
+# gzip's fastest levels shrink COPY text nearly as well as its slowest
+COMPRESS_LEVEL = 3
+KEY_FIELDS = {
+    "tables": ("table_schema", "table_name"),
+    "columns": ("table_schema", "table_name", "column_name"),
+}
+# Not exported: ids are per instance, and these describe an instance's own upstream data
+SKIPPED_FIELDS = (
+    "id", "inserted_at", "updated_at", "orphaned", "rows_count", "rows_count_as_of",
+    "rows_counted_at")
+# Set when a row is inserted, but left alone on existing rows, where refresh keeps them right
+INSERT_ONLY_FIELDS = ("data_type",)
+# How many conflicts to list per table. They're all counted.
+CONFLICT_PRINT_LIMIT = 20
+
+
+class SectionReader:
+    """
+    File-like view of one section of an export file, stopping at its end marker, for
+    copy_expert to read a COPY's worth of rows from
+    """
+    def __init__(self, export_f):
+        self.export_f = export_f
+        self.done = False
+
+    def read(self, size=-1):
+        chunks = []
+        length = 0
+        while not self.done and (size < 0 or length < size):
+            line = self.export_f.readline()
+            if not line:
+                raise ValueError("Export file ends in the middle of a section")
+            if line == END_MARKER:
+                self.done = True
+                break
+            chunks.append(line)
+            length += len(line)
+        return b"".join(chunks)
+
+
+def open_export_file(path, mode):
+    """Open an export file for reading ("rb") or writing ("wb"). "-" means stdin/stdout."""
+    if path == "-":
+        std_f = sys.stdout.buffer if "w" in mode else sys.stdin.buffer
+        return gzip.GzipFile(fileobj=std_f, mode=mode, compresslevel=COMPRESS_LEVEL)
+    return gzip.open(path, mode, compresslevel=COMPRESS_LEVEL)
+
+
+def get_fields(table):
+    """A docs table's field names, in order"""
+    util.cursor.execute("SELECT * FROM %s LIMIT 0" % table)
+    return [column.name for column in util.cursor.description]
+
+
+def quote_fields(fields, prefix=""):
+    """Field names as a quoted SQL list, each optionally qualified like t."field" """
+    return ", ".join('%s"%s"' % (prefix, field) for field in fields)
+
+
+def export_docs(path):
+    """
+    Write every tables and columns row to an export file, streamed straight from COPY
+    """
+    start_time = time.time()
+    with open_export_file(path, "wb") as export_f:
+        export_f.write(json.dumps({
+            "format": FILE_FORMAT,
+            "version": FILE_FORMAT_VERSION,
+            "schema": util.USER_CONFIG["schema"],
+            "exported_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }).encode("utf-8") + b"\n")
+        for table, key_fields in KEY_FIELDS.items():
+            fields = [field for field in get_fields(table) if field not in SKIPPED_FIELDS]
+            export_f.write(json.dumps({"section": table, "fields": fields}).encode("utf-8") + b"\n")
+            util.cursor.copy_expert(
+                "COPY (SELECT %s FROM %s ORDER BY %s) TO STDOUT" % (
+                    quote_fields(fields), table, quote_fields(key_fields)),
+                export_f)
+            export_f.write(END_MARKER)
+            # Messages go to stderr, since the export itself may be going to stdout
+            sys.stderr.write("Exported %i %s\n" % (util.cursor.rowcount, table))
+    util.db_conn.commit()
+    sys.stderr.write("Done in %.1fs\n" % (time.time() - start_time))
+
+
+def load_staging_table(table, fields, section_f):
+    """
+    COPY a section into a temp table shaped like the docs table (minus its constraints), which
+    is dropped at commit. Fields this docs schema doesn't have are loaded as text and ignored.
+    Returns the staging table's name, the fields that can be imported, and the number of rows.
+    """
+    staging_table = "se_import_" + table
+    table_fields = get_fields(table)
+    known_fields = [field for field in fields if field in table_fields]
+    unknown_fields = [field for field in fields if field not in table_fields]
+    missing_keys = [field for field in KEY_FIELDS[table] if field not in known_fields]
+    if missing_keys:
+        raise ValueError("The %s section is missing key fields %s" % (table, missing_keys))
+    if unknown_fields:
+        sys.stderr.write("Warning: ignoring %s fields that aren't in this docs schema: %s\n" % (
+            table, ", ".join(unknown_fields)))
+
+    util.cursor.execute("CREATE TEMP TABLE %s ON COMMIT DROP AS SELECT %s FROM %s LIMIT 0" % (
+        staging_table, quote_fields(known_fields), table))
+    for field in unknown_fields:
+        util.cursor.execute('ALTER TABLE %s ADD COLUMN "%s" TEXT' % (staging_table, field))
+    util.cursor.copy_expert(
+        "COPY %s (%s) FROM STDIN" % (staging_table, quote_fields(fields)), section_f)
+    num_rows = util.cursor.rowcount
+    # Temp tables are never analyzed automatically
+    util.cursor.execute("ANALYZE %s" % staging_table)
+    return staging_table, known_fields, num_rows
+
+
+def get_conflicts(table, staging_table, doc_fields):
+    """
+    Compare staged rows with the docs already here. A conflict is a field where both have a
+    value and they differ; a clear is a field this docs schema has a value for, but the file
+    has NULL. Returns (number of rows with conflicts, number of rows with clears, the first
+    CONFLICT_PRINT_LIMIT of either as (name, conflicting fields, clearing fields)).
+    """
+    key_fields = KEY_FIELDS[table]
+    if not doc_fields:
+        return 0, 0, []
+
+    def get_field_checks(condition):
+        return ", ".join(
+            "CASE WHEN %s THEN '%s' END" % (condition.format(field=field), field)
+            for field in doc_fields)
+
+    util.cursor.execute("""
+        SELECT
+        *,
+        count(1) FILTER (WHERE conflicting_fields <> '{}') OVER () AS num_conflicts,
+        count(1) FILTER (WHERE clearing_fields <> '{}') OVER () AS num_clears
+        FROM (
+            SELECT
+            %s,
+            array_remove(ARRAY[%s], NULL) AS conflicting_fields,
+            array_remove(ARRAY[%s], NULL) AS clearing_fields
+            FROM %s s
+            JOIN %s t USING (%s)
+        ) c
+        WHERE conflicting_fields <> '{}' OR clearing_fields <> '{}'
+        ORDER BY %s
+        LIMIT %i
+    """ % (
+        quote_fields(key_fields, "s."),
+        get_field_checks('t."{field}" IS NOT NULL AND s."{field}" IS NOT NULL '
+                         'AND t."{field}" IS DISTINCT FROM s."{field}"'),
+        get_field_checks('t."{field}" IS NOT NULL AND s."{field}" IS NULL'),
+        staging_table, table, quote_fields(key_fields),
+        quote_fields(key_fields), CONFLICT_PRINT_LIMIT))
+    rows = util.cursor.fetchall()
+    differences = [
+        (".".join(row[field] for field in key_fields), row["conflicting_fields"],
+         row["clearing_fields"])
+        for row in rows]
+    if not rows:
+        return 0, 0, []
+    return rows[0]["num_conflicts"], rows[0]["num_clears"], differences
+
+
+def merge_staging_table(table, staging_table, fields, doc_fields, keep_existing, clear_missing):
+    """
+    Upsert the staged rows into the docs table in one statement. On existing rows, imported
+    values replace the current ones, but a NULL in the file means "no value", not "erase",
+    unless clear_missing. With keep_existing, imported values only fill in NULLs. Rows that
+    wouldn't change aren't written. Returns (number inserted, number updated).
+    """
+    key_fields = KEY_FIELDS[table]
+    if doc_fields:
+        if keep_existing:
+            value_template = 'coalesce(t."{field}", excluded."{field}")'
+        elif clear_missing:
+            value_template = 'excluded."{field}"'
+        else:
+            value_template = 'coalesce(excluded."{field}", t."{field}")'
+        new_values = [value_template.format(field=field) for field in doc_fields]
+        on_conflict = "DO UPDATE SET %s WHERE ROW(%s) IS DISTINCT FROM ROW(%s)" % (
+            ", ".join('"%s" = %s' % pair for pair in zip(doc_fields, new_values)),
+            quote_fields(doc_fields, "t."),
+            ", ".join(new_values))
+    else:
+        on_conflict = "DO NOTHING"
+    util.cursor.execute("""
+        WITH merged AS (
+            INSERT INTO %s AS t (%s)
+            SELECT DISTINCT ON (%s) %s
+            FROM %s
+            ORDER BY %s
+            ON CONFLICT (%s) %s
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT
+        count(1) FILTER (WHERE inserted) AS num_inserted,
+        count(1) FILTER (WHERE NOT inserted) AS num_updated
+        FROM merged
+    """ % (
+        table, quote_fields(fields),
+        quote_fields(key_fields), quote_fields(fields),
+        staging_table,
+        quote_fields(key_fields),
+        quote_fields(key_fields), on_conflict))
+    row = util.cursor.fetchone()
+    return row["num_inserted"], row["num_updated"]
+
+
+def import_docs(path, keep_existing=False, dry_run=False, clear_missing=False):
+    """
+    Upsert the tables and columns rows in an export file, all in one transaction, and report
+    conflicts with the docs already here. With dry_run, report and roll back.
+    """
+    if keep_existing and clear_missing:
+        raise ValueError("keep_existing and clear_missing can't be used together")
+    start_time = time.time()
+    with open_export_file(path, "rb") as export_f:
+        header = json.loads(export_f.readline() or "{}")
+        if header.get("format") != FILE_FORMAT:
+            raise ValueError("%s isn't an se export file" % path)
+        if header.get("version", 0) > FILE_FORMAT_VERSION:
+            raise ValueError("%s is from a newer se (format version %s)" % (
+                path, header["version"]))
+        print("Importing docs exported from schema %s at %s" % (
+            header["schema"], header["exported_at"]))
+
+        while True:
+            section_line = export_f.readline()
+            if not section_line:
+                break
+            section = json.loads(section_line)
+            table = section["section"]
+            if table not in KEY_FIELDS:
+                raise ValueError("Unknown section %s in %s" % (table, path))
+
+            staging_table, fields, num_rows = load_staging_table(
+                table, section["fields"], SectionReader(export_f))
+            doc_fields = [
+                field for field in fields
+                if field not in KEY_FIELDS[table] and field not in INSERT_ONLY_FIELDS]
+            num_conflicts, num_clears, differences = get_conflicts(
+                table, staging_table, doc_fields)
+            num_inserted, num_updated = merge_staging_table(
+                table, staging_table, fields, doc_fields, keep_existing, clear_missing)
+
+            print("%s: %i in file, %i inserted, %i updated, %i unchanged" % (
+                table, num_rows, num_inserted, num_updated,
+                num_rows - num_inserted - num_updated))
+            if num_conflicts:
+                print("    %i rows with conflicting values (%s)" % (
+                    num_conflicts, "existing kept" if keep_existing else "imported won"))
+            if num_clears:
+                print("    %i rows with values that are NULL in the file (%s)" % (
+                    num_clears, "cleared" if clear_missing else "existing kept"))
+            for name, conflicting_fields, clearing_fields in differences:
+                print("    %s: %s" % (name, ", ".join(
+                    ["%s differs" % field for field in conflicting_fields]
+                    + ["%s is NULL in file" % field for field in clearing_fields])))
+            if max(num_conflicts, num_clears) > len(differences):
+                print("    ...")
+
+    if dry_run:
+        util.db_conn.rollback()
+        print("Dry run, nothing was changed")
+        return
+    util.db_conn.commit()
+    local_cache.mark_stale()
+    print("Done in %.1fs" % (time.time() - start_time))
@@ -5,6 +5,8 @@ i.e. columns that no longer exist upstream as we last knew them
 
 import sys
 
+import psycopg2.extras
+
 import util
 
 
@@ -61,3 +63,68 @@ def handle_orphaned_column():
                 orphaned_row["column_name"]))
 
         util.db_conn.commit()
+
+
+def merge_renamed_columns(renames, commit=True):
+    """
+    Apply many column renames in one transaction. `renames` is a list of
+    (table_schema, table_name, old_column_name, new_column_name).
+    If the new column already has a row from a refresh, the orphaned column's docs fill in
+    whatever it doesn't have yet, and the orphaned row is deleted. Otherwise the orphaned row
+    is just renamed, and stays orphaned unless the new column exists upstream.
+    """
+    util.cursor.execute("""
+        CREATE TEMP TABLE column_renames (
+            table_schema TEXT, table_name TEXT, old_column TEXT, new_column TEXT
+        ) ON COMMIT DROP
+    """)
+    psycopg2.extras.execute_values(
+        util.cursor, "INSERT INTO column_renames VALUES %s", [tuple(r) for r in renames])
+
+    util.cursor.execute("""
+        UPDATE columns o
+        SET
+        column_name = r.new_column,
+        orphaned = NOT EXISTS (
+            SELECT * FROM pg_attribute a
+            JOIN pg_class c ON c.oid = a.attrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = r.table_schema
+            AND c.relname = r.table_name
+            AND a.attname = r.new_column
+            AND a.attnum > 0
+            AND NOT a.attisdropped)
+        FROM column_renames r
+        WHERE o.table_schema = r.table_schema
+        AND o.table_name = r.table_name
+        AND o.column_name = r.old_column
+        AND NOT EXISTS (
+            SELECT * FROM columns n
+            WHERE n.table_schema = r.table_schema
+            AND n.table_name = r.table_name
+            AND n.column_name = r.new_column)
+    """)
+    util.cursor.execute("""
+        UPDATE columns n
+        SET
+        description = coalesce(n.description, o.description),
+        example_vals = coalesce(n.example_vals, o.example_vals),
+        also_goes_by = coalesce(n.also_goes_by, o.also_goes_by)
+        FROM column_renames r
+        JOIN columns o
+        ON o.table_schema = r.table_schema
+        AND o.table_name = r.table_name
+        AND o.column_name = r.old_column
+        WHERE n.table_schema = r.table_schema
+        AND n.table_name = r.table_name
+        AND n.column_name = r.new_column
+    """)
+    util.cursor.execute("""
+        DELETE FROM columns o
+        USING column_renames r
+        WHERE o.table_schema = r.table_schema
+        AND o.table_name = r.table_name
+        AND o.column_name = r.old_column
+    """)
+    if commit:
+        util.db_conn.commit()
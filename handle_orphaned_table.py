@@ -5,6 +5,9 @@ i.e. tables that no longer exist upstream as we last knew them.
 
 import sys
 
+import psycopg2.extras
+
+import rename_matcher
 import util
 
 
@@ -66,3 +69,145 @@ def handle_orphaned_table():
         """, (orphaned_row["table_name"], orphaned_row["table_schema"]))
 
         util.db_conn.commit()
+
+
+def merge_renamed_tables(renames, commit=True):
+    """
+    Apply many table renames in one transaction. `renames` is a list of
+    ((old_schema, old_table), (new_schema, new_table)).
+    If the new table already has rows from a refresh, docs from the orphaned table (and its
+    columns, matched by column name) fill in whatever the new rows don't have yet, then the
+    orphaned rows are deleted. Columns with no match are moved to the new table, still orphaned,
+    so their docs are kept for resolving later. Otherwise the orphaned rows are just renamed.
+    Either way, rows only stop being orphaned if the new table (or column) exists upstream, so a
+    mistyped target stays visible as an orphan.
+    """
+    util.cursor.execute("""
+        CREATE TEMP TABLE renames (
+            old_schema TEXT, old_table TEXT, new_schema TEXT, new_table TEXT
+        ) ON COMMIT DROP
+    """)
+    psycopg2.extras.execute_values(
+        util.cursor,
+        "INSERT INTO renames VALUES %s",
+        [old_key + new_key for old_key, new_key in renames])
+
+    # Columns first, while the new table name still doesn't exist in tables
+    util.cursor.execute("""
+        UPDATE columns o
+        SET
+        table_schema = r.new_schema,
+        table_name = r.new_table,
+        orphaned = NOT EXISTS (
+            SELECT * FROM pg_attribute a
+            JOIN pg_class c ON c.oid = a.attrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = r.new_schema
+            AND c.relname = r.new_table
+            AND a.attname = o.column_name
+            AND a.attnum > 0
+            AND NOT a.attisdropped)
+        FROM renames r
+        WHERE o.table_schema = r.old_schema AND o.table_name = r.old_table
+        AND NOT EXISTS (
+            SELECT * FROM tables n
+            WHERE n.table_schema = r.new_schema AND n.table_name = r.new_table)
+    """)
+    util.cursor.execute("""
+        UPDATE tables o
+        SET
+        table_schema = r.new_schema,
+        table_name = r.new_table,
+        orphaned = NOT EXISTS (
+            SELECT * FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = r.new_schema
+            AND c.relname = r.new_table
+            AND c.relkind IN ('r', 'v', 'f', 'p'))
+        FROM renames r
+        WHERE o.table_schema = r.old_schema AND o.table_name = r.old_table
+        AND NOT EXISTS (
+            SELECT * FROM tables n
+            WHERE n.table_schema = r.new_schema AND n.table_name = r.new_table)
+    """)
+
+    util.cursor.execute("""
+        UPDATE tables n
+        SET
+        description = coalesce(n.description, o.description),
+        common_joins = coalesce(n.common_joins, o.common_joins),
+        intended_update_frequency = coalesce(
+            n.intended_update_frequency, o.intended_update_frequency),
+        deprecated = coalesce(n.deprecated, o.deprecated),
+        docs_approved = coalesce(n.docs_approved, False) OR coalesce(o.docs_approved, False),
+        last_approval_at = coalesce(n.last_approval_at, o.last_approval_at)
+        FROM renames r
+        JOIN tables o ON o.table_schema = r.old_schema AND o.table_name = r.old_table
+        WHERE n.table_schema = r.new_schema AND n.table_name = r.new_table
+    """)
+    util.cursor.execute("""
+        UPDATE columns n
+        SET
+        description = coalesce(n.description, o.description),
+        example_vals = coalesce(n.example_vals, o.example_vals),
+        also_goes_by = coalesce(n.also_goes_by, o.also_goes_by)
+        FROM renames r
+        JOIN columns o ON o.table_schema = r.old_schema AND o.table_name = r.old_table
+        WHERE n.table_schema = r.new_schema
+        AND n.table_name = r.new_table
+        AND n.column_name = o.column_name
+    """)
+    util.cursor.execute("""
+        UPDATE columns o
+        SET table_schema = r.new_schema, table_name = r.new_table, orphaned = True
+        FROM renames r
+        WHERE o.table_schema = r.old_schema AND o.table_name = r.old_table
+        AND NOT EXISTS (
+            SELECT * FROM columns n
+            WHERE n.table_schema = r.new_schema
+            AND n.table_name = r.new_table
+            AND n.column_name = o.column_name)
+    """)
+    util.cursor.execute("""
+        DELETE FROM columns c
+        USING renames r
+        WHERE c.table_schema = r.old_schema AND c.table_name = r.old_table
+    """)
+    util.cursor.execute("""
+        DELETE FROM tables t
+        USING renames r
+        WHERE t.table_schema = r.old_schema AND t.table_name = r.old_table
+    """)
+    if commit:
+        util.db_conn.commit()
+
+
+def auto_resolve(min_confidence=0.5, assume_yes=False):
+    """
+    Propose renames for all orphaned tables at once, let the user accept them, and apply the
+    accepted ones in one transaction.
+    """
+    proposals = rename_matcher.propose_renames(min_confidence)
+    if not proposals:
+        print("No likely renames found for orphaned tables")
+        return
+
+    accepted = []
+    for confidence, old_key, new_key in proposals:
+        print("%.2f  %s.%s -> %s.%s" % ((confidence,) + old_key + new_key))
+        if assume_yes:
+            accepted.append((old_key, new_key))
+            continue
+        user_response = input("Accept this rename? (y=yes, n=no, a=yes to all, q=quit)")
+        if user_response == "q":
+            break
+        if user_response == "a":
+            assume_yes = True
+        if user_response in ("y", "a"):
+            accepted.append((old_key, new_key))
+
+    if not accepted:
+        print("No renames accepted")
+        return
+    merge_renamed_tables(accepted)
+    print("%i renames applied" % len(accepted))
@@ -0,0 +1,202 @@
+"""
+Export every table's summary (as `se describe` shows it) to static HTML pages, with an index
+page and a search.json for finding tables and columns.
+
+A manifest of content hashes is kept in the output directory, so later runs only rewrite the
+pages whose table or column rows have changed.
+"""
+
+import hashlib
+import html
+import itertools
+import json
+import os
+import re
+import urllib.parse
+
+import local_cache
+import table_summary
+import util
+
+MANIFEST_FILE_NAME = "manifest.json"
+# Bump when page layout changes, so every page is regenerated once
+RENDER_VERSION = 1
+# How `se describe` highlights column names
+COLUMN_NAME_PATTERN = r"\033\[1;4m(.*?)\033\[0m"
+
+PAGE_TEMPLATE = """\
+<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<p><a href="index.html">All tables</a></p>
+<pre>
+{body}
+</pre>
+</body>
+</html>
+"""
+
+INDEX_TEMPLATE = """\
+<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Schema docs</title></head>
+<body>
+<p><input id="search" placeholder="Search tables and columns" size="50"></p>
+<ul id="results"></ul>
+{body}
+<script>
+// Needs the pages to be served over HTTP, since browsers don't fetch() from file://
+fetch("search.json").then(response => response.json()).then(entries => {{
+    const search = document.getElementById("search");
+    const results = document.getElementById("results");
+    search.addEventListener("input", () => {{
+        const words = search.value.toLowerCase().split(/\\s+/).filter(word => word);
+        results.innerHTML = "";
+        if (!words.length) return;
+        entries.filter(entry => {{
+            const text = (entry.name + " " + entry.columns.join(" ") + " "
+                + (entry.description || "")).toLowerCase();
+            return words.every(word => text.includes(word));
+        }}).slice(0, 100).forEach(entry => {{
+            const link = document.createElement("a");
+            link.href = entry.page;
+            link.textContent = entry.name;
+            const item = document.createElement("li");
+            item.appendChild(link);
+            results.appendChild(item);
+        }});
+    }});
+}});
+</script>
+</body>
+</html>
+"""
+
+
+def get_page_name(table_schema, table_name):
+    """File name for a table's page, safe whatever characters the names contain"""
+    return urllib.parse.quote("%s.%s" % (table_schema, table_name), safe="") + ".html"
+
+
+def get_rows_hash(table_row, column_rows):
+    """Content hash of everything a table's page is rendered from"""
+    content = json.dumps(
+        [RENDER_VERSION, table_row, column_rows], sort_keys=True, default=str)
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
+def render_page(table_row, column_rows):
+    """A table's summary as an HTML page"""
+    lines = table_summary.iter_summary_lines(table_row, column_rows)
+    body = "\n".join(
+        re.sub(COLUMN_NAME_PATTERN, r"<b><u>\1</u></b>", html.escape(line)) for line in lines)
+    title = html.escape("%s.%s" % (table_row["table_schema"], table_row["table_name"]))
+    return PAGE_TEMPLATE.format(title=title, body=body)
+
+
+def render_index(entries):
+    """The index page: every table, by schema, with the start of its description"""
+    body = []
+    for table_schema, schema_entries in itertools.groupby(entries, lambda entry: entry["schema"]):
+        body.append("<h2>%s</h2>" % html.escape(table_schema))
+        body.append("<ul>")
+        for entry in schema_entries:
+            description = (entry["description"] or "").split("\n")[0][:100]
+            body.append('<li><a href="%s">%s</a> %s</li>' % (
+                html.escape(entry["page"]), html.escape(entry["table"]), html.escape(description)))
+        body.append("</ul>")
+    return INDEX_TEMPLATE.format(body="\n".join(body))
+
+
+def iter_tables_with_columns():
+    """
+    Yields (table row, [column rows]) for every non-orphaned table, from one query over tables
+    and one over columns, both sorted the same way and walked together. Columns are streamed,
+    since there are many more of them.
+    """
+    tables_query = """
+        SELECT * FROM tables
+        WHERE NOT orphaned
+        ORDER BY table_schema COLLATE "C", table_name COLLATE "C"
+    """
+    columns_query = """
+        SELECT * FROM columns
+        ORDER BY table_schema COLLATE "C", table_name COLLATE "C", column_name
+    """
+    if local_cache.is_enabled():
+        # SQLite compares text bytewise, same as COLLATE "C"
+        table_rows = local_cache.fetch_all(tables_query.replace(' COLLATE "C"', ""))
+        column_rows = local_cache.query(columns_query.replace(' COLLATE "C"', ""))
+    else:
+        table_rows = util.fetch_all(tables_query)
+        column_rows = util.stream_query(columns_query, name="se_export_columns")
+
+    column_groups = itertools.groupby(
+        (dict(row) for row in column_rows), lambda row: (row["table_schema"], row["table_name"]))
+    next_group = next(column_groups, None)
+    for table_row in table_rows:
+        table_row = dict(table_row)
+        key = (table_row["table_schema"], table_row["table_name"])
+        # Skip the columns of orphaned tables
+        while next_group is not None and next_group[0] < key:
+            next_group = next(column_groups, None)
+        columns = []
+        if next_group is not None and next_group[0] == key:
+            columns = list(next_group[1])
+            next_group = next(column_groups, None)
+        yield table_row, columns
+    # Columns of orphaned tables may be left unread at the end
+    column_rows.close()
+
+
+def export_html(out_dir, force=False):
+    """
+    Write a page per table to out_dir, plus index.html and search.json. Pages whose rows haven't
+    changed since the last export are left alone, unless `force` is set. Either way, pages of
+    tables that are gone are removed.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE_NAME)
+    # Always read, even with force, since it's the only record of which pages were exported
+    old_manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_f:
+            old_manifest = json.load(manifest_f)
+
+    manifest = {}
+    entries = []
+    num_written = 0
+    for table_row, column_rows in iter_tables_with_columns():
+        page_name = get_page_name(table_row["table_schema"], table_row["table_name"])
+        rows_hash = get_rows_hash(table_row, column_rows)
+        manifest[page_name] = rows_hash
+        page_path = os.path.join(out_dir, page_name)
+        if force or old_manifest.get(page_name) != rows_hash or not os.path.exists(page_path):
+            with open(page_path, "w") as page_f:
+                page_f.write(render_page(table_row, column_rows))
+            num_written += 1
+        entries.append({
+            "name": "%s.%s" % (table_row["table_schema"], table_row["table_name"]),
+            "schema": table_row["table_schema"],
+            "table": table_row["table_name"],
+            "page": page_name,
+            "description": table_row["description"],
+            "columns": [row["column_name"] for row in column_rows],
+        })
+
+    removed_pages = set(old_manifest) - set(manifest)
+    for page_name in removed_pages:
+        page_path = os.path.join(out_dir, page_name)
+        if os.path.exists(page_path):
+            os.remove(page_path)
+
+    with open(os.path.join(out_dir, "index.html"), "w") as index_f:
+        index_f.write(render_index(entries))
+    with open(os.path.join(out_dir, "search.json"), "w") as search_f:
+        json.dump(entries, search_f)
+    with open(manifest_path, "w") as manifest_f:
+        json.dump(manifest, manifest_f, indent=0, sort_keys=True)
+
+    print("%i pages written, %i unchanged, %i removed, in %s" % (
+        num_written, len(manifest) - num_written, len(removed_pages), out_dir))
@@ -0,0 +1,290 @@
+"""
+Records every statement se sends (normalized text, duration, rowcount and where in se it came
+from), plus commits, connects and time spent in $EDITOR, for `se --profile`.
+
+Only imported when profiling or connecting, and does nothing until start() is called, so
+normal runs use plain DictCursors and pay nothing.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import psycopg2.extensions
+import psycopg2.extras
+
+# Statements run at least this many times from one place are reported as a possible N+1
+N_PLUS_ONE_THRESHOLD = 10
+# How many of the most expensive statements the summary lists
+SUMMARY_LIMIT = 15
+# Frames in these files are plumbing, the call site is the first frame outside them
+PLUMBING_FILES = (
+    os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)), "util.py"))
+PSYCOPG2_DIR = os.path.dirname(psycopg2.extensions.__file__)
+
+ENABLED = False
+
+_lock = threading.Lock()
+_records = []
+_start_time = None
+
+
+def start():
+    """Start recording, forgetting anything recorded before"""
+    global ENABLED, _start_time # pylint: disable=global-statement
+    with _lock:
+        del _records[:]
+    _start_time = time.perf_counter()
+    ENABLED = True
+
+
+def stop():
+    """Stop recording. What was recorded is kept for the summary and trace."""
+    global ENABLED # pylint: disable=global-statement
+    ENABLED = False
+
+
+def normalize(query):
+    """
+    A statement's text with literals and value lists replaced by ?, so statements that differ
+    only in their values (e.g. one per table) group together
+    """
+    if hasattr(query, "as_string"):
+        # psycopg2.sql.Composed, which needs a connection to render, so group by its parts
+        query = str(query)
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    query = re.sub(r"'(?:[^']|'')*'", "?", query)
+    query = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?\b", "?", query)
+    query = re.sub(r"(?<=[(,])(\s*)NULL\b", r"\1?", query, flags=re.IGNORECASE)
+    query = re.sub(r"\s+", " ", query).strip()
+    # (?, ?::timestamp, ?), (?, ?, ?) ... -> (...)
+    query = re.sub(r"\(\s*(?:\?(?:::\w+)?\s*,\s*)*\?(?:::\w+)?\s*\)", "(...)", query)
+    query = re.sub(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+", "(...)", query)
+    return query
+
+
+def get_call_site():
+    """Where in se the current statement came from, as file:line in function"""
+    frame = sys._getframe(1) # pylint: disable=protected-access
+    fallback = None
+    while frame is not None:
+        file_name = os.path.abspath(frame.f_code.co_filename)
+        if file_name != PLUMBING_FILES[0] and not file_name.startswith(PSYCOPG2_DIR):
+            call_site = "%s:%i in %s" % (
+                os.path.basename(file_name), frame.f_lineno, frame.f_code.co_name)
+            if file_name not in PLUMBING_FILES:
+                return call_site
+            fallback = fallback or call_site
+        frame = frame.f_back
+    return fallback
+
+
+def record(kind, text, start_time, duration, rowcount=None, call_site=None):
+    """Save one event. Times are from time.perf_counter(), in seconds."""
+    if not ENABLED:
+        return
+    with _lock:
+        _records.append({
+            "kind": kind,
+            "text": text,
+            "start": start_time - _start_time,
+            "duration": duration,
+            "rowcount": rowcount,
+            "call_site": call_site,
+            "thread": threading.get_ident(),
+        })
+
+
+@contextlib.contextmanager
+def span(kind, text):
+    """Record the time spent in a with block, e.g. waiting on the editor"""
+    if not ENABLED:
+        yield
+        return
+    call_site = get_call_site()
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, text, start_time, time.perf_counter() - start_time, call_site=call_site)
+
+
+class ProfilingCursor(psycopg2.extras.DictCursor):
+    """
+    A DictCursor that records each statement. For named (server-side) cursors, the time spent
+    fetching batches while iterating is recorded too, as one FETCH event.
+    """
+    def execute(self, query, vars=None): # pylint: disable=redefined-builtin
+        call_site = get_call_site()
+        start_time = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record(
+                "query", normalize(query), start_time, time.perf_counter() - start_time,
+                self.rowcount, call_site)
+
+    def executemany(self, query, vars_list):
+        call_site = get_call_site()
+        start_time = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record(
+                "query", normalize(query), start_time, time.perf_counter() - start_time,
+                self.rowcount, call_site)
+
+    def __iter__(self):
+        rows = super().__iter__()
+        if self.name is None:
+            # Client-side, everything was fetched by execute
+            yield from rows
+            return
+        call_site = get_call_site()
+        start_time = time.perf_counter()
+        fetch_time = 0
+        num_rows = 0
+        try:
+            while True:
+                fetch_start = time.perf_counter()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    break
+                finally:
+                    fetch_time += time.perf_counter() - fetch_start
+                num_rows += 1
+                yield row
+        finally:
+            record(
+                "query", "FETCH FROM %s" % self.name, start_time, fetch_time, num_rows, call_site)
+
+
+class ProfilingConnection(psycopg2.extensions.connection):
+    """A connection that records commits and rollbacks, which are round trips too"""
+    def commit(self):
+        call_site = get_call_site()
+        start_time = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record("commit", "COMMIT", start_time, time.perf_counter() - start_time,
+                   call_site=call_site)
+
+    def rollback(self):
+        call_site = get_call_site()
+        start_time = time.perf_counter()
+        try:
+            return super().rollback()
+        finally:
+            record("commit", "ROLLBACK", start_time, time.perf_counter() - start_time,
+                   call_site=call_site)
+
+
+def get_records():
+    """A copy of everything recorded so far"""
+    with _lock:
+        return list(_records)
+
+
+def find_n_plus_one(records):
+    """
+    Call sites that ran the same statement at least N_PLUS_ONE_THRESHOLD times, as
+    (count, total seconds, call site, statement), most first
+    """
+    groups = collections.defaultdict(lambda: [0, 0])
+    for event in records:
+        if event["kind"] == "query" and not event["text"].startswith("FETCH FROM "):
+            group = groups[(event["call_site"], event["text"])]
+            group[0] += 1
+            group[1] += event["duration"]
+    return sorted(
+        ((count, total, call_site, text)
+         for (call_site, text), (count, total) in groups.items()
+         if count >= N_PLUS_ONE_THRESHOLD),
+        reverse=True)
+
+
+def print_summary(title, out=None):
+    """
+    Where the time went: statements (server time plus round trips), commits, connecting, the
+    editor and everything else, then the most expensive statements and any N+1 patterns.
+    Goes to stderr by default, so it doesn't mix with the command's output.
+    """
+    out = out or sys.stderr
+    records = get_records()
+    wall_time = time.perf_counter() - _start_time
+    totals = collections.Counter()
+    counts = collections.Counter()
+    for event in records:
+        totals[event["kind"]] += event["duration"]
+        counts[event["kind"]] += 1
+    # Worker threads overlap, so these can add up to more than the wall time
+    other_time = max(0, wall_time - sum(totals.values()))
+
+    out.write("\nProfile: %s\n" % title)
+    out.write("  %.1fms total: %i statements %.1fms, %i commits/rollbacks %.1fms, "
+              "%i connects %.1fms, editor %.1fms, other %.1fms\n" % (
+                  wall_time * 1000,
+                  counts["query"], totals["query"] * 1000,
+                  counts["commit"], totals["commit"] * 1000,
+                  counts["connect"], totals["connect"] * 1000,
+                  totals["editor"] * 1000,
+                  other_time * 1000))
+
+    statements = collections.defaultdict(lambda: [0, 0, 0])
+    for event in records:
+        if event["kind"] == "query":
+            statement = statements[event["text"]]
+            statement[0] += 1
+            statement[1] += event["duration"]
+            statement[2] += max(event["rowcount"] or 0, 0)
+    if statements:
+        out.write("\n  %7s %10s %9s %9s  %s\n" % (
+            "count", "total ms", "mean ms", "rows", "statement"))
+        top_statements = sorted(statements.items(), key=lambda item: item[1][1], reverse=True)
+        for text, (count, total, rows) in top_statements[:SUMMARY_LIMIT]:
+            out.write("  %7i %10.1f %9.2f %9i  %s\n" % (
+                count, total * 1000, total * 1000 / count, rows, text[:100]))
+
+    for count, total, call_site, text in find_n_plus_one(records):
+        out.write("\n  Possible N+1: %i statements (%.1fms) from %s:\n    %s\n" % (
+            count, total * 1000, call_site, text[:200]))
+
+
+def write_trace(path, title):
+    """
+    Write what was recorded as a Chrome trace, for chrome://tracing or https://ui.perfetto.dev
+    """
+    records = get_records()
+    thread_numbers = {}
+    events = [{
+        "name": title, "cat": "command", "ph": "X", "ts": 0,
+        "dur": (time.perf_counter() - _start_time) * 1e6,
+        "pid": os.getpid(), "tid": 0,
+    }]
+    for event in records:
+        thread_number = thread_numbers.setdefault(event["thread"], len(thread_numbers))
+        events.append({
+            "name": event["text"][:80],
+            "cat": event["kind"],
+            "ph": "X",
+            "ts": event["start"] * 1e6,
+            "dur": event["duration"] * 1e6,
+            "pid": os.getpid(),
+            "tid": thread_number,
+            "args": {
+                "statement": event["text"],
+                "rowcount": event["rowcount"],
+                "call_site": event["call_site"],
+            },
+        })
+    with open(path, "w") as trace_f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_f)
+    sys.stderr.write("Wrote trace to %s\n" % path)
@@ -0,0 +1,354 @@
+"""
+Local SQLite copy of the tables and columns tables, so searches, describes and name lookups
+don't need a round trip to the server.
+
+The copy is brought up to date incrementally using the updated_at column (maintained by a
+trigger, see migrations/0003_updated_at.sql) at most every SE_CACHE_MAX_AGE seconds.
+Writes always go to the server, and invalidate the affected local rows.
+"""
+
+import datetime
+import difflib
+import os
+import re
+import sqlite3
+import time
+
+import util
+
+CACHED_TABLES = ("tables", "columns")
+# Rows committed a while after their updated_at was set (long transactions) could be missed by
+# a plain watermark, so every refresh looks back this far. Re-fetching a row is harmless.
+WATERMARK_OVERLAP = datetime.timedelta(minutes=10)
+# How long deleted_rows tombstones are kept (syncs prune older ones). A cache last refreshed
+# longer ago than this can't tell what was deleted since, so it's reloaded in full.
+TOMBSTONE_RETENTION = datetime.timedelta(days=7)
+# Postgres type OIDs that need converting back from SQLite's storage classes
+SQLITE_TYPES = {16: "BOOLEAN", 20: "INTEGER", 21: "INTEGER", 23: "INTEGER", 1114: "TIMESTAMP"}
+
+# What names each cached table's rows, see name_index.py
+NAME_FIELDS = {
+    "tables": ("table_schema", "table_name"),
+    "columns": ("table_schema", "table_name", "column_name"),
+}
+# Fields covered by each table's full-text index (`se find`), and how much a match in each counts
+SEARCH_FIELDS = {
+    "tables": {"table_name": 10.0, "description": 5.0},
+    "columns": {
+        "table_name": 2.0, "column_name": 10.0, "description": 5.0, "example_vals": 1.0,
+        "also_goes_by": 3.0,
+    },
+}
+# Typo'd words are swapped for indexed words at least this similar (difflib ratio)
+FUZZY_CUTOFF = 0.75
+
+# Set to False (e.g. by `se --fresh`) to skip the cache and go to the server
+USE_CACHE = True
+
+_cache_conn = None
+
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("BOOLEAN", lambda value: value == b"1")
+sqlite3.register_converter(
+    "TIMESTAMP", lambda value: datetime.datetime.fromisoformat(value.decode("utf-8")))
+
+
+def is_enabled():
+    """Whether lookups should be answered from the local cache"""
+    return USE_CACHE and util.USER_CONFIG["local_cache"]
+
+
+def get_cache_path():
+    """One cache file per server, database and docs schema"""
+    cache_key = "%s_%s_%s" % (
+        os.environ.get("PGHOST"), os.environ.get("PGDATABASE"), util.USER_CONFIG["schema"])
+    cache_key = re.sub(r"[^\w.-]", "_", cache_key)
+    return os.path.join(util.TEMP_DIR, "cache_%s.sqlite" % cache_key)
+
+
+def regexp(pattern, value):
+    """Backs SQLite's REGEXP operator, so cached searches take the same patterns as Postgres"""
+    if value is None:
+        return False
+    return re.search(pattern, value) is not None
+
+
+def get_connection():
+    """
+    Open the cache (once per process), refreshing it first if it's older than the max age
+    """
+    global _cache_conn # pylint: disable=global-statement
+    if _cache_conn is None:
+        util.make_temp_dir()
+        _cache_conn = sqlite3.connect(get_cache_path(), detect_types=sqlite3.PARSE_DECLTYPES)
+        _cache_conn.row_factory = sqlite3.Row
+        # So INSERT OR REPLACE fires the delete triggers that keep the search index in sync
+        _cache_conn.execute("PRAGMA recursive_triggers = ON")
+        _cache_conn.create_function("regexp", 2, regexp, deterministic=True)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        refresh()
+    return _cache_conn
+
+
+def get_meta(key, default=None):
+    """Read a value from the cache's bookkeeping table"""
+    row = _cache_conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else default
+
+
+def set_meta(key, value):
+    """Write a value to the cache's bookkeeping table"""
+    _cache_conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def get_local_fields(table):
+    """Column names of a cached table, or [] if it isn't cached yet"""
+    return [row["name"] for row in _cache_conn.execute('PRAGMA table_info("%s")' % table)]
+
+
+def get_server_fields(table):
+    """(name, SQLite type) for each column of a server table"""
+    util.cursor.execute("SELECT * FROM " + table + " LIMIT 0")
+    return [
+        (column.name, SQLITE_TYPES.get(column.type_code, "TEXT"))
+        for column in util.cursor.description
+    ]
+
+
+def store_rows(table, fields, rows):
+    """Insert or replace rows in a cached table. Returns the latest updated_at seen."""
+    insert_query = 'INSERT OR REPLACE INTO "%s" (%s) VALUES (%s)' % (
+        table, ", ".join('"%s"' % field for field in fields), ", ".join("?" for _ in fields))
+    latest_update = None
+    batch = []
+    for row in rows:
+        batch.append(tuple(row[field] for field in fields))
+        if "updated_at" in fields and row["updated_at"] is not None:
+            latest_update = max(latest_update or row["updated_at"], row["updated_at"])
+        if len(batch) >= 5000:
+            _cache_conn.executemany(insert_query, batch)
+            batch = []
+    _cache_conn.executemany(insert_query, batch)
+    return latest_update
+
+
+def full_load(table, server_fields):
+    """Replace a cached table with a fresh copy of the server's"""
+    _cache_conn.execute('DROP TABLE IF EXISTS "%s_fts"' % table)
+    _cache_conn.execute('DROP TABLE IF EXISTS "%s"' % table)
+    _cache_conn.execute('CREATE TABLE "%s" (%s, PRIMARY KEY (id))' % (
+        table, ", ".join('"%s" %s' % field for field in server_fields)))
+    fields = [name for name, _ in server_fields]
+    latest_update = store_rows(
+        table, fields, util.stream_query("SELECT * FROM " + table, name="se_cache_load"))
+    set_meta(table + "_watermark", latest_update.isoformat(" ") if latest_update else None)
+    util.cursor.execute(
+        "SELECT coalesce(max(deleted_at), localtimestamp) AS latest FROM deleted_rows "
+        "WHERE table_name = %s",
+        (table,))
+    set_meta(table + "_deletes_watermark", util.cursor.fetchone()["latest"].isoformat(" "))
+    set_meta("names_version", str(time.time()))
+
+
+def incremental_load(table, watermark, deletes_watermark, pruned_before):
+    """
+    Pull rows changed since the watermark, and drop rows deleted on the server since the
+    deletes watermark (from the deleted_rows tombstones). Returns False if the table was
+    truncated on the server, or tombstones the cache needs may have been pruned (anything
+    before pruned_before), so needs a full load instead.
+    """
+    if datetime.datetime.fromisoformat(deletes_watermark) - WATERMARK_OVERLAP < pruned_before:
+        return False
+    util.cursor.execute(
+        "SELECT row_id, deleted_at FROM deleted_rows WHERE table_name = %s AND deleted_at > %s",
+        (table, datetime.datetime.fromisoformat(deletes_watermark) - WATERMARK_OVERLAP))
+    deleted_rows = util.cursor.fetchall()
+    if any(row["row_id"] is None for row in deleted_rows):
+        return False
+
+    fields = get_local_fields(table)
+    util.cursor.execute(
+        "SELECT * FROM " + table + " WHERE updated_at > %s",
+        (datetime.datetime.fromisoformat(watermark) - WATERMARK_OVERLAP,))
+    changed_rows = util.cursor.fetchall()
+    renamed = names_changed(table, changed_rows)
+    latest_update = store_rows(table, fields, changed_rows)
+    if latest_update:
+        set_meta(table + "_watermark", latest_update.isoformat(" "))
+
+    # Deleting ids that are already gone (or were re-read within the overlap) is harmless
+    num_deleted = 0
+    for row in deleted_rows:
+        num_deleted += _cache_conn.execute(
+            'DELETE FROM "%s" WHERE id = ?' % table, (row["row_id"],)).rowcount
+    if deleted_rows:
+        latest_delete = max(row["deleted_at"] for row in deleted_rows)
+        if latest_delete > datetime.datetime.fromisoformat(deletes_watermark):
+            set_meta(table + "_deletes_watermark", latest_delete.isoformat(" "))
+    if renamed or num_deleted:
+        set_meta("names_version", str(time.time()))
+    return True
+
+
+def names_changed(table, rows):
+    """Whether any of the rows are new to the cache, or have been renamed since cached"""
+    name_fields = NAME_FIELDS[table]
+    select_query = 'SELECT %s FROM "%s" WHERE id = ?' % (", ".join(name_fields), table)
+    for row in rows:
+        cached_row = _cache_conn.execute(select_query, (row["id"],)).fetchone()
+        if cached_row is None or tuple(cached_row) != tuple(row[field] for field in name_fields):
+            return True
+    return False
+
+
+def refresh(force=False):
+    """
+    Bring the cache up to date with the server, unless it was checked within the max age.
+    Tables are reloaded in full the first time, if the server's columns have changed (or it
+    has no updated_at column to go by), if the server's table was truncated, or if the cache
+    is older than TOMBSTONE_RETENTION. The search index is built if it's missing.
+    """
+    checked_at = float(get_meta("checked_at", 0))
+    if force or time.time() - checked_at >= util.USER_CONFIG["cache_max_age"]:
+        # In server time, like the watermarks
+        util.cursor.execute(
+            "SELECT localtimestamp - %s AS pruned_before", (TOMBSTONE_RETENTION,))
+        pruned_before = util.cursor.fetchone()["pruned_before"]
+        for table in CACHED_TABLES:
+            server_fields = get_server_fields(table)
+            watermark = get_meta(table + "_watermark")
+            deletes_watermark = get_meta(table + "_deletes_watermark")
+            same_fields = get_local_fields(table) == [name for name, _ in server_fields]
+            if not (same_fields and watermark and deletes_watermark
+                    and "updated_at" in dict(server_fields)
+                    and incremental_load(table, watermark, deletes_watermark, pruned_before)):
+                full_load(table, server_fields)
+        util.db_conn.commit()
+        set_meta("checked_at", time.time())
+
+    for table in CACHED_TABLES:
+        if not get_local_fields(table + "_fts"):
+            build_search_index(table)
+    _cache_conn.commit()
+
+
+def build_search_index(table):
+    """
+    Create a full-text index over a cached table's SEARCH_FIELDS, plus triggers so that
+    later inserts, replaces and deletes keep it up to date
+    """
+    fields = list(SEARCH_FIELDS[table])
+    field_list = ", ".join(fields)
+    _cache_conn.execute(
+        "CREATE VIRTUAL TABLE %s_fts USING fts5(%s, content='%s', content_rowid='id', "
+        "tokenize='porter unicode61')" % (table, field_list, table))
+    _cache_conn.execute("INSERT INTO %s_fts(%s_fts) VALUES ('rebuild')" % (table, table))
+    _cache_conn.execute("DROP TABLE IF EXISTS %s_fts_vocab" % table)
+    _cache_conn.execute(
+        "CREATE VIRTUAL TABLE %s_fts_vocab USING fts5vocab(%s_fts, 'row')" % (table, table))
+
+    new_values = ", ".join("new." + field for field in fields)
+    old_values = ", ".join("old." + field for field in fields)
+    insert_sql = "INSERT INTO %s_fts (rowid, %s) VALUES (new.id, %s);" % (
+        table, field_list, new_values)
+    delete_sql = "INSERT INTO %s_fts (%s_fts, rowid, %s) VALUES ('delete', old.id, %s);" % (
+        table, table, field_list, old_values)
+    for event, body in (
+            ("INSERT", insert_sql), ("DELETE", delete_sql), ("UPDATE", delete_sql + insert_sql)):
+        _cache_conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS %s_fts_%s AFTER %s ON %s BEGIN %s END" % (
+                table, event.lower(), event, table, body))
+
+
+def get_match_terms(text):
+    """
+    Turn free text into FTS5 prefix terms. Words found nowhere in the index are swapped for
+    the closest indexed words, so small typos still find things.
+    """
+    terms = []
+    for word in re.findall(r"[^\W_]+", text.lower()):
+        term = '"%s"*' % word
+        if any(
+                _cache_conn.execute(
+                    "SELECT 1 FROM %s_fts WHERE %s_fts MATCH ? LIMIT 1" % (table, table),
+                    (term,)).fetchone()
+                for table in CACHED_TABLES):
+            terms.append(term)
+            continue
+        candidates = set()
+        for table in CACHED_TABLES:
+            candidates.update(
+                row["term"] for row in _cache_conn.execute(
+                    "SELECT term FROM %s_fts_vocab WHERE term >= ? AND term < ?" % table,
+                    (word[0], chr(ord(word[0]) + 1))))
+        terms += [
+            '"%s"' % close
+            for close in difflib.get_close_matches(word, candidates, n=3, cutoff=FUZZY_CUTOFF)]
+    return terms
+
+
+def find(text, limit):
+    """
+    Rank tables and columns by how well their names and docs match free text, best first.
+    Returns up to `limit` rows of (table_schema, table_name, column_name, description).
+    """
+    get_connection()
+    terms = get_match_terms(text)
+    if not terms:
+        return []
+    match_query = " OR ".join(terms)
+    table_weights = ", ".join(str(weight) for weight in SEARCH_FIELDS["tables"].values())
+    column_weights = ", ".join(str(weight) for weight in SEARCH_FIELDS["columns"].values())
+    return _cache_conn.execute(f"""
+        SELECT table_schema, table_name, column_name, description
+        FROM (
+            SELECT t.table_schema, t.table_name, NULL AS column_name, t.description,
+            bm25(tables_fts, {table_weights}) AS rank
+            FROM tables_fts
+            JOIN tables t ON t.id = tables_fts.rowid
+            WHERE tables_fts MATCH ?
+            UNION ALL
+            SELECT c.table_schema, c.table_name, c.column_name, c.description,
+            bm25(columns_fts, {column_weights}) AS rank
+            FROM columns_fts
+            JOIN columns c ON c.id = columns_fts.rowid
+            WHERE columns_fts MATCH ?
+        )
+        ORDER BY rank
+        LIMIT ?
+    """, (match_query, match_query, limit))
+
+
+def invalidate(table, row_id):
+    """
+    Drop a row that was just written on the server, and make the next lookup refresh the cache
+    so it comes back with the new values
+    """
+    if not os.path.exists(get_cache_path()):
+        return
+    cache_conn = get_connection()
+    cache_conn.execute('DELETE FROM "%s" WHERE id = ?' % table, (row_id,))
+    set_meta("checked_at", 0)
+    cache_conn.commit()
+
+
+def mark_stale():
+    """Make the next lookup bring the cache up to date, e.g. after a bulk write on the server"""
+    if not os.path.exists(get_cache_path()):
+        return
+    cache_conn = get_connection()
+    set_meta("checked_at", 0)
+    cache_conn.commit()
+
+
+def query(sql, params=()):
+    """
+    Run a query against the cache and return a cursor over sqlite3.Row rows.
+    Takes the same %s placeholders as the server queries.
+    """
+    return get_connection().execute(sql.replace("%s", "?"), params)
+
+
+def fetch_all(sql, params=()):
+    """Run a query against the cache and return all rows as dicts"""
+    return [dict(row) for row in query(sql, params)]
@@ -0,0 +1,122 @@
+"""
+Numbered migrations for the docs schema, see migrations/.
+
+Each file is named like 0003_some_change.sql, and runs in its own transaction with the
+search path pointed at the docs schema, so the SQL doesn't name the schema. Applied
+versions are recorded in schema_version. Clients refuse to run against a docs schema older
+than the newest migration they ship with.
+"""
+
+import os
+import re
+import sys
+
+import psycopg2.errors
+import psycopg2.extensions
+
+import util
+
+MIGRATIONS_DIR = os.path.join(util.THIS_DIR, "migrations")
+MIGRATION_FILE_PATTERN = r"(\d+)_(\w+)\.sql$"
+
+
+class SchemaVersionError(Exception):
+    """
+    Exception for when the docs schema is older than this client expects
+    """
+    pass # pylint: disable=unnecessary-pass
+
+
+def get_migrations():
+    """
+    Get (version, name, path) for every migration file, in order
+    """
+    migrations = []
+    for file_name in os.listdir(MIGRATIONS_DIR):
+        matches = re.match(MIGRATION_FILE_PATTERN, file_name)
+        if matches:
+            migrations.append((
+                int(matches.group(1)), matches.group(2), os.path.join(MIGRATIONS_DIR, file_name)))
+    return sorted(migrations)
+
+
+def get_latest_version():
+    """The version a fully migrated docs schema is at, as far as this client knows"""
+    migrations = get_migrations()
+    return migrations[-1][0] if migrations else 0
+
+
+def get_schema_version(cursor):
+    """The docs schema's current version, or 0 if it has never been migrated"""
+    try:
+        cursor.execute("SELECT max(version) FROM schema_version")
+        version = cursor.fetchone()[0] or 0
+    except psycopg2.errors.UndefinedTable:
+        version = 0
+    cursor.connection.rollback()
+    return version
+
+
+def check_schema_version(cursor):
+    """
+    Refuse to go on if the docs schema is behind this client, and warn if it's ahead
+    (i.e. this checkout is out of date)
+    """
+    latest_version = get_latest_version()
+    schema_version = get_schema_version(cursor)
+    if schema_version < latest_version:
+        raise SchemaVersionError(
+            "The docs schema is at version %i, but this client needs version %i. "
+            "Run `se migrate` to upgrade it." % (schema_version, latest_version))
+    if schema_version > latest_version:
+        sys.stderr.write(
+            "Warning: the docs schema is at version %i, newer than this client knows about "
+            "(%i). Update your checkout.\n" % (schema_version, latest_version))
+
+
+def print_status():
+    """List each migration and whether it has been applied"""
+    schema_version = get_schema_version(util.cursor)
+    for version, name, _ in get_migrations():
+        print("%s %04i %s" % ("applied" if version <= schema_version else "pending", version, name))
+
+
+def migrate():
+    """
+    Apply every migration newer than the docs schema's version, each in its own transaction.
+    An advisory lock keeps two clients from migrating at the same time.
+    """
+    schema = util.USER_CONFIG["schema"]
+    util.cursor.execute(
+        "CREATE SCHEMA IF NOT EXISTS " + psycopg2.extensions.quote_ident(schema, util.cursor))
+    util.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    util.db_conn.commit()
+
+    num_applied = 0
+    for version, name, path in get_migrations():
+        util.cursor.execute("SELECT pg_advisory_xact_lock(hashtext('se migrate'))")
+        util.cursor.execute("SELECT 1 FROM schema_version WHERE version = %s", (version,))
+        if util.cursor.fetchone():
+            util.db_conn.rollback()
+            continue
+        print("Applying %04i %s" % (version, name))
+        with open(path) as migration_f:
+            migration_sql = migration_f.read()
+        try:
+            util.cursor.execute(migration_sql)
+            util.cursor.execute(
+                "INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+        except Exception:
+            util.db_conn.rollback()
+            raise
+        util.db_conn.commit()
+        num_applied += 1
+
+    print("Docs schema %s is at version %i (%i migrations applied)" % (
+        schema, get_latest_version(), num_applied))
@@ -1,7 +1,6 @@
-CREATE SCHEMA IF NOT EXISTS schemadoc;
--- GRANT USAGE, CREATE ON SCHEMA schemadoc TO somebody;
+-- The docs tables themselves
 
-CREATE TABLE IF NOT EXISTS schemadoc.tables (
+CREATE TABLE IF NOT EXISTS tables (
     id SERIAL PRIMARY KEY,
     table_schema TEXT NOT NULL,
     table_name TEXT NOT NULL,
@@ -22,7 +21,7 @@ CREATE TABLE IF NOT EXISTS schemadoc.tables (
     CHECK (last_approval_at IS NULL OR deprecated IS NOT NULL)
 );
 
-CREATE TABLE IF NOT EXISTS schemadoc.columns (
+CREATE TABLE IF NOT EXISTS columns (
     id SERIAL PRIMARY KEY,
     table_schema TEXT NOT NULL,
     table_name TEXT NOT NULL,
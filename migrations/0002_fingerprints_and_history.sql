@@ -0,0 +1,30 @@
+-- Hashes of each upstream table's column names/types, and of each schema's tables,
+-- so a refresh can skip what hasn't changed
+CREATE TABLE IF NOT EXISTS table_fingerprints (
+    table_schema TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (table_schema, table_name)
+);
+
+CREATE TABLE IF NOT EXISTS schema_fingerprints (
+    table_schema TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Tables/columns appearing, disappearing or changing type, as seen by refreshes
+CREATE TABLE IF NOT EXISTS structure_history (
+    id SERIAL PRIMARY KEY,
+    table_schema TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    column_name TEXT,
+    change TEXT NOT NULL,
+    old_data_type TEXT,
+    new_data_type TEXT,
+    observed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS structure_history_table_idx
+    ON structure_history (table_schema, table_name, observed_at);
@@ -0,0 +1,19 @@
+-- updated_at lets clients keep a local cache up to date incrementally
+ALTER TABLE tables ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE columns ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS tables_updated_at_idx ON tables (updated_at);
+CREATE INDEX IF NOT EXISTS columns_updated_at_idx ON columns (updated_at);
+
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at = clock_timestamp();
+    RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS tables_set_updated_at ON tables;
+CREATE TRIGGER tables_set_updated_at BEFORE UPDATE ON tables
+    FOR EACH ROW EXECUTE PROCEDURE set_updated_at();
+DROP TRIGGER IF EXISTS columns_set_updated_at ON columns;
+CREATE TRIGGER columns_set_updated_at BEFORE UPDATE ON columns
+    FOR EACH ROW EXECUTE PROCEDURE set_updated_at();
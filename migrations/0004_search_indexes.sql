@@ -0,0 +1,13 @@
+-- Full-text indexes for `se find` when it goes to the server. The expressions must match
+-- SEARCH_DOCUMENTS in search.py.
+CREATE INDEX IF NOT EXISTS tables_search_idx ON tables USING GIN ((
+    setweight(to_tsvector('english', table_name), 'A')
+    || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+));
+CREATE INDEX IF NOT EXISTS columns_search_idx ON columns USING GIN ((
+    setweight(to_tsvector('english', column_name), 'A')
+    || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    || setweight(to_tsvector('english', table_name), 'C')
+    || setweight(to_tsvector('english', coalesce(also_goes_by, '')), 'C')
+    || setweight(to_tsvector('english', coalesce(example_vals, '')), 'D')
+));
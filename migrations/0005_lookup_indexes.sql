@@ -0,0 +1,29 @@
+-- Indexes for the name regexes in `se search`, the orphan and undocumented work lists,
+-- and `se search -r` (newest first)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS tables_table_name_trgm_idx
+    ON tables USING GIN (table_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS columns_table_name_trgm_idx
+    ON columns USING GIN (table_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS columns_column_name_trgm_idx
+    ON columns USING GIN (column_name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS tables_orphaned_idx
+    ON tables (table_schema, table_name) WHERE orphaned;
+CREATE INDEX IF NOT EXISTS columns_orphaned_idx
+    ON columns (table_schema, table_name, column_name) WHERE orphaned;
+
+CREATE INDEX IF NOT EXISTS tables_undocumented_idx
+    ON tables (table_schema, table_name) WHERE description IS NULL;
+CREATE INDEX IF NOT EXISTS columns_undocumented_idx
+    ON columns (table_name, column_name) WHERE description IS NULL;
+
+-- `example_vals IS NULL` work lists walk by (schema, table) or by (table, column)
+CREATE INDEX IF NOT EXISTS columns_missing_examples_idx
+    ON columns (table_schema, table_name, column_name) WHERE example_vals IS NULL;
+CREATE INDEX IF NOT EXISTS columns_missing_examples_by_name_idx
+    ON columns (table_name, column_name) WHERE example_vals IS NULL;
+
+CREATE INDEX IF NOT EXISTS tables_inserted_at_idx ON tables (inserted_at);
+CREATE INDEX IF NOT EXISTS columns_inserted_at_idx ON columns (inserted_at);
@@ -0,0 +1,4 @@
+-- Names given without a schema (`se describe orders`, `se document orders.total`) are looked up
+-- by table_name, which the (table_schema, table_name, ...) unique indexes can't serve
+CREATE INDEX IF NOT EXISTS tables_table_name_idx ON tables (table_name);
+CREATE INDEX IF NOT EXISTS columns_table_name_column_name_idx ON columns (table_name, column_name);
@@ -0,0 +1,4 @@
+-- Row counts can pass 2^31, and exact counts (se refresh --row-counts --exact) are told
+-- apart from planner estimates by when they were last counted
+ALTER TABLE tables ALTER COLUMN rows_count TYPE BIGINT;
+ALTER TABLE tables ADD COLUMN IF NOT EXISTS rows_counted_at TIMESTAMP;
@@ -0,0 +1,194 @@
+-- Per-schema documentation coverage, kept up to date by statement-level triggers, so
+-- `se stats` reads a few rows instead of aggregating tables and columns.
+-- object_type is 'table' or 'column'. Tables never have example values, columns never
+-- have approvals, so those counts stay 0.
+CREATE TABLE IF NOT EXISTS coverage (
+    object_type TEXT NOT NULL,
+    table_schema TEXT NOT NULL,
+    num_objects BIGINT NOT NULL DEFAULT 0,
+    num_with_desc BIGINT NOT NULL DEFAULT 0,
+    num_with_approval BIGINT NOT NULL DEFAULT 0,
+    num_with_example_vals BIGINT NOT NULL DEFAULT 0,
+    num_orphaned BIGINT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (object_type, table_schema)
+);
+
+-- coverage as of the end of each day it changed, for `se stats --trend`
+CREATE TABLE IF NOT EXISTS coverage_history (
+    snapshot_date DATE NOT NULL,
+    object_type TEXT NOT NULL,
+    table_schema TEXT NOT NULL,
+    num_objects BIGINT NOT NULL,
+    num_with_desc BIGINT NOT NULL,
+    num_with_approval BIGINT NOT NULL,
+    num_with_example_vals BIGINT NOT NULL,
+    num_orphaned BIGINT NOT NULL,
+
+    PRIMARY KEY (snapshot_date, object_type, table_schema)
+);
+
+-- Applies one statement's changes to coverage, from its transition tables (old_rows/new_rows),
+-- and copies the touched schemas' new totals into today's coverage_history row.
+-- Trigger arguments: the object_type, then SQL for "has an approval" and "has example values"
+-- over a row of the table the trigger is on.
+CREATE OR REPLACE FUNCTION count_coverage() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    counted TEXT := format(
+        'SELECT id, table_schema, description IS NOT NULL AS has_desc, %s AS has_approval, '
+        '%s AS has_example_vals, orphaned FROM %%s',
+        TG_ARGV[1], TG_ARGV[2]);
+    changes TEXT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        changes := format('SELECT 1 AS sign, * FROM (%s) n', format(counted, 'new_rows'));
+    ELSIF TG_OP = 'DELETE' THEN
+        changes := format('SELECT -1 AS sign, * FROM (%s) o', format(counted, 'old_rows'));
+    ELSE
+        -- Only rows whose counted fields changed, so updates that don't touch them
+        -- (row counts, updated_at, ...) cost a join and nothing more
+        changes := format($sql$
+            WITH o AS (%s), n AS (%s), changed AS (
+                SELECT id FROM o JOIN n USING (id)
+                WHERE (o.table_schema, o.has_desc, o.has_approval, o.has_example_vals, o.orphaned)
+                    IS DISTINCT FROM
+                    (n.table_schema, n.has_desc, n.has_approval, n.has_example_vals, n.orphaned)
+            )
+            SELECT -1 AS sign, o.* FROM o JOIN changed USING (id)
+            UNION ALL
+            SELECT 1 AS sign, n.* FROM n JOIN changed USING (id)
+        $sql$, format(counted, 'old_rows'), format(counted, 'new_rows'));
+    END IF;
+
+    EXECUTE format($sql$
+        WITH updated AS (
+            INSERT INTO coverage AS c (
+                object_type, table_schema, num_objects, num_with_desc, num_with_approval,
+                num_with_example_vals, num_orphaned)
+            SELECT
+            %L,
+            table_schema,
+            sum(sign),
+            sum(sign * has_desc::int),
+            sum(sign * has_approval::int),
+            sum(sign * has_example_vals::int),
+            sum(sign * orphaned::int)
+            FROM (%s) d
+            GROUP BY table_schema
+            -- Same order in every statement, so concurrent writers can't deadlock
+            ORDER BY table_schema
+            ON CONFLICT (object_type, table_schema) DO UPDATE SET
+            num_objects = c.num_objects + excluded.num_objects,
+            num_with_desc = c.num_with_desc + excluded.num_with_desc,
+            num_with_approval = c.num_with_approval + excluded.num_with_approval,
+            num_with_example_vals = c.num_with_example_vals + excluded.num_with_example_vals,
+            num_orphaned = c.num_orphaned + excluded.num_orphaned
+            RETURNING c.*
+        )
+        INSERT INTO coverage_history AS h
+        SELECT current_date, * FROM updated
+        ON CONFLICT (snapshot_date, object_type, table_schema) DO UPDATE SET
+        num_objects = excluded.num_objects,
+        num_with_desc = excluded.num_with_desc,
+        num_with_approval = excluded.num_with_approval,
+        num_with_example_vals = excluded.num_with_example_vals,
+        num_orphaned = excluded.num_orphaned
+    $sql$, TG_ARGV[0], changes);
+    RETURN NULL;
+END
+$$;
+
+-- TRUNCATE has no transition tables, but everything is gone, so zero every count
+CREATE OR REPLACE FUNCTION clear_coverage() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    WITH updated AS (
+        UPDATE coverage SET
+        num_objects = 0,
+        num_with_desc = 0,
+        num_with_approval = 0,
+        num_with_example_vals = 0,
+        num_orphaned = 0
+        WHERE object_type = TG_ARGV[0]
+        RETURNING *
+    )
+    INSERT INTO coverage_history AS h
+    SELECT current_date, * FROM updated
+    ON CONFLICT (snapshot_date, object_type, table_schema) DO UPDATE SET
+    num_objects = 0,
+    num_with_desc = 0,
+    num_with_approval = 0,
+    num_with_example_vals = 0,
+    num_orphaned = 0;
+    RETURN NULL;
+END
+$$;
+
+-- Transition tables (REFERENCING) can't be shared by triggers for several events, hence one
+-- trigger per event
+DROP TRIGGER IF EXISTS tables_coverage_insert ON tables;
+CREATE TRIGGER tables_coverage_insert AFTER INSERT ON tables
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE count_coverage('table', 'last_approval_at IS NOT NULL', 'false');
+DROP TRIGGER IF EXISTS tables_coverage_update ON tables;
+CREATE TRIGGER tables_coverage_update AFTER UPDATE ON tables
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE count_coverage('table', 'last_approval_at IS NOT NULL', 'false');
+DROP TRIGGER IF EXISTS tables_coverage_delete ON tables;
+CREATE TRIGGER tables_coverage_delete AFTER DELETE ON tables
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE count_coverage('table', 'last_approval_at IS NOT NULL', 'false');
+DROP TRIGGER IF EXISTS tables_coverage_truncate ON tables;
+CREATE TRIGGER tables_coverage_truncate AFTER TRUNCATE ON tables
+    FOR EACH STATEMENT EXECUTE PROCEDURE clear_coverage('table');
+
+DROP TRIGGER IF EXISTS columns_coverage_insert ON columns;
+CREATE TRIGGER columns_coverage_insert AFTER INSERT ON columns
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE count_coverage('column', 'false', 'example_vals IS NOT NULL');
+DROP TRIGGER IF EXISTS columns_coverage_update ON columns;
+CREATE TRIGGER columns_coverage_update AFTER UPDATE ON columns
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE count_coverage('column', 'false', 'example_vals IS NOT NULL');
+DROP TRIGGER IF EXISTS columns_coverage_delete ON columns;
+CREATE TRIGGER columns_coverage_delete AFTER DELETE ON columns
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE count_coverage('column', 'false', 'example_vals IS NOT NULL');
+DROP TRIGGER IF EXISTS columns_coverage_truncate ON columns;
+CREATE TRIGGER columns_coverage_truncate AFTER TRUNCATE ON columns
+    FOR EACH STATEMENT EXECUTE PROCEDURE clear_coverage('column');
+
+-- Count what's already there. The triggers above lock both tables against writes until this
+-- migration commits, so nothing is missed or counted twice.
+DELETE FROM coverage;
+INSERT INTO coverage
+SELECT
+'table',
+table_schema,
+count(1),
+count(description),
+count(last_approval_at),
+0,
+count(1) FILTER (WHERE orphaned)
+FROM tables
+GROUP BY table_schema
+UNION ALL
+SELECT
+'column',
+table_schema,
+count(1),
+count(description),
+0,
+count(example_vals),
+count(1) FILTER (WHERE orphaned)
+FROM columns
+GROUP BY table_schema;
+
+INSERT INTO coverage_history
+SELECT current_date, * FROM coverage
+ON CONFLICT (snapshot_date, object_type, table_schema) DO NOTHING;
@@ -0,0 +1,37 @@
+-- Tombstones for rows deleted from the docs tables, so clients can drop them from their local
+-- cache by reading what was deleted since they last looked, instead of comparing every id.
+-- A NULL row_id means the whole table was truncated. Syncs delete tombstones older than
+-- local_cache.TOMBSTONE_RETENTION (a week); older caches reload in full.
+CREATE TABLE IF NOT EXISTS deleted_rows (
+    table_name TEXT NOT NULL,
+    row_id INT,
+    deleted_at TIMESTAMP NOT NULL DEFAULT clock_timestamp()
+);
+CREATE INDEX IF NOT EXISTS deleted_rows_table_deleted_at_idx
+    ON deleted_rows (table_name, deleted_at);
+
+CREATE OR REPLACE FUNCTION record_deleted_rows() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        INSERT INTO deleted_rows (table_name, row_id) VALUES (TG_TABLE_NAME, NULL);
+    ELSE
+        INSERT INTO deleted_rows (table_name, row_id) SELECT TG_TABLE_NAME, id FROM old_rows;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS tables_record_deleted_rows ON tables;
+CREATE TRIGGER tables_record_deleted_rows AFTER DELETE ON tables
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE record_deleted_rows();
+DROP TRIGGER IF EXISTS tables_record_truncate ON tables;
+CREATE TRIGGER tables_record_truncate AFTER TRUNCATE ON tables
+    FOR EACH STATEMENT EXECUTE PROCEDURE record_deleted_rows();
+DROP TRIGGER IF EXISTS columns_record_deleted_rows ON columns;
+CREATE TRIGGER columns_record_deleted_rows AFTER DELETE ON columns
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE record_deleted_rows();
+DROP TRIGGER IF EXISTS columns_record_truncate ON columns;
+CREATE TRIGGER columns_record_truncate AFTER TRUNCATE ON columns
+    FOR EACH STATEMENT EXECUTE PROCEDURE record_deleted_rows();
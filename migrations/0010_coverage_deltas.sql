@@ -0,0 +1,171 @@
+-- The coverage triggers from 0008 upserted one counter row per schema, so every write to a
+-- schema's docs waited on every other until it committed, and two writers touching schemas in
+-- different orders (a sync and an import) could deadlock. Now each statement only appends its
+-- changes to coverage_deltas, which nothing else writes to. fold_coverage_deltas() moves them
+-- into coverage and coverage_history, and is run after syncs, in a transaction of its own.
+-- `se stats` reads the counters plus whatever hasn't been folded yet, so it never writes.
+CREATE TABLE IF NOT EXISTS coverage_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    changed_on DATE NOT NULL DEFAULT current_date,
+    object_type TEXT NOT NULL,
+    table_schema TEXT NOT NULL,
+    num_objects BIGINT NOT NULL,
+    num_with_desc BIGINT NOT NULL,
+    num_with_approval BIGINT NOT NULL,
+    num_with_example_vals BIGINT NOT NULL,
+    num_orphaned BIGINT NOT NULL
+);
+
+-- Appends one statement's changes, from its transition tables (old_rows/new_rows).
+-- Trigger arguments: the object_type, then SQL for "has an approval" and "has example values"
+-- over a row of the table the trigger is on.
+CREATE OR REPLACE FUNCTION count_coverage() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    counted TEXT := format(
+        'SELECT id, table_schema, description IS NOT NULL AS has_desc, %s AS has_approval, '
+        '%s AS has_example_vals, orphaned FROM %%s',
+        TG_ARGV[1], TG_ARGV[2]);
+    changes TEXT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        changes := format('SELECT 1 AS sign, * FROM (%s) n', format(counted, 'new_rows'));
+    ELSIF TG_OP = 'DELETE' THEN
+        changes := format('SELECT -1 AS sign, * FROM (%s) o', format(counted, 'old_rows'));
+    ELSE
+        -- Only rows whose counted fields changed, so updates that don't touch them
+        -- (row counts, updated_at, ...) cost a join and nothing more
+        changes := format($sql$
+            WITH o AS (%s), n AS (%s), changed AS (
+                SELECT id FROM o JOIN n USING (id)
+                WHERE (o.table_schema, o.has_desc, o.has_approval, o.has_example_vals, o.orphaned)
+                    IS DISTINCT FROM
+                    (n.table_schema, n.has_desc, n.has_approval, n.has_example_vals, n.orphaned)
+            )
+            SELECT -1 AS sign, o.* FROM o JOIN changed USING (id)
+            UNION ALL
+            SELECT 1 AS sign, n.* FROM n JOIN changed USING (id)
+        $sql$, format(counted, 'old_rows'), format(counted, 'new_rows'));
+    END IF;
+
+    EXECUTE format($sql$
+        INSERT INTO coverage_deltas (
+            object_type, table_schema, num_objects, num_with_desc, num_with_approval,
+            num_with_example_vals, num_orphaned)
+        SELECT * FROM (
+            SELECT
+            %L AS object_type,
+            table_schema,
+            sum(sign) AS num_objects,
+            sum(sign * has_desc::int),
+            sum(sign * has_approval::int),
+            sum(sign * has_example_vals::int),
+            sum(sign * orphaned::int)
+            FROM (%s) d
+            GROUP BY table_schema
+        ) schema_changes
+        -- Updates that changed nothing counted still show up here, as all zeros
+        WHERE num_objects <> 0 OR (num_with_desc, num_with_approval, num_with_example_vals,
+                                   num_orphaned) <> (0, 0, 0, 0)
+    $sql$, TG_ARGV[0], changes);
+    RETURN NULL;
+END
+$$;
+
+-- TRUNCATE has no transition tables, but everything is gone, so append the negative of each
+-- schema's total. TRUNCATE locks out every other writer of the table, so the total can't move
+-- under it.
+CREATE OR REPLACE FUNCTION clear_coverage() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO coverage_deltas (
+        object_type, table_schema, num_objects, num_with_desc, num_with_approval,
+        num_with_example_vals, num_orphaned)
+    SELECT
+    object_type,
+    table_schema,
+    -sum(num_objects),
+    -sum(num_with_desc),
+    -sum(num_with_approval),
+    -sum(num_with_example_vals),
+    -sum(num_orphaned)
+    FROM (
+        SELECT object_type, table_schema, num_objects, num_with_desc, num_with_approval,
+        num_with_example_vals, num_orphaned
+        FROM coverage
+        UNION ALL
+        SELECT object_type, table_schema, num_objects, num_with_desc, num_with_approval,
+        num_with_example_vals, num_orphaned
+        FROM coverage_deltas
+    ) totals
+    WHERE object_type = TG_ARGV[0]
+    GROUP BY object_type, table_schema;
+    RETURN NULL;
+END
+$$;
+
+-- Moves every committed delta into coverage, and sets coverage_history's row for each day and
+-- schema they touched to the running total as of that day. Folds wait for each other (only
+-- each other) on an advisory lock, so two of them can't apply the same deltas. Returns the
+-- number of schemas whose coverage changed.
+CREATE OR REPLACE FUNCTION fold_coverage_deltas() RETURNS BIGINT LANGUAGE plpgsql AS $$
+DECLARE
+    num_changed BIGINT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('fold_coverage_deltas'));
+    WITH folded AS (
+        DELETE FROM coverage_deltas RETURNING *
+    ), daily AS (
+        SELECT
+        changed_on,
+        object_type,
+        table_schema,
+        sum(num_objects) AS num_objects,
+        sum(num_with_desc) AS num_with_desc,
+        sum(num_with_approval) AS num_with_approval,
+        sum(num_with_example_vals) AS num_with_example_vals,
+        sum(num_orphaned) AS num_orphaned
+        FROM folded
+        GROUP BY changed_on, object_type, table_schema
+    ), history AS (
+        -- Every part of this statement sees coverage from before it, so these are the old
+        -- totals plus each day's deltas so far
+        INSERT INTO coverage_history AS h
+        SELECT
+        d.changed_on,
+        d.object_type,
+        d.table_schema,
+        coalesce(c.num_objects, 0) + sum(d.num_objects) OVER running,
+        coalesce(c.num_with_desc, 0) + sum(d.num_with_desc) OVER running,
+        coalesce(c.num_with_approval, 0) + sum(d.num_with_approval) OVER running,
+        coalesce(c.num_with_example_vals, 0) + sum(d.num_with_example_vals) OVER running,
+        coalesce(c.num_orphaned, 0) + sum(d.num_orphaned) OVER running
+        FROM daily d
+        LEFT JOIN coverage c USING (object_type, table_schema)
+        WINDOW running AS (PARTITION BY d.object_type, d.table_schema ORDER BY d.changed_on)
+        ON CONFLICT (snapshot_date, object_type, table_schema) DO UPDATE SET
+        num_objects = excluded.num_objects,
+        num_with_desc = excluded.num_with_desc,
+        num_with_approval = excluded.num_with_approval,
+        num_with_example_vals = excluded.num_with_example_vals,
+        num_orphaned = excluded.num_orphaned
+    )
+    INSERT INTO coverage AS c
+    SELECT
+    object_type,
+    table_schema,
+    sum(num_objects),
+    sum(num_with_desc),
+    sum(num_with_approval),
+    sum(num_with_example_vals),
+    sum(num_orphaned)
+    FROM daily
+    GROUP BY object_type, table_schema
+    ON CONFLICT (object_type, table_schema) DO UPDATE SET
+    num_objects = c.num_objects + excluded.num_objects,
+    num_with_desc = c.num_with_desc + excluded.num_with_desc,
+    num_with_approval = c.num_with_approval + excluded.num_with_approval,
+    num_with_example_vals = c.num_with_example_vals + excluded.num_with_example_vals,
+    num_orphaned = c.num_orphaned + excluded.num_orphaned;
+    GET DIAGNOSTICS num_changed = ROW_COUNT;
+    RETURN num_changed;
+END
+$$;
@@ -0,0 +1,17 @@
+-- Typo-tolerant name matching for `se find` when it goes to the server (the local cache has its
+-- own). Needs the pg_trgm extension, which is created here if this role may. Without it the
+-- indexes are skipped and `se find` sticks to full-text search. If pg_trgm is installed later,
+-- the fallback works at once, but scans; create these two indexes by hand to speed it up.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT * FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE EXTENSION pg_trgm;
+    END IF;
+    CREATE INDEX IF NOT EXISTS tables_table_name_trgm_idx
+        ON tables USING GIN (table_name gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS columns_column_name_trgm_idx
+        ON columns USING GIN (column_name gin_trgm_ops);
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm not available (%), skipping trigram indexes', SQLERRM;
+END
+$$;
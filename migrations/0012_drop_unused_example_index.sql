@@ -0,0 +1,4 @@
+-- Nothing walks columns missing example values by (table_name, column_name) any more: every
+-- work list goes by schema first, which columns_missing_examples_idx covers. Drop the other one
+-- so writes to columns don't keep it up to date for nothing.
+DROP INDEX IF EXISTS columns_missing_examples_by_name_idx;
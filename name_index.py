@@ -0,0 +1,153 @@
+"""
+Sorted in-memory index of every table and column name, for resolving names given on the command
+line and for tab completion without going to the database.
+
+With the local cache on, the index is built from it and saved next to it, so later runs load it
+in one go until the cached names change. Otherwise it's built from the server, once per process.
+"""
+
+import bisect
+import marshal
+import os
+import time
+
+import local_cache
+import util
+
+# Sorts after any character that can follow a prefix, for finding the end of a prefix's range
+PREFIX_END = "\U0010ffff"
+
+_index = None
+_index_version = None
+
+
+def get_index_path():
+    """Saved index for the current cache file"""
+    return os.path.splitext(local_cache.get_cache_path())[0] + "_names.marshal"
+
+
+def build(fetch):
+    """
+    Get names from fetch (util.fetch_all or local_cache.fetch_all) into sorted key lists, with
+    the matching row ids in parallel lists
+    """
+    tables = sorted(
+        (row["table_schema"] + "." + row["table_name"], row["id"])
+        for row in fetch("SELECT id, table_schema, table_name FROM tables"))
+    columns = sorted(
+        (row["table_schema"] + "." + row["table_name"] + "." + row["column_name"], row["id"])
+        for row in fetch("SELECT id, table_schema, table_name, column_name FROM columns"))
+    return {
+        "table_keys": [key for key, _ in tables],
+        "table_ids": [row_id for _, row_id in tables],
+        "column_keys": [key for key, _ in columns],
+        "column_ids": [row_id for _, row_id in columns],
+    }
+
+
+def load_saved(version):
+    """The saved index if it was built from this version of the cache, otherwise None"""
+    try:
+        with open(get_index_path(), "rb") as index_f:
+            saved_version, index = marshal.load(index_f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return index if saved_version == version else None
+
+
+def save(version, index):
+    """Write the index atomically, since other se processes may be reading it"""
+    temp_path = "%s.%i.tmp" % (get_index_path(), os.getpid())
+    with open(temp_path, "wb") as index_f:
+        marshal.dump((version, index), index_f)
+    os.replace(temp_path, get_index_path())
+
+
+def get_index():
+    """
+    Get the name index, loading or rebuilding it if the names have changed since it was built
+    """
+    global _index, _index_version # pylint: disable=global-statement
+    if local_cache.is_enabled():
+        local_cache.get_connection()
+        version = local_cache.get_meta("names_version") or str(time.time())
+        if _index is None or _index_version != version:
+            index = load_saved(version)
+            if index is None:
+                index = build(local_cache.fetch_all)
+                save(version, index)
+            _index, _index_version = index, version
+    elif _index is None:
+        _index = build(util.fetch_all)
+        util.db_conn.commit()
+
+    if "tables_by_name" not in _index:
+        tables_by_name = {}
+        for key in _index["table_keys"]:
+            tables_by_name.setdefault(key.split(".", 1)[1], []).append(key)
+        _index["tables_by_name"] = tables_by_name
+    return _index
+
+
+def get_prefix_range(keys, prefix):
+    """Positions in sorted keys of the ones starting with prefix"""
+    return bisect.bisect_left(keys, prefix), bisect.bisect_left(keys, prefix + PREFIX_END)
+
+
+def get_id(keys, ids, key):
+    """Row id for an exact key, or None"""
+    position = bisect.bisect_left(keys, key)
+    if position < len(keys) and keys[position] == key:
+        return ids[position]
+    return None
+
+
+def resolve(name):
+    """
+    Find what a name given on the command line could refer to, the same way
+    util.get_record_from_name reads names. Returns a list of (object_type, full name, id),
+    public schema first and then in sorted order, which is empty if nothing matched.
+    """
+    index = get_index()
+    table_keys, table_ids = index["table_keys"], index["table_ids"]
+    column_keys, column_ids = index["column_keys"], index["column_ids"]
+    matches = []
+
+    if name.count(".") == 0:
+        for key in index["tables_by_name"].get(name, []):
+            matches.append(("table", key, get_id(table_keys, table_ids, key)))
+    elif name.count(".") == 2:
+        row_id = get_id(column_keys, column_ids, name)
+        if row_id is not None:
+            matches.append(("column", name, row_id))
+    elif name.count(".") == 1:
+        row_id = get_id(table_keys, table_ids, name)
+        if row_id is not None:
+            matches.append(("table", name, row_id))
+        else:
+            # table.column, in any schema
+            table_name, column_name = name.split(".")
+            for table_key in index["tables_by_name"].get(table_name, []):
+                key = table_key + "." + column_name
+                row_id = get_id(column_keys, column_ids, key)
+                if row_id is not None:
+                    matches.append(("column", key, row_id))
+    # Like psql's default search path, a short name means the public one if there is one
+    matches.sort(key=lambda match: not match[1].startswith("public."))
+    return matches
+
+
+def complete(prefix):
+    """
+    Names that could follow prefix, a level at a time: table names and schemas, then the tables
+    in a schema, then the columns of a table
+    """
+    index = get_index()
+    if prefix.count(".") == 0:
+        start, end = get_prefix_range(index["table_keys"], prefix)
+        schemas = {key.split(".", 1)[0] + "." for key in index["table_keys"][start:end]}
+        tables = {name for name in index["tables_by_name"] if name.startswith(prefix)}
+        return sorted(schemas | tables)
+    keys = index["table_keys"] if prefix.count(".") == 1 else index["column_keys"]
+    start, end = get_prefix_range(keys, prefix)
+    return keys[start:end]
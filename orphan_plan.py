@@ -0,0 +1,220 @@
+"""
+Non-interactive orphan resolution: export every orphan to a plan file, edit it,
+then apply the whole plan in one transaction.
+"""
+
+import collections
+import csv
+
+import psycopg2.extras
+
+import handle_orphaned_column
+import handle_orphaned_table
+import rename_matcher
+import util
+
+PLAN_FIELDS = (
+    "object_type", "table_schema", "table_name", "column_name", "action", "target", "note")
+OBJECT_TYPES = ("table", "column")
+ACTIONS = ("", "rename", "transfer", "delete")
+PLAN_HEADER = """\
+# Orphan resolution plan. Fill in "action" for each row, then run: se resolve-orphans --apply FILE
+#   rename:   target is the new table name (or schema.table), or the new column name
+#   transfer: tables only, target is the schema the table moved to
+#   delete:   remove the docs rows
+#   (blank):  leave the orphan alone
+# Columns of orphaned tables aren't listed; they follow their table.
+"""
+
+
+def get_column_rename_guesses():
+    """
+    Guess renames for orphaned columns of live tables: if a table has exactly one orphaned
+    column of some data type, and exactly one undocumented column of that type added after
+    the table was first seen, the second is probably the first renamed.
+    Returns {(table_schema, table_name, column_name): new_column_name}.
+    """
+    util.cursor.execute("""
+        WITH orphans AS (
+            SELECT c.table_schema, c.table_name, c.column_name, c.data_type
+            FROM columns c
+            JOIN tables t
+            ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+            WHERE c.orphaned AND NOT t.orphaned
+        ),
+        candidates AS (
+            SELECT n.table_schema, n.table_name, n.column_name, n.data_type
+            FROM columns n
+            WHERE NOT n.orphaned
+            AND n.description IS NULL
+            AND (n.table_schema, n.table_name) IN (SELECT table_schema, table_name FROM orphans)
+            AND n.inserted_at > (
+                SELECT min(f.inserted_at) FROM columns f
+                WHERE f.table_schema = n.table_schema AND f.table_name = n.table_name)
+        )
+        SELECT o.table_schema, o.table_name, o.column_name, min(n.column_name) AS new_column_name
+        FROM orphans o
+        JOIN candidates n USING (table_schema, table_name, data_type)
+        GROUP BY o.table_schema, o.table_name, o.column_name, o.data_type
+        HAVING count(1) = 1
+        AND (
+            SELECT count(1) FROM orphans o2
+            WHERE o2.table_schema = o.table_schema
+            AND o2.table_name = o.table_name
+            AND o2.data_type = o.data_type
+        ) = 1
+    """)
+    return {
+        (row["table_schema"], row["table_name"], row["column_name"]): row["new_column_name"]
+        for row in util.cursor
+    }
+
+
+def export_plan(file_path, min_confidence=0.5):
+    """
+    Write every orphaned table, and every orphaned column of a live table, to a TSV plan file.
+    Renames/transfers are prefilled where they can be inferred, for tables only when the guess
+    scores at least min_confidence.
+    """
+    table_guesses = {
+        old_key: (confidence, new_key)
+        for confidence, old_key, new_key in rename_matcher.propose_renames(min_confidence)
+    }
+    column_guesses = get_column_rename_guesses()
+
+    util.cursor.execute("""
+        SELECT table_schema, table_name FROM tables
+        WHERE orphaned
+        ORDER BY table_schema, table_name
+    """)
+    orphaned_tables = [(row["table_schema"], row["table_name"]) for row in util.cursor]
+    util.cursor.execute("""
+        SELECT c.table_schema, c.table_name, c.column_name
+        FROM columns c
+        JOIN tables t ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+        WHERE c.orphaned AND NOT t.orphaned
+        ORDER BY c.table_schema, c.table_name, c.column_name
+    """)
+    orphaned_cols = [
+        (row["table_schema"], row["table_name"], row["column_name"]) for row in util.cursor]
+    util.db_conn.commit()
+
+    with open(file_path, "w", newline="") as plan_f:
+        plan_f.write(PLAN_HEADER)
+        writer = csv.writer(plan_f, delimiter="\t", lineterminator="\n")
+        writer.writerow(PLAN_FIELDS)
+        for old_key in orphaned_tables:
+            action, target, note = "", "", ""
+            if old_key in table_guesses:
+                confidence, new_key = table_guesses[old_key]
+                note = "confidence %.2f" % confidence
+                if new_key[1] == old_key[1]:
+                    action, target = "transfer", new_key[0]
+                else:
+                    action, target = "rename", "%s.%s" % new_key
+            writer.writerow(("table",) + old_key + ("", action, target, note))
+        for col_key in orphaned_cols:
+            action, target, note = "", "", ""
+            if col_key in column_guesses:
+                action, target = "rename", column_guesses[col_key]
+                note = "only new column of the same type"
+            writer.writerow(("column",) + col_key + (action, target, note))
+
+    print("Wrote %i tables and %i columns to %s" % (
+        len(orphaned_tables), len(orphaned_cols), file_path))
+
+
+def read_plan(file_path):
+    """
+    Parse and validate a plan file. Returns rows as dicts, skipping those with no action.
+    """
+    with open(file_path, newline="") as plan_f:
+        lines = [line for line in plan_f if not line.startswith("#")]
+    rows = []
+    for line_num, row in enumerate(csv.DictReader(lines, delimiter="\t"), start=1):
+        action = (row.get("action") or "").strip()
+        target = (row.get("target") or "").strip()
+        if row.get("object_type") not in OBJECT_TYPES:
+            raise ValueError("Bad object_type %r on plan row %i. Expected one of: %s" % (
+                row.get("object_type"), line_num, OBJECT_TYPES))
+        if action not in ACTIONS:
+            raise ValueError("Bad action %r on plan row %i. Expected one of: %s" % (
+                action, line_num, ACTIONS))
+        if action in ("rename", "transfer") and not target:
+            raise ValueError("Plan row %i needs a target for %s" % (line_num, action))
+        if action == "transfer" and row["object_type"] != "table":
+            raise ValueError("Plan row %i: only tables can be transferred" % line_num)
+        if action:
+            row["action"], row["target"] = action, target
+            rows.append(row)
+    return rows
+
+
+def apply_plan(file_path):
+    """
+    Apply every rename, transfer and delete in a plan file with set-based statements,
+    all in one transaction.
+    """
+    rows = read_plan(file_path)
+    counts = collections.Counter((row["object_type"], row["action"]) for row in rows)
+
+    table_renames = []
+    column_renames = []
+    deletes = []
+    for row in rows:
+        if row["action"] == "delete":
+            deletes.append((
+                row["object_type"], row["table_schema"], row["table_name"], row["column_name"]))
+        elif row["object_type"] == "table":
+            old_key = (row["table_schema"], row["table_name"])
+            if row["action"] == "transfer":
+                new_key = (row["target"], row["table_name"])
+            elif "." in row["target"]:
+                new_key = tuple(row["target"].split(".", 1))
+            else:
+                new_key = (row["table_schema"], row["target"])
+            table_renames.append((old_key, new_key))
+        else:
+            column_renames.append(
+                (row["table_schema"], row["table_name"], row["column_name"], row["target"]))
+
+    try:
+        if deletes:
+            util.cursor.execute("""
+                CREATE TEMP TABLE plan_deletes (
+                    object_type TEXT, table_schema TEXT, table_name TEXT, column_name TEXT
+                ) ON COMMIT DROP
+            """)
+            psycopg2.extras.execute_values(
+                util.cursor, "INSERT INTO plan_deletes VALUES %s", deletes, page_size=10000)
+            util.cursor.execute("""
+                DELETE FROM columns c
+                USING plan_deletes p
+                WHERE c.table_schema = p.table_schema
+                AND c.table_name = p.table_name
+                AND (p.object_type = 'table' OR (c.column_name = p.column_name AND c.orphaned))
+                AND (p.object_type = 'column' OR EXISTS (
+                    SELECT * FROM tables t
+                    WHERE t.table_schema = p.table_schema
+                    AND t.table_name = p.table_name
+                    AND t.orphaned))
+            """)
+            util.cursor.execute("""
+                DELETE FROM tables t
+                USING plan_deletes p
+                WHERE p.object_type = 'table'
+                AND t.table_schema = p.table_schema
+                AND t.table_name = p.table_name
+                AND t.orphaned
+            """)
+        if table_renames:
+            handle_orphaned_table.merge_renamed_tables(table_renames, commit=False)
+        if column_renames:
+            handle_orphaned_column.merge_renamed_columns(column_renames, commit=False)
+    except Exception:
+        util.db_conn.rollback()
+        raise
+    util.db_conn.commit()
+
+    for (object_type, action), count in sorted(counts.items()):
+        print("%i %s %s actions applied" % (count, object_type, action))
@@ -0,0 +1,77 @@
+"""
+Finds likely renames among orphaned tables, by comparing column sets with newly discovered
+(still undocumented) tables.
+"""
+
+import collections
+import difflib
+
+import util
+
+# How much of the score comes from column overlap vs. table name similarity
+COLUMN_WEIGHT = 0.8
+NAME_WEIGHT = 0.2
+
+
+def get_tables_with_cols(where_clause):
+    """
+    Get {(table_schema, table_name): set of column names} for tables matching where_clause
+    """
+    util.cursor.execute(f"""
+        SELECT t.table_schema, t.table_name, array_agg(c.column_name) AS cols
+        FROM tables t
+        JOIN columns c ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+        WHERE {where_clause}
+        GROUP BY t.table_schema, t.table_name
+    """)
+    return {(row["table_schema"], row["table_name"]): set(row["cols"]) for row in util.cursor}
+
+
+def score_pair(orphan_key, orphan_cols, candidate_key, candidate_cols, num_shared):
+    """
+    Confidence between 0 and 1 that candidate is the orphan under a new name:
+    mostly the Jaccard similarity of the column sets, plus some for similar table names.
+    """
+    jaccard = num_shared / (len(orphan_cols) + len(candidate_cols) - num_shared)
+    name_ratio = difflib.SequenceMatcher(None, orphan_key[1], candidate_key[1]).ratio()
+    return COLUMN_WEIGHT * jaccard + NAME_WEIGHT * name_ratio
+
+
+def propose_renames(min_confidence=0.5):
+    """
+    Score every orphaned table against every newly discovered table it shares columns with,
+    in one pass over an inverted column-name index. Returns a list of
+    (confidence, (old_schema, old_table), (new_schema, new_table)), best first, where each
+    orphan and each candidate is used at most once.
+    """
+    orphans = get_tables_with_cols("t.orphaned")
+    candidates = get_tables_with_cols("NOT t.orphaned AND t.description IS NULL")
+    util.db_conn.commit()
+
+    index = collections.defaultdict(list)
+    for candidate_key, candidate_cols in candidates.items():
+        for col in candidate_cols:
+            index[col].append(candidate_key)
+
+    scored = []
+    for orphan_key, orphan_cols in orphans.items():
+        shared_counts = collections.Counter()
+        for col in orphan_cols:
+            shared_counts.update(index.get(col, ()))
+        for candidate_key, num_shared in shared_counts.items():
+            confidence = score_pair(
+                orphan_key, orphan_cols, candidate_key, candidates[candidate_key], num_shared)
+            if confidence >= min_confidence:
+                scored.append((confidence, orphan_key, candidate_key))
+
+    # Greedily keep the best pairs, so no table is matched twice
+    scored.sort(reverse=True)
+    used_orphans, used_candidates = set(), set()
+    proposals = []
+    for confidence, orphan_key, candidate_key in scored:
+        if orphan_key in used_orphans or candidate_key in used_candidates:
+            continue
+        used_orphans.add(orphan_key)
+        used_candidates.add(candidate_key)
+        proposals.append((confidence, orphan_key, candidate_key))
+    return proposals
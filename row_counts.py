@@ -0,0 +1,146 @@
+"""
+Fill in tables.rows_count, either from the planner's estimates (one catalog query for every
+table) or with exact count(*)s spread over a pool of connections.
+"""
+
+import concurrent.futures
+import time
+
+import psycopg2.extensions
+import psycopg2.extras
+
+import util
+
+# Exact counts are written back in batches of this many
+WRITE_BATCH_SIZE = 100
+EXACT_BUDGET = {"workers": 4, "timeout_ms": 60000}
+# Exact counts newer than this are kept over estimates. Older ones give way to the estimate,
+# which is likely closer by then.
+EXACT_COUNT_MAX_AGE = "7 days"
+
+
+class CountTimeoutError(Exception):
+    """
+    Exception for when a count(*) runs past its statement_timeout
+    """
+    pass # pylint: disable=unnecessary-pass
+
+
+def refresh_estimates():
+    """
+    Set every table's rows_count from pg_stat_user_tables.n_live_tup (kept current by the stats
+    collector), or pg_class.reltuples (as of the last VACUUM/ANALYZE) if the stats are empty,
+    e.g. after a stats reset. Tables counted exactly (rows_counted_at) within
+    EXACT_COUNT_MAX_AGE are skipped, so their exact count stands.
+    """
+    util.cursor.execute("""
+        UPDATE tables t
+        SET rows_count = e.estimate, rows_count_as_of = now()
+        FROM (
+            SELECT
+            n.nspname AS table_schema,
+            c.relname AS table_name,
+            coalesce(nullif(s.n_live_tup, 0), greatest(c.reltuples, 0))::bigint AS estimate
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+            WHERE c.relkind IN ('r', 'm')
+        ) e
+        WHERE t.table_schema = e.table_schema
+        AND t.table_name = e.table_name
+        AND NOT t.orphaned
+        AND (t.rows_counted_at IS NULL OR t.rows_counted_at < now() - %s::interval)
+    """, (EXACT_COUNT_MAX_AGE,))
+    num_updated = util.cursor.rowcount
+    util.db_conn.commit()
+    print("Estimated row counts for %i tables" % num_updated)
+
+
+def get_exact_work_list():
+    """
+    Tables to count exactly, never-counted first, then the longest since counted.
+    Within those, smaller tables first, so a run that's cut short still covers the most tables.
+    """
+    util.cursor.execute("""
+        SELECT t.table_schema, t.table_name
+        FROM tables t
+        JOIN pg_namespace n ON n.nspname = t.table_schema
+        JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = t.table_name
+        WHERE NOT t.orphaned
+        AND c.relkind IN ('r', 'p', 'm')
+        AND has_table_privilege(c.oid, 'SELECT')
+        ORDER BY t.rows_counted_at NULLS FIRST, c.reltuples
+    """)
+    work_list = [(row["table_schema"], row["table_name"]) for row in util.cursor]
+    util.db_conn.commit()
+    return work_list
+
+
+def count_table_worker(schema, table):
+    """
+    Runs in a pool thread, using that thread's own connection.
+    Returns (count, counted_at) from the server.
+    """
+    cursor = util.thread_cursor()
+    try:
+        cursor.execute("SET LOCAL statement_timeout = %s", (EXACT_BUDGET["timeout_ms"],))
+        cursor.execute(f'SELECT count(*), now() FROM "{schema}"."{table}"')
+        row = cursor.fetchone()
+    except psycopg2.extensions.QueryCanceledError as e:
+        raise CountTimeoutError(
+            "count took longer than %ims" % EXACT_BUDGET["timeout_ms"]) from e
+    finally:
+        cursor.connection.rollback()
+    return row[0], row[1]
+
+
+def write_exact_counts(counts):
+    """
+    Save exact counts in one statement. `counts` is a list of (schema, table, count, counted_at).
+    """
+    psycopg2.extras.execute_values(util.cursor, """
+        UPDATE tables t
+        SET
+        rows_count = v.rows_count,
+        rows_count_as_of = v.counted_at,
+        rows_counted_at = v.counted_at
+        FROM (VALUES %s) AS v(table_schema, table_name, rows_count, counted_at)
+        WHERE t.table_schema = v.table_schema
+        AND t.table_name = v.table_name
+    """, counts, page_size=WRITE_BATCH_SIZE)
+    util.db_conn.commit()
+
+
+def refresh_exact():
+    """
+    count(*) every table over EXACT_BUDGET["workers"] connections, each count limited to
+    EXACT_BUDGET["timeout_ms"]. Tables that time out or fail keep their old count.
+    """
+    work_list = get_exact_work_list()
+    print("%i tables to count, %i at a time" % (len(work_list), EXACT_BUDGET["workers"]))
+
+    start_time = time.time()
+    num_done, num_failed = 0, 0
+    pending_writes = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=EXACT_BUDGET["workers"]) as executor:
+        futures = {
+            executor.submit(count_table_worker, schema, table): (schema, table)
+            for schema, table in work_list
+        }
+        for future in concurrent.futures.as_completed(futures):
+            schema, table = futures[future]
+            num_done += 1
+            try:
+                count, counted_at = future.result()
+                pending_writes.append((schema, table, count, counted_at))
+            except Exception as e: # pylint: disable=broad-except
+                num_failed += 1
+                print("couldn't count %s.%s: %s" % (schema, table, str(e).strip()))
+            if len(pending_writes) >= WRITE_BATCH_SIZE:
+                write_exact_counts(pending_writes)
+                pending_writes = []
+            if num_done % 100 == 0 or num_done == len(work_list):
+                print("%i/%i tables, %i failed, %.1f tables/sec" % (
+                    num_done, len(work_list), num_failed, num_done / (time.time() - start_time)))
+    if pending_writes:
+        write_exact_counts(pending_writes)
@@ -1,34 +1,250 @@
 """
 Functions for finding and displaying tables and columns.
-Mostly leverages the psql client.
+Output mimics the psql client's aligned, expanded (-x), tuples-only (-t) and wrapped formats.
 """
 
-import subprocess
+import csv
+import decimal
+import itertools
+import json
+import os
+import sys
+import textwrap
 
+import local_cache
 import util
 
+# Rows used to size columns before the rest are streamed out with the same widths
+WIDTH_SAMPLE_SIZE = 1000
+# Total width for wrapped output, same as `\pset columns 150`
+WRAP_COLUMNS = 150
+# Counts kept per schema in the coverage, coverage_history and coverage_deltas tables
+COVERAGE_FIELDS = (
+    "num_objects", "num_with_desc", "num_with_approval", "num_with_example_vals", "num_orphaned")
+# Per-schema coverage: the folded counters plus the deltas not folded in yet (syncs fold them,
+# see migrations/0010_coverage_deltas.sql), so stats stay read-only and still current
+CURRENT_COVERAGE_QUERY = """
+    SELECT object_type, table_schema, %s
+    FROM (
+        SELECT object_type, table_schema, %s FROM coverage
+        UNION ALL
+        SELECT object_type, table_schema, %s FROM coverage_deltas
+    ) c
+    GROUP BY object_type, table_schema
+""" % (
+    ", ".join("sum(%s)::bigint AS %s" % (field, field) for field in COVERAGE_FIELDS),
+    ", ".join(COVERAGE_FIELDS),
+    ", ".join(COVERAGE_FIELDS))
+# coverage_history, plus a row for each day and schema with deltas not folded in yet, at the
+# running total as of that day (what folding would write)
+CURRENT_COVERAGE_HISTORY_QUERY = """
+    WITH pending AS (
+        SELECT
+        d.changed_on AS snapshot_date,
+        d.object_type,
+        d.table_schema,
+        %s
+        FROM (
+            SELECT changed_on, object_type, table_schema, %s
+            FROM coverage_deltas
+            GROUP BY changed_on, object_type, table_schema
+        ) d
+        LEFT JOIN coverage c USING (object_type, table_schema)
+        WINDOW running AS (PARTITION BY d.object_type, d.table_schema ORDER BY d.changed_on)
+    )
+    SELECT * FROM pending
+    UNION ALL
+    SELECT * FROM coverage_history h
+    WHERE NOT EXISTS (
+        SELECT * FROM pending p
+        WHERE p.snapshot_date = h.snapshot_date
+        AND p.object_type = h.object_type
+        AND p.table_schema = h.table_schema)
+""" % (
+    ", ".join(
+        "(coalesce(c.%s, 0) + sum(d.%s) OVER running)::bigint AS %s" % (field, field, field)
+        for field in COVERAGE_FIELDS),
+    ", ".join("sum(%s) AS %s" % (field, field) for field in COVERAGE_FIELDS))
+# Weighted text each table's rows are ranked on by `find` when going to the server. These must
+# match the expression indexes in migrations/0004_search_indexes.sql for the indexes to be used.
+SEARCH_DOCUMENTS = {
+    "tables": """
+        setweight(to_tsvector('english', table_name), 'A')
+        || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    """,
+    "columns": """
+        setweight(to_tsvector('english', column_name), 'A')
+        || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        || setweight(to_tsvector('english', table_name), 'C')
+        || setweight(to_tsvector('english', coalesce(also_goes_by, '')), 'C')
+        || setweight(to_tsvector('english', coalesce(example_vals, '')), 'D')
+    """,
+}
+
+
+def format_value(value):
+    """Render a value the way psql does"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value)
+
+
+def is_numeric(value):
+    """psql right-aligns numbers"""
+    return isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool)
+
+
+def to_json_value(value):
+    """For json.dumps: numerics stay numbers, anything else it can't handle (dates) is a string"""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+def to_csv_value(value):
+    """Render a value for CSV/TSV: empty for NULL, booleans as true/false"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def print_machine_readable(fields, rows, output_format, tuples_only=False):
+    """
+    Write rows as JSON lines ("jsonl"), "csv" or "tsv", each as soon as it arrives, so memory use
+    stays flat however many rows there are. If fields is None, they're the first row's keys.
+    CSV and TSV get a header line (if there are any rows) unless tuples_only.
+    """
+    writer = None
+    if output_format != "jsonl":
+        writer = csv.writer(
+            sys.stdout,
+            dialect="excel-tab" if output_format == "tsv" else "excel",
+            lineterminator="\n")
+    for num_rows, row in enumerate(rows):
+        if num_rows == 0:
+            fields = fields or list(row.keys())
+            if writer and not tuples_only:
+                writer.writerow(fields)
+        # Rows are sequences (DictRow, sqlite3.Row), or dicts
+        values = list(row.values()) if isinstance(row, dict) else list(row)
+        if writer:
+            writer.writerow([to_csv_value(value) for value in values])
+        else:
+            sys.stdout.write(json.dumps(dict(zip(fields, values)), default=to_json_value) + "\n")
+
+
+def get_wrapped_widths(widths, max_total):
+    """Shrink the widest columns until a row fits in max_total characters"""
+    widths = list(widths)
+    while sum(widths) + 3 * len(widths) - 1 > max_total and max(widths) > 10:
+        widest = widths.index(max(widths))
+        widths[widest] -= 1
+    return widths
+
+
+def split_cell(text, width, wrap):
+    """
+    Break a cell into its display lines. Returns (line, marker) pairs, where the marker is
+    "+" if the value continues after a newline, "." if it was wrapped, like psql.
+    """
+    split_lines = []
+    lines = text.split("\n")
+    for line_num, line in enumerate(lines):
+        pieces = textwrap.wrap(line, width) if wrap else [line]
+        pieces = pieces or [""]
+        split_lines += [(piece, ".") for piece in pieces[:-1]]
+        split_lines.append((pieces[-1], "+" if line_num < len(lines) - 1 else " "))
+    return split_lines
+
+
+def print_row(values, widths, wrap):
+    """Print one row, over several lines if cells are multiline or wrapped"""
+    cells = [split_cell(format_value(value), width, wrap) for value, width in zip(values, widths)]
+    num_lines = max(len(cell) for cell in cells)
+    for line_num in range(num_lines):
+        parts = []
+        for cell, width, value in zip(cells, widths, values):
+            text, marker = cell[line_num] if line_num < len(cell) else ("", " ")
+            text = text.rjust(width) if is_numeric(value) else text.ljust(width)
+            parts.append(" " + text + marker)
+        print("|".join(parts).rstrip())
+
+
+def print_aligned(fields, rows, tuples_only=False, wrap=False, title=None):
+    """
+    Print rows as a psql-style aligned table. Column widths come from the first
+    WIDTH_SAMPLE_SIZE rows, and the rest are printed as they arrive.
+    A title is centered over the table, like psql's \\C.
+    """
+    rows = iter(rows)
+    first_rows = list(itertools.islice(rows, WIDTH_SAMPLE_SIZE))
+    widths = [len(field) for field in fields]
+    for row in first_rows:
+        for i, value in enumerate(row):
+            longest_line = max(len(line) for line in format_value(value).split("\n"))
+            widths[i] = max(widths[i], longest_line)
+    if wrap:
+        widths = get_wrapped_widths(widths, WRAP_COLUMNS)
+
+    if not tuples_only:
+        if title:
+            print(title.center(sum(widths) + 3 * len(widths) - 1).rstrip())
+        print("|".join(
+            " " + field.center(width) + " " for field, width in zip(fields, widths)).rstrip())
+        print("+".join("-" * (width + 2) for width in widths))
+
+    num_rows = 0
+    for row in itertools.chain(first_rows, rows):
+        print_row(list(row), widths, wrap)
+        num_rows += 1
+
+    if not tuples_only:
+        print("(%i row%s)" % (num_rows, "" if num_rows == 1 else "s"))
+        print()
+
+
+def print_expanded(fields, rows, tuples_only=False, wrap=False):
+    """Print rows as psql-style expanded records (key | value pairs)"""
+    key_width = max(len(field) for field in fields)
+    num_rows = 0
+    for num_rows, row in enumerate(rows, start=1):
+        values = [format_value(value) for value in row]
+        cells = [split_cell(value, WRAP_COLUMNS - key_width - 3, wrap) for value in values]
+        value_width = max([len(line) for cell in cells for line, _ in cell] + [0])
+        if tuples_only:
+            if num_rows > 1:
+                print()
+        else:
+            record_label = "-[ RECORD %i ]" % num_rows
+            print(record_label.ljust(key_width + 1, "-") + "+" + "-" * (value_width + 1))
+        for field, cell in zip(fields, cells):
+            for line_num, (line, marker) in enumerate(cell):
+                key = field if line_num == 0 else ""
+                print(("%s | %s%s" % (key.ljust(key_width), line, marker)).rstrip())
+
+    if num_rows == 0 and not tuples_only:
+        print("(0 rows)")
+    print()
+
 
 def search(
         patterns, expanded_display=False, tuples_only=False, most_recent=False, wrap=False,
-        null_desc_only=False):
+        null_desc_only=False, output_format=None):
     """
     Find tables or columns matching passed regular expressions.
-    Print according to given formatting options.
+    Print according to given formatting options. With an output_format (jsonl, csv, tsv), every
+    field of the matching rows is written, for scripts.
     """
     if len(patterns) not in (1, 2):
         raise ValueError("Too many patterns provided to search function")
 
-    psql_command = "psql -q << EOF\n"
-    psql_command += f"SET SEARCH_PATH = { util.USER_CONFIG['schema'] },public;\n"
-
-    if expanded_display:
-        psql_command += "\\x\n"
-    if tuples_only:
-        psql_command += "\\t\n"
-    if wrap:
-        psql_command += \
-            "\pset format wrapped\n\pset columns 150" \
-            # pylint: disable=anomalous-backslash-in-string
+    # Same regexes either way: REGEXP in the local cache is backed by Python's re
+    use_cache = local_cache.is_enabled()
+    match_op = "REGEXP" if use_cache else "~"
 
     null_desc_clause = ""
     if null_desc_only:
@@ -39,28 +255,236 @@ def search(
         order_clause = "ORDER BY table_schema, table_name"
         if most_recent:
             order_clause = "ORDER BY inserted_at DESC"
-        psql_command += f"""
-            SELECT
-            table_schema, table_name, description, docs_approved AS aprvd
+        fields = ["table_schema", "table_name", "description", "aprvd"]
+        select_list = "table_schema, table_name, description, docs_approved AS aprvd"
+        if output_format:
+            fields, select_list = None, "*"
+        query = f"""
+            SELECT {select_list}
             FROM tables
-            WHERE table_name ~ '{table_pattern}'
+            WHERE table_name {match_op} %s
             {null_desc_clause}
             {order_clause}
-            ;
         """
-    elif len(patterns) == 2:
+        params = (table_pattern,)
+    else:
         column_pattern = patterns[1]
         order_clause = "ORDER BY table_name, column_name"
         if most_recent:
             order_clause = "ORDER BY inserted_at DESC"
-        psql_command += f"""
-            SELECT table_schema, table_name, column_name, description
+        fields = ["table_schema", "table_name", "column_name", "description"]
+        select_list = ", ".join(fields)
+        if output_format:
+            fields, select_list = None, "*"
+        query = f"""
+            SELECT {select_list}
             FROM columns
-            WHERE table_name ~ '{table_pattern}'
-            AND column_name ~ '{column_pattern}'
+            WHERE table_name {match_op} %s
+            AND column_name {match_op} %s
             {null_desc_clause}
             {order_clause}
-            ;
         """
-    psql_command += "\nEOF"
-    subprocess.call(psql_command, shell=True)
+        params = (table_pattern, column_pattern)
+
+    if use_cache:
+        rows = local_cache.query(query, params)
+    else:
+        rows = util.stream_query(query, params, name="se_search")
+    print_results(fields, rows, expanded_display, tuples_only, wrap, output_format)
+
+
+def find_on_server(text, limit):
+    """
+    Rank tables and columns against free text with Postgres full-text search, best first.
+    Any of the words can match; matching more of them ranks higher. If that finds fewer than
+    `limit`, names similar to the text (typos included) fill in the rest, where pg_trgm is
+    installed (see migrations/0011_trigram_indexes.sql).
+    """
+    rows = util.fetch_all(f"""
+        WITH q AS (
+            SELECT replace(plainto_tsquery('english', %(text)s)::text, ' & ', ' | ')::tsquery
+                AS query
+        )
+        SELECT table_schema, table_name, column_name, description
+        FROM (
+            SELECT table_schema, table_name, NULL AS column_name, description,
+            ts_rank({SEARCH_DOCUMENTS["tables"]}, q.query) AS rank
+            FROM tables, q
+            WHERE {SEARCH_DOCUMENTS["tables"]} @@ q.query
+            UNION ALL
+            SELECT table_schema, table_name, column_name, description,
+            ts_rank({SEARCH_DOCUMENTS["columns"]}, q.query) AS rank
+            FROM columns, q
+            WHERE {SEARCH_DOCUMENTS["columns"]} @@ q.query
+        ) ranked
+        ORDER BY rank DESC
+        LIMIT %(limit)s
+    """, {"text": text, "limit": limit})
+    if len(rows) < limit and has_trigram_matching():
+        found = {tuple(row) for row in rows}
+        rows += [
+            row for row in find_similar_names(text, limit)
+            if tuple(row) not in found][:limit - len(rows)]
+    return rows
+
+
+def has_trigram_matching():
+    """Whether pg_trgm's similarity functions are on the search path"""
+    util.cursor.execute("SELECT to_regproc('similarity') IS NOT NULL AS has_trigram")
+    return util.cursor.fetchone()["has_trigram"]
+
+
+def find_similar_names(text, limit):
+    """
+    Tables and columns whose names are most similar to the text by trigrams, so "custmer" still
+    finds customer_id. Needs pg_trgm.
+    """
+    return util.fetch_all("""
+        SELECT table_schema, table_name, column_name, description
+        FROM (
+            SELECT table_schema, table_name, NULL AS column_name, description,
+            similarity(table_name, %(text)s) AS rank
+            FROM tables
+            WHERE table_name %% %(text)s
+            UNION ALL
+            SELECT table_schema, table_name, column_name, description,
+            similarity(column_name, %(text)s) AS rank
+            FROM columns
+            WHERE column_name %% %(text)s
+        ) ranked
+        ORDER BY rank DESC
+        LIMIT %(limit)s
+    """, {"text": text, "limit": limit})
+
+
+def find(text, limit=20, expanded_display=False, tuples_only=False, wrap=False):
+    """
+    Print the tables and columns whose names, descriptions, example values and aliases best
+    match free text, e.g. "customer email"
+    """
+    fields = ["table_schema", "table_name", "column_name", "description"]
+    if local_cache.is_enabled():
+        rows = local_cache.find(text, limit)
+    else:
+        rows = find_on_server(text, limit)
+        util.db_conn.commit()
+    print_results(fields, rows, expanded_display, tuples_only, wrap)
+
+
+def print_results(
+        fields, rows, expanded_display=False, tuples_only=False, wrap=False, output_format=None):
+    """
+    Print rows in the chosen psql-style format, or as jsonl/csv/tsv if output_format is given,
+    stopping quietly if the reader goes away
+    """
+    try:
+        if output_format:
+            print_machine_readable(fields, rows, output_format, tuples_only)
+        elif expanded_display:
+            print_expanded(fields, rows, tuples_only, wrap)
+        else:
+            print_aligned(fields, rows, tuples_only, wrap)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Output was piped to something like `head` that stopped reading. Point stdout at
+        # devnull so the interpreter doesn't complain again while flushing at exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+
+def print_table_stats(output_format=None):
+    """
+    Print how much of each schema's tables and columns are documented, from the coverage
+    counters the docs tables' triggers keep (see migrations/0010_coverage_deltas.sql).
+    With an output_format, tables and columns come as one set of rows, told apart by object_type.
+    """
+    rows = util.fetch_all("""
+        SELECT
+        object_type,
+        table_schema,
+        num_objects,
+        round(num_with_desc::numeric / num_objects, 2) AS prop_with_desc,
+        round(num_with_approval::numeric / num_objects, 2) AS prop_with_approval,
+        round(num_with_example_vals::numeric / num_objects, 2) AS prop_with_example_vals,
+        num_orphaned
+        FROM (%s) c
+        WHERE num_objects > 0
+        ORDER BY object_type DESC, table_schema
+    """ % CURRENT_COVERAGE_QUERY)
+    util.db_conn.commit()
+    if output_format:
+        print_results(None, rows, output_format=output_format)
+        return
+    print_aligned(
+        ["table_schema", "num_tables", "prop_with_desc", "prop_with_approval", "num_orphaned"],
+        [[row["table_schema"], row["num_objects"], row["prop_with_desc"],
+          row["prop_with_approval"], row["num_orphaned"]]
+         for row in rows if row["object_type"] == "table"],
+        title="Table Stats")
+    print_aligned(
+        ["table_schema", "num_columns", "prop_with_desc", "prop_with_example_vals", "num_orphaned"],
+        [[row["table_schema"], row["num_objects"], row["prop_with_desc"],
+          row["prop_with_example_vals"], row["num_orphaned"]]
+         for row in rows if row["object_type"] == "column"],
+        title="Column Stats")
+
+
+def get_proportion(count, total):
+    """count / total to 2 places, like the stats queries' round(..., 2)"""
+    return round(decimal.Decimal(count) / total, 2) if total else None
+
+
+def print_coverage_trend(days, output_format=None):
+    """
+    Print overall coverage for each of the last `days` days that it changed, from the daily
+    snapshots in coverage_history (and changes not folded into it yet). Schemas that didn't
+    change on a day count at their last snapshot before it.
+    """
+    rows = util.fetch_all("""
+        WITH history AS (%s)
+        SELECT * FROM (
+            SELECT DISTINCT ON (object_type, table_schema) *, false AS in_window
+            FROM history
+            WHERE snapshot_date < current_date - %%(days)s
+            ORDER BY object_type, table_schema, snapshot_date DESC
+        ) before_window
+        UNION ALL
+        SELECT *, true AS in_window FROM history
+        WHERE snapshot_date >= current_date - %%(days)s
+        ORDER BY snapshot_date
+    """ % CURRENT_COVERAGE_HISTORY_QUERY, {"days": days})
+    util.db_conn.commit()
+
+    latest = {}
+    trend = []
+    for snapshot_date, snapshots in itertools.groupby(rows, lambda row: row["snapshot_date"]):
+        in_window = False
+        for row in snapshots:
+            latest[(row["object_type"], row["table_schema"])] = row
+            in_window = row["in_window"]
+        if not in_window:
+            continue
+        totals = {
+            object_type: dict.fromkeys(COVERAGE_FIELDS, 0) for object_type in ("table", "column")}
+        for (object_type, _), row in latest.items():
+            for field in COVERAGE_FIELDS:
+                totals[object_type][field] += row[field]
+        tables, columns = totals["table"], totals["column"]
+        trend.append([
+            snapshot_date,
+            tables["num_objects"],
+            get_proportion(tables["num_with_desc"], tables["num_objects"]),
+            get_proportion(tables["num_with_approval"], tables["num_objects"]),
+            columns["num_objects"],
+            get_proportion(columns["num_with_desc"], columns["num_objects"]),
+            get_proportion(columns["num_with_example_vals"], columns["num_objects"]),
+            tables["num_orphaned"] + columns["num_orphaned"],
+        ])
+
+    fields = [
+        "date", "num_tables", "tables_with_desc", "tables_with_approval", "num_columns",
+        "columns_with_desc", "columns_with_example_vals", "num_orphaned"]
+    if output_format:
+        print_results(fields, trend, output_format=output_format)
+    else:
+        print_aligned(fields, trend, title="Coverage, last %i days" % days)
@@ -1,56 +1,406 @@
 """
 Syncs documentation tables with upstream data tables.
+
+Upstream tables/columns are read from pg_catalog once per sync into a temp table
+(the "snapshot"), and everything else is a set difference against that snapshot.
 """
 
+import psycopg2.errors
+
+import local_cache
 import util
 
+DDL_EVENT_TRIGGERS = ("se_queue_ddl_command_end", "se_queue_sql_drop")
 
-def update_table_list():
+
+def load_upstream_snapshot(schemas=None):
     """
-    Look for new tables upstream that don't exist in documentation tables, and add them.
+    Read every upstream column from pg_catalog into temp table upstream_columns.
+    Mirrors what information_schema.columns would show (same relkinds, same privilege check,
+    same data_type naming), without going through that view's many joins.
+    If `schemas` is given, only those schemas are read.
+    The table is dropped at the end of the transaction.
+    """
+    schema_clause = ""
+    if schemas is not None:
+        schema_clause = "AND n.nspname = ANY(%(schemas)s)"
+    util.cursor.execute(f"""
+        CREATE TEMP TABLE upstream_columns ON COMMIT DROP AS
+        SELECT
+        n.nspname::text AS table_schema,
+        c.relname::text AS table_name,
+        a.attname::text AS column_name,
+        CASE
+            WHEN t.typtype = 'd' THEN
+                CASE
+                    WHEN bt.typelem != 0 AND bt.typlen = -1 THEN 'ARRAY'
+                    WHEN nbt.nspname = 'pg_catalog' THEN format_type(t.typbasetype, NULL)
+                    ELSE 'USER-DEFINED'
+                END
+            WHEN t.typelem != 0 AND t.typlen = -1 THEN 'ARRAY'
+            WHEN nt.nspname = 'pg_catalog' THEN format_type(a.atttypid, NULL)
+            ELSE 'USER-DEFINED'
+        END AS data_type
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_type t ON t.oid = a.atttypid
+        JOIN pg_namespace nt ON nt.oid = t.typnamespace
+        LEFT JOIN pg_type bt ON t.typtype = 'd' AND bt.oid = t.typbasetype
+        LEFT JOIN pg_namespace nbt ON nbt.oid = bt.typnamespace
+        WHERE a.attnum > 0
+        AND NOT a.attisdropped
+        AND c.relkind IN ('r', 'v', 'f', 'p')
+        AND NOT pg_is_other_temp_schema(n.oid)
+        AND (
+            pg_has_role(c.relowner, 'USAGE')
+            OR has_column_privilege(c.oid, a.attnum, 'SELECT, INSERT, UPDATE, REFERENCES')
+        )
+        {schema_clause}
+    """, {"schemas": list(schemas or [])})
+    util.cursor.execute("ANALYZE upstream_columns")
+
+
+def get_ignore_params():
+    """
+    Params to go along with util.TABLE_IGNORE_STRING and the schemas_to_ignore clause
     """
     query_params = []
     query_params += list(util.USER_CONFIG["table_ignore_patterns"])
     query_params.append(tuple(util.USER_CONFIG["schemas_to_ignore"]))
+    return tuple(query_params)
+
 
+def insert_new_tables():
+    """
+    Add tables that are in the snapshot but not in documentation tables
+    """
     query = f"""
-        INSERT INTO tables (table_schema, table_name) (
-            SELECT table_schema, table_name
-            FROM information_schema.columns
-            WHERE 1 = 1
-            { util.TABLE_IGNORE_STRING } 
-            AND table_schema NOT IN %s
+        WITH inserted AS (
+            INSERT INTO tables (table_schema, table_name) (
+                SELECT DISTINCT table_schema, table_name
+                FROM upstream_columns
+                WHERE 1 = 1
+                { util.TABLE_IGNORE_STRING }
+                AND table_schema NOT IN %s
+            )
+            ON CONFLICT DO NOTHING
+            RETURNING table_schema, table_name
         )
-        ON CONFLICT DO NOTHING;
+        INSERT INTO structure_history (table_schema, table_name, change)
+        SELECT table_schema, table_name, 'table added' FROM inserted;
     """
-    util.cursor.execute(query, tuple(query_params))
-    num_inserted_rows = util.cursor.rowcount
-    print("%i rows inserted" % num_inserted_rows)
-    util.db_conn.commit()
+    util.cursor.execute(query, get_ignore_params())
+    return util.cursor.rowcount
 
 
-def update_column_list():
+def insert_new_columns():
     """
-    Insert rows for columns that exist in data tables but not in documentation tables
+    Add columns that are in the snapshot but not in documentation tables,
+    for tables we document.
     """
-    query_params = []
-    query_params += list(util.USER_CONFIG["table_ignore_patterns"])
-    query_params.append(tuple(util.USER_CONFIG["schemas_to_ignore"]))
-
     query = f"""
-        INSERT INTO columns (table_schema, table_name, column_name, data_type) (
-            SELECT table_schema, table_name, column_name, data_type
-            FROM information_schema.columns
-            WHERE 1 = 1
-            { util.TABLE_IGNORE_STRING }
-            AND table_schema NOT IN %s
-            AND table_name IN (SELECT table_name FROM tables)
+        WITH inserted AS (
+            INSERT INTO columns (table_schema, table_name, column_name, data_type) (
+                SELECT table_schema, table_name, column_name, data_type
+                FROM upstream_columns
+                WHERE 1 = 1
+                { util.TABLE_IGNORE_STRING }
+                AND table_schema NOT IN %s
+                AND (table_schema, table_name) IN (SELECT table_schema, table_name FROM tables)
+            )
+            ON CONFLICT DO NOTHING
+            RETURNING table_schema, table_name, column_name, data_type
+        )
+        INSERT INTO structure_history (table_schema, table_name, column_name, change, new_data_type)
+        SELECT table_schema, table_name, column_name, 'added', data_type FROM inserted;
+    """
+    util.cursor.execute(query, get_ignore_params())
+    return util.cursor.rowcount
+
+
+def update_data_types():
+    """
+    Bring data_type up to date for documented columns whose upstream type changed
+    """
+    util.cursor.execute("""
+        WITH changed AS (
+            SELECT c.id, c.data_type AS old_data_type, u.data_type AS new_data_type
+            FROM columns c
+            JOIN upstream_columns u
+            ON u.table_schema = c.table_schema
+            AND u.table_name = c.table_name
+            AND u.column_name = c.column_name
+            WHERE u.data_type != c.data_type
+        ),
+        updated AS (
+            UPDATE columns c
+            SET data_type = changed.new_data_type
+            FROM changed
+            WHERE c.id = changed.id
+            RETURNING c.table_schema, c.table_name, c.column_name,
+            changed.old_data_type, changed.new_data_type
+        )
+        INSERT INTO structure_history (
+            table_schema, table_name, column_name, change, old_data_type, new_data_type)
+        SELECT table_schema, table_name, column_name, 'type changed', old_data_type, new_data_type
+        FROM updated
+    """)
+    return util.cursor.rowcount
+
+
+def set_sync_scope(scope_query, params=None):
+    """
+    Limit orphan checks to the (table_schema, table_name) pairs returned by scope_query,
+    for the rest of the transaction.
+    """
+    util.cursor.execute(f"""
+        CREATE TEMP TABLE sync_scope ON COMMIT DROP AS
+        {scope_query}
+    """, params)
+
+
+def mark_orphaned_tables(scoped=False):
+    """
+    Mark documented tables that are no longer in the snapshot.
+    If `scoped`, only documented tables in sync_scope are checked.
+    """
+    scope_clause = ""
+    if scoped:
+        scope_clause = """
+            AND (t.table_schema, t.table_name) IN (
+                SELECT table_schema, table_name FROM sync_scope)"""
+    util.cursor.execute(f"""
+        WITH orphaned AS (
+            UPDATE tables t
+            SET orphaned = True
+            WHERE (orphaned IS NOT True) AND NOT EXISTS (
+                SELECT * FROM upstream_columns u
+                WHERE u.table_name = t.table_name
+                AND u.table_schema = t.table_schema)
+            {scope_clause}
+            RETURNING t.table_schema, t.table_name
+        )
+        INSERT INTO structure_history (table_schema, table_name, change)
+        SELECT table_schema, table_name, 'table removed' FROM orphaned;
+    """)
+    return util.cursor.rowcount
+
+
+def mark_orphaned_columns(scoped=False):
+    """
+    Mark documented columns that are no longer in the snapshot.
+    If `scoped`, only documented columns of tables in sync_scope are checked.
+    """
+    scope_clause = ""
+    if scoped:
+        scope_clause = """
+            AND (t.table_schema, t.table_name) IN (
+                SELECT table_schema, table_name FROM sync_scope)"""
+    util.cursor.execute(f"""
+        WITH orphaned AS (
+            UPDATE columns t
+            SET orphaned = True
+            WHERE (orphaned IS NOT True) AND NOT EXISTS (
+                SELECT * FROM upstream_columns u
+                WHERE u.table_name = t.table_name
+                AND u.table_schema = t.table_schema
+                AND u.column_name = t.column_name
+            )
+            {scope_clause}
+            RETURNING t.table_schema, t.table_name, t.column_name, t.data_type
+        )
+        INSERT INTO structure_history (
+            table_schema, table_name, column_name, change, old_data_type)
+        SELECT table_schema, table_name, column_name, 'removed', data_type FROM orphaned;
+    """)
+    return util.cursor.rowcount
+
+
+def mark_moved_tables_orphaned():
+    """
+    Mark documented tables in any schema that no longer exist upstream, plus their columns.
+    Only looks tables up by name in pg_class, so it's cheap enough to run on every incremental
+    refresh, and catches tables moved out of a schema (which the DDL queue only sees from the
+    new schema's side).
+    """
+    util.cursor.execute("""
+        WITH orphaned AS (
+            UPDATE tables t
+            SET orphaned = True
+            WHERE (orphaned IS NOT True) AND NOT EXISTS (
+                SELECT * FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = t.table_schema
+                AND c.relname = t.table_name
+                AND c.relkind IN ('r', 'v', 'f', 'p'))
+            RETURNING t.table_schema, t.table_name
         )
-        ON CONFLICT DO NOTHING;
+        INSERT INTO structure_history (table_schema, table_name, change)
+        SELECT table_schema, table_name, 'table removed' FROM orphaned;
+    """)
+    num_tables = util.cursor.rowcount
+    util.cursor.execute("""
+        WITH orphaned AS (
+            UPDATE columns c
+            SET orphaned = True
+            FROM tables t
+            WHERE t.orphaned
+            AND (c.orphaned IS NOT True)
+            AND c.table_schema = t.table_schema
+            AND c.table_name = t.table_name
+            RETURNING c.table_schema, c.table_name, c.column_name, c.data_type
+        )
+        INSERT INTO structure_history (
+            table_schema, table_name, column_name, change, old_data_type)
+        SELECT table_schema, table_name, column_name, 'removed', data_type FROM orphaned;
+    """)
+    return num_tables, util.cursor.rowcount
+
+
+def compute_upstream_fingerprints():
+    """
+    Hash each snapshot table's column names and types into temp table upstream_fingerprints,
+    and roll those up into one hash per schema in upstream_schema_fingerprints. Ignored schemas
+    and tables aren't hashed, so changes to them don't trigger a rescan, and changing what's
+    ignored shows up as a change on the next sync.
+    """
+    util.cursor.execute(f"""
+        CREATE TEMP TABLE upstream_fingerprints ON COMMIT DROP AS
+        SELECT
+        table_schema,
+        table_name,
+        md5(string_agg(column_name || ' ' || data_type, ',' ORDER BY column_name)) AS fingerprint
+        FROM upstream_columns
+        WHERE 1 = 1
+        { util.TABLE_IGNORE_STRING }
+        AND table_schema NOT IN %s
+        GROUP BY table_schema, table_name
+    """, get_ignore_params())
+    util.cursor.execute("""
+        CREATE TEMP TABLE upstream_schema_fingerprints ON COMMIT DROP AS
+        SELECT
+        table_schema,
+        md5(string_agg(table_name || ' ' || fingerprint, ',' ORDER BY table_name)) AS fingerprint
+        FROM upstream_fingerprints
+        GROUP BY table_schema
+    """)
 
+
+def narrow_to_changed_tables():
+    """
+    Compare snapshot hashes with the stored ones, and set the sync scope to the tables that
+    were added, removed or changed. Unchanged schemas are skipped without looking at their
+    tables. Documented tables with no fingerprint on either side (e.g. in a schema dropped
+    before it was ever fingerprinted, or imported from another instance) are in scope too, or
+    they'd never be orphaned. Snapshot rows outside the scope are dropped, so later steps
+    don't diff them. Returns (number of changed schemas, number of changed tables).
     """
-    util.cursor.execute(query, tuple(query_params))
-    num_inserted_rows = util.cursor.rowcount
+    set_sync_scope(f"""
+        WITH changed_schemas AS (
+            SELECT table_schema
+            FROM upstream_schema_fingerprints u
+            FULL JOIN schema_fingerprints s USING (table_schema)
+            WHERE u.fingerprint IS DISTINCT FROM s.fingerprint
+        )
+        SELECT table_schema, table_name
+        FROM (
+            SELECT * FROM upstream_fingerprints
+            WHERE table_schema IN (SELECT table_schema FROM changed_schemas)
+        ) u
+        FULL JOIN (
+            SELECT * FROM table_fingerprints
+            WHERE table_schema IN (SELECT table_schema FROM changed_schemas)
+        ) s USING (table_schema, table_name)
+        WHERE u.fingerprint IS DISTINCT FROM s.fingerprint
+        UNION
+        SELECT table_schema, table_name
+        FROM (
+            SELECT table_schema, table_name FROM tables WHERE orphaned IS NOT True
+            UNION
+            SELECT table_schema, table_name FROM columns WHERE orphaned IS NOT True
+        ) d
+        WHERE 1 = 1
+        { util.TABLE_IGNORE_STRING }
+        AND table_schema NOT IN %s
+        AND NOT EXISTS (
+            SELECT * FROM upstream_fingerprints u
+            WHERE u.table_schema = d.table_schema AND u.table_name = d.table_name)
+        AND NOT EXISTS (
+            SELECT * FROM table_fingerprints s
+            WHERE s.table_schema = d.table_schema AND s.table_name = d.table_name)
+        AND (
+            table_schema IN (SELECT table_schema FROM changed_schemas)
+            OR (
+                table_schema NOT IN (SELECT table_schema FROM upstream_schema_fingerprints)
+                AND table_schema NOT IN (SELECT table_schema FROM schema_fingerprints)))
+    """, get_ignore_params())
+    util.cursor.execute("""
+        DELETE FROM upstream_columns
+        WHERE (table_schema, table_name) NOT IN (SELECT table_schema, table_name FROM sync_scope)
+    """)
+    util.cursor.execute("""
+        SELECT count(DISTINCT table_schema) AS num_schemas, count(1) AS num_tables
+        FROM sync_scope
+    """)
+    row = util.cursor.fetchone()
+    return row["num_schemas"], row["num_tables"]
+
+
+def save_fingerprints(schemas=None):
+    """
+    Store the snapshot's hashes. If `schemas` is given, the snapshot only covered those schemas,
+    so only their stored hashes are replaced.
+    """
+    schema_clause = ""
+    if schemas is not None:
+        schema_clause = "AND table_schema = ANY(%(schemas)s)"
+    params = {"schemas": list(schemas or [])}
+    util.cursor.execute(f"""
+        DELETE FROM table_fingerprints s
+        WHERE NOT EXISTS (
+            SELECT * FROM upstream_fingerprints u
+            WHERE u.table_schema = s.table_schema AND u.table_name = s.table_name)
+        {schema_clause}
+    """, params)
+    util.cursor.execute("""
+        INSERT INTO table_fingerprints (table_schema, table_name, fingerprint)
+        SELECT table_schema, table_name, fingerprint FROM upstream_fingerprints
+        ON CONFLICT (table_schema, table_name) DO UPDATE
+        SET fingerprint = EXCLUDED.fingerprint, updated_at = CURRENT_TIMESTAMP
+        WHERE table_fingerprints.fingerprint != EXCLUDED.fingerprint
+    """)
+    util.cursor.execute(f"""
+        DELETE FROM schema_fingerprints s
+        WHERE NOT EXISTS (
+            SELECT * FROM upstream_schema_fingerprints u WHERE u.table_schema = s.table_schema)
+        {schema_clause}
+    """, params)
+    util.cursor.execute("""
+        INSERT INTO schema_fingerprints (table_schema, fingerprint)
+        SELECT table_schema, fingerprint FROM upstream_schema_fingerprints
+        ON CONFLICT (table_schema) DO UPDATE
+        SET fingerprint = EXCLUDED.fingerprint, updated_at = CURRENT_TIMESTAMP
+        WHERE schema_fingerprints.fingerprint != EXCLUDED.fingerprint
+    """)
+
+
+def update_table_list():
+    """
+    Look for new tables upstream that don't exist in documentation tables, and add them.
+    """
+    load_upstream_snapshot()
+    num_inserted_rows = insert_new_tables()
+    print("%i rows inserted" % num_inserted_rows)
+    util.db_conn.commit()
+
+
+def update_column_list():
+    """
+    Insert rows for columns that exist in data tables but not in documentation tables
+    """
+    load_upstream_snapshot()
+    num_inserted_rows = insert_new_columns()
     print("%i rows inserted" % num_inserted_rows)
     util.db_conn.commit()
 
@@ -59,40 +409,186 @@ def update_orphans():
     """
     Marks tables/columns as orphaned, if their corresponding upstream entry has disappeared.
     """
-    table_query = f"""
-        WITH isc AS (
-            SELECT DISTINCT table_schema, table_name
-            FROM information_schema.columns
-        )
+    load_upstream_snapshot()
+    num_updated_rows = mark_orphaned_tables()
+    print("%i tables marked as orphaned" % num_updated_rows)
+    num_updated_rows = mark_orphaned_columns()
+    print("%i columns marked as orphaned" % num_updated_rows)
+    util.db_conn.commit()
+
 
-        UPDATE tables t
-        SET orphaned = True
-        WHERE (orphaned IS NOT True) AND NOT EXISTS (
-            SELECT * FROM isc
-            WHERE table_name = t.table_name
-            AND table_schema = t.table_schema);
+def run_sync_steps(scoped=False):
     """
-    util.cursor.execute(table_query)
-    num_updated_rows = util.cursor.rowcount
-    print("%i tables marked as orphaned" % num_updated_rows)
+    Apply every sync step against an already loaded snapshot, without committing.
+    Returns a summary of what changed, as a list of (description, count).
+    """
+    return [
+        ("tables inserted", insert_new_tables()),
+        ("columns inserted", insert_new_columns()),
+        ("column data types updated", update_data_types()),
+        ("tables marked as orphaned", mark_orphaned_tables(scoped)),
+        ("columns marked as orphaned", mark_orphaned_columns(scoped)),
+    ]
+
+
+def print_summary(summary):
+    """Print what a sync changed"""
+    for description, count in summary:
+        print("%i %s" % (count, description))
+
+
+def fold_coverage_deltas():
+    """
+    Fold the coverage changes the docs tables' triggers have logged into the coverage and
+    coverage_history counters (see migrations/0010_coverage_deltas.sql). Every sync does this,
+    after committing, so its own writes never wait on it. `se stats` adds in whatever hasn't
+    been folded yet, so this only keeps the log short.
+    """
+    util.cursor.execute("SELECT fold_coverage_deltas()")
     util.db_conn.commit()
-    
-    column_query = """
-        WITH isc AS (
-            SELECT DISTINCT table_schema, table_name, column_name
-            FROM information_schema.columns
-        )
 
-        UPDATE columns t
-        SET orphaned = True
-        WHERE (orphaned IS NOT True) AND NOT EXISTS (
-            SELECT * FROM isc
-            WHERE table_name = t.table_name
-            AND table_schema = t.table_schema
-            AND column_name = t.column_name
-        );
-    """
-    util.cursor.execute(column_query)
-    num_updated_rows = util.cursor.rowcount
-    print("%i columns marked as orphaned" % num_updated_rows)
+
+def prune_deleted_rows():
+    """
+    Delete deleted_rows tombstones older than local_cache.TOMBSTONE_RETENTION. Caches that
+    haven't refreshed within that long reload in full, so they don't need them.
+    """
+    util.cursor.execute(
+        "DELETE FROM deleted_rows WHERE deleted_at < localtimestamp - %s",
+        (local_cache.TOMBSTONE_RETENTION,))
+    util.db_conn.commit()
+
+
+def sync_all(force=False):
+    """
+    Add new tables and columns, update changed data types, and mark orphans,
+    all from one catalog snapshot and in one transaction. Prints a summary of what changed.
+    Only schemas/tables whose fingerprint changed since the last sync are diffed,
+    unless `force` is set.
+    """
+    load_upstream_snapshot()
+    compute_upstream_fingerprints()
+    if force:
+        summary = run_sync_steps()
+    else:
+        num_schemas, num_tables = narrow_to_changed_tables()
+        print("%i tables changed in %i schemas" % (num_tables, num_schemas))
+        summary = run_sync_steps(scoped=True)
+    save_fingerprints()
     util.db_conn.commit()
+    fold_coverage_deltas()
+    prune_deleted_rows()
+    print_summary(summary)
+
+
+def get_ddl_queue_state():
+    """
+    Read the DDL queue's state and everything queued since the last refresh, in one statement
+    so that both come from the same snapshot. Returns None if the queue isn't installed or its
+    event triggers aren't enabled.
+    """
+    try:
+        util.cursor.execute("""
+            SELECT
+            s.needs_full_sync,
+            count(q.seq) AS num_queued,
+            coalesce(array_agg(q.seq) FILTER (WHERE q.seq IS NOT NULL), '{}') AS seqs,
+            array_remove(array_agg(DISTINCT q.schema_name), NULL) AS schemas,
+            (
+                SELECT count(1) FROM pg_event_trigger
+                WHERE evtname IN %s AND evtenabled != 'D'
+            ) AS num_triggers
+            FROM ddl_queue_state s
+            LEFT JOIN ddl_queue q ON True
+            GROUP BY s.needs_full_sync
+        """, (DDL_EVENT_TRIGGERS,))
+    except psycopg2.errors.UndefinedTable:
+        util.db_conn.rollback()
+        return None
+    state = util.cursor.fetchone()
+    if not state or state["num_triggers"] != len(DDL_EVENT_TRIGGERS):
+        return None
+    return state
+
+
+def sync_incremental():
+    """
+    Sync only the schemas touched by DDL queued since the last refresh, in one transaction.
+    Falls back to a full sync if the queue isn't installed or enabled, or is flagged as
+    missing changes. Needs custom_queries/ddl_event_queue.psql.
+    """
+    state = get_ddl_queue_state()
+    if state is None:
+        print("DDL queue isn't installed or enabled, doing a full sync")
+        sync_all()
+        return
+
+    # Only the rows read above are handled and deleted. Anything committed since, whatever its
+    # number, is left for the next refresh. If the snapshot below already saw it, syncing it
+    # again later does nothing.
+    if state["needs_full_sync"]:
+        print("DDL queue can't be trusted (first run, or changes it couldn't queue), "
+              "doing a full sync")
+        load_upstream_snapshot()
+        compute_upstream_fingerprints()
+        summary = run_sync_steps()
+        save_fingerprints()
+        util.cursor.execute("UPDATE ddl_queue_state SET needs_full_sync = False")
+    else:
+        schemas = state["schemas"]
+        print("%i queued DDL changes in %i schemas" % (state["num_queued"], len(schemas)))
+        load_upstream_snapshot(schemas)
+        compute_upstream_fingerprints()
+        set_sync_scope("""
+            SELECT DISTINCT table_schema, table_name FROM upstream_columns
+            UNION
+            SELECT table_schema, table_name FROM tables WHERE table_schema = ANY(%s)
+        """, (schemas,))
+        summary = run_sync_steps(scoped=True)
+        save_fingerprints(schemas)
+        num_moved_tables, num_moved_cols = mark_moved_tables_orphaned()
+        summary.append(("tables elsewhere marked as orphaned", num_moved_tables))
+        summary.append(("columns of orphaned tables marked as orphaned", num_moved_cols))
+
+    util.cursor.execute("DELETE FROM ddl_queue WHERE seq = ANY(%s)", (state["seqs"],))
+    util.db_conn.commit()
+    fold_coverage_deltas()
+    prune_deleted_rows()
+    print_summary(summary)
+
+
+def print_history(name):
+    """
+    Print the recorded structural changes for a table, oldest first.
+    `name` is schema.table, or just a table name to match it in any schema.
+    """
+    if "." in name:
+        table_schema, table_name = name.split(".", 1)
+        util.cursor.execute("""
+            SELECT * FROM structure_history
+            WHERE table_schema = %s AND table_name = %s
+            ORDER BY observed_at, id
+        """, (table_schema, table_name))
+    else:
+        util.cursor.execute("""
+            SELECT * FROM structure_history
+            WHERE table_name = %s
+            ORDER BY observed_at, id
+        """, (name,))
+    rows = util.cursor.fetchall()
+    if not rows:
+        print("No structural changes recorded for %s" % name)
+        return
+
+    for row in rows:
+        if row["change"] == "type changed":
+            detail = "%s -> %s" % (row["old_data_type"], row["new_data_type"])
+        else:
+            detail = row["new_data_type"] or row["old_data_type"] or ""
+        print("%s  %s.%s  %-13s %s %s" % (
+            row["observed_at"].strftime("%Y-%m-%d %H:%M:%S"),
+            row["table_schema"],
+            row["table_name"],
+            row["change"],
+            row["column_name"] or "",
+            detail))
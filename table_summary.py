@@ -4,6 +4,8 @@ Pretty-prints a summary of a table and its columns, e.g. for reading in a pager.
 
 import textwrap
 
+import local_cache
+import search
 import util
 
 
@@ -23,55 +25,95 @@ def format_table_summary(convenient_name):
     """
     Assembles a formatted string with an in-depth summary of table and columns
     """
+    return "\n".join(iter_table_summary(convenient_name))
+
+
+def iter_table_summary(convenient_name):
+    """
+    Get a generator of the lines of an in-depth summary of table and columns. Column rows are
+    streamed and formatted as they arrive, so a pager can show the start right away.
+    The name is looked up straight away, so a bad one fails before anything is shown.
+    """
     table_record, object_type = util.get_record_from_name(convenient_name)
     assert object_type == "table"
-    table_schema, table_name = table_record["table_schema"], table_record["table_name"]
+    return iter_summary_lines(table_record)
 
-    output = []
-    output.append("\n")
-
-    output.append("-" * 100)
-    output.append(("    TABLE %s.%s    " % (table_schema, table_name)).center(100))
-    output.append("-" * 100)
-    output.append("")
-    output.append("Description:")
-    output.append(wrap_and_indent(table_record["description"]))
-    output.append("")
-    output.append("Common joins: %s" % table_record["common_joins"])
-    pretty_rows_count = "{:,}".format(
-        table_record["rows_count"]) if table_record["rows_count"] else "unknown"
-    output.append(
-        "Latest num rows: {} as of {}".format(pretty_rows_count, table_record["rows_count_as_of"]))
-    output.append("Update frequency: %s" % table_record["intended_update_frequency"])
-    output.append("Deprecated: %s" % table_record["deprecated"])
-    output.append("Docs Approved: %s" % table_record["docs_approved"])
-    output.append("Last docs approval at: %s" % table_record["last_approval_at"])
-    output.append("")
-    output.append("-" * 100)
-    output.append("   COLUMN DETAILS    ".center(100))
-    output.append("-" * 100)
-    output.append("")
-
-    util.cursor.execute("""
+
+def get_column_rows(table_schema, table_name):
+    """A table's column rows, sorted by column_name, streamed from the cache or server"""
+    query = """
         SELECT *
         FROM columns
         WHERE table_schema = %s AND table_name = %s
         ORDER BY column_name
-    """, (table_schema, table_name))
-    for row in util.cursor.fetchall():
+    """
+    params = (table_schema, table_name)
+    if local_cache.is_enabled():
+        return local_cache.query(query, params)
+    return util.stream_query(query, params, name="se_describe")
+
+
+def print_table_columns(convenient_name, output_format):
+    """
+    Write every field of each of a table's columns as jsonl, csv or tsv, for scripts, instead of
+    the summary text
+    """
+    table_record, object_type = util.get_record_from_name(convenient_name)
+    assert object_type == "table"
+    search.print_results(
+        None,
+        get_column_rows(table_record["table_schema"], table_record["table_name"]),
+        output_format=output_format)
+
+
+def iter_summary_lines(table_record, column_rows=None):
+    """
+    Yields the summary lines for a row from the tables table. Its column rows are fetched
+    unless passed in (sorted by column_name).
+    """
+    table_schema, table_name = table_record["table_schema"], table_record["table_name"]
+
+    yield "\n"
+    yield "-" * 100
+    yield ("    TABLE %s.%s    " % (table_schema, table_name)).center(100)
+    yield "-" * 100
+    yield ""
+    yield "Description:"
+    yield wrap_and_indent(table_record["description"])
+    yield ""
+    yield "Common joins: %s" % table_record["common_joins"]
+    pretty_rows_count = "{:,}".format(
+        table_record["rows_count"]) if table_record["rows_count"] else "unknown"
+    counted_at, count_as_of = table_record["rows_counted_at"], table_record["rows_count_as_of"]
+    if table_record["rows_count"] and (
+            counted_at is None or (count_as_of is not None and counted_at < count_as_of)):
+        pretty_rows_count += " (estimate)"
+    yield "Latest num rows: {} as of {}".format(
+        pretty_rows_count, table_record["rows_count_as_of"])
+    yield "Update frequency: %s" % table_record["intended_update_frequency"]
+    yield "Deprecated: %s" % table_record["deprecated"]
+    yield "Docs Approved: %s" % table_record["docs_approved"]
+    yield "Last docs approval at: %s" % table_record["last_approval_at"]
+    yield ""
+    yield "-" * 100
+    yield "   COLUMN DETAILS    ".center(100)
+    yield "-" * 100
+    yield ""
+
+    if column_rows is None:
+        column_rows = get_column_rows(table_schema, table_name)
+    for row in column_rows:
         col_desc = row["description"]
         example_vals = row["example_vals"]
         also_goes_by = row["also_goes_by"]
-        output.append("\033[1;4m%s\033[0m" % row["column_name"])
+        yield "\033[1;4m%s\033[0m" % row["column_name"]
         if col_desc:
-            output.append(wrap_and_indent(col_desc))
+            yield wrap_and_indent(col_desc)
         if example_vals:
-            output.append("\n    Example values:")
-            output.append(wrap_and_indent(example_vals))
+            yield "\n    Example values:"
+            yield wrap_and_indent(example_vals)
         if also_goes_by:
-            output.append("\n    Also goes by:")
-            output.append(wrap_and_indent(also_goes_by))
-        output.append("")
-        output.append("-" * 100)
-
-    return "\n".join(output)
+            yield "\n    Also goes by:"
+            yield wrap_and_indent(also_goes_by)
+        yield ""
+        yield "-" * 100
@@ -0,0 +1,74 @@
+"""
+Tests for choosing example values, which don't need a database
+"""
+
+import unittest
+
+import auto_add_example_vals
+
+
+class PickExamplesTest(unittest.TestCase):
+    """pick_examples keeps at most five values, spread out by rank"""
+
+    def test_few_values_kept_as_is(self):
+        self.assertEqual(auto_add_example_vals.pick_examples([]), [])
+        self.assertEqual(auto_add_example_vals.pick_examples(["a", "b", "c"]), ["a", "b", "c"])
+        vals = ["a", "b", "c", "d", "e"]
+        self.assertEqual(auto_add_example_vals.pick_examples(vals), vals)
+
+    def test_under_ten_keeps_top_four_and_last(self):
+        vals = [str(i) for i in range(8)]
+        self.assertEqual(auto_add_example_vals.pick_examples(vals), ["0", "1", "2", "3", "7"])
+
+    def test_ten_or_more_keeps_every_other(self):
+        vals = [str(i) for i in range(20)]
+        self.assertEqual(auto_add_example_vals.pick_examples(vals), ["0", "2", "4", "6", "8"])
+
+
+class TruncateValTest(unittest.TestCase):
+    """truncate_val shortens long values and stringifies the rest"""
+
+    def test_short_value(self):
+        self.assertEqual(auto_add_example_vals.truncate_val(42), "42")
+
+    def test_long_value(self):
+        truncated = auto_add_example_vals.truncate_val("x" * 100)
+        self.assertEqual(truncated, "x" * 80 + "...[truncated]")
+
+
+def stats_row(null_frac=0, mcv=None, mcv_freqs=None, histogram=None):
+    """A pg_stats row as fill_from_stats reads it"""
+    return {"null_frac": null_frac, "mcv": mcv, "mcv_freqs": mcv_freqs, "histogram": histogram}
+
+
+class ExamplesFromStatsTest(unittest.TestCase):
+    """examples_from_stats turns pg_stats into example values"""
+
+    def test_most_common_values_by_frequency(self):
+        row = stats_row(mcv=["b", "a", "c"], mcv_freqs=[0.2, 0.5, 0.1])
+        self.assertEqual(auto_add_example_vals.examples_from_stats(row), ["a", "b", "c"])
+
+    def test_null_ranked_among_most_common(self):
+        row = stats_row(null_frac=0.3, mcv=["b", "a"], mcv_freqs=[0.2, 0.4])
+        self.assertEqual(auto_add_example_vals.examples_from_stats(row), ["a", "NULL", "b"])
+
+    def test_histogram_when_no_most_common(self):
+        row = stats_row(histogram=list(range(101)))
+        self.assertEqual(
+            auto_add_example_vals.examples_from_stats(row), ["0", "20", "40", "60", "80"])
+
+    def test_short_histogram(self):
+        row = stats_row(histogram=[1, 5, 9])
+        self.assertEqual(auto_add_example_vals.examples_from_stats(row), ["1", "5", "9"])
+
+    def test_all_null(self):
+        row = stats_row(null_frac=1)
+        self.assertEqual(auto_add_example_vals.examples_from_stats(row), ["NULL"])
+
+    def test_no_stats(self):
+        self.assertIsNone(auto_add_example_vals.examples_from_stats(stats_row()))
+        self.assertIsNone(auto_add_example_vals.examples_from_stats(stats_row(null_frac=None)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Tests for batch editing a table's column docs in one file, which don't need a database
+"""
+
+import os
+import tempfile
+import unittest
+
+import doc_col
+
+
+def column_row(row_id, column_name, description=None, example_vals=None):
+    """A columns row with the fields write_batch_file and get_batch_changes look at"""
+    return {
+        "id": row_id, "table_schema": "s", "table_name": "t", "column_name": column_name,
+        "data_type": "text", "description": description, "example_vals": example_vals,
+    }
+
+
+class BatchFileTest(unittest.TestCase):
+    """A batch file round trip, and the changes read back from it"""
+
+    def setUp(self):
+        edit_f = tempfile.NamedTemporaryFile("w", suffix=".tmp", delete=False)
+        edit_f.close()
+        self.file_path = edit_f.name
+        self.rows = [
+            column_row(1, "id", description="Primary key"),
+            column_row(2, "status", example_vals="{new,done}"),
+        ]
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def edit(self, replacements):
+        """Write the batch file, apply (old, new) text replacements to it and parse it back"""
+        doc_col.write_batch_file(self.rows, self.file_path)
+        with open(self.file_path) as edit_f:
+            text = edit_f.read()
+        for old, new in replacements:
+            self.assertIn(old, text)
+            text = text.replace(old, new)
+        with open(self.file_path, "w") as edit_f:
+            edit_f.write(text)
+        return doc_col.parse_batch_file(self.file_path)
+
+    def test_round_trip(self):
+        self.assertEqual(self.edit([]), {
+            "id": {"description": "Primary key", "example_vals": ""},
+            "status": {"description": "", "example_vals": "{new,done}"},
+        })
+        self.assertEqual(doc_col.get_batch_changes(self.rows, self.edit([])), [])
+
+    def test_multiline_value(self):
+        edited = self.edit([("___description: Primary key", "___description: Line 1\nLine 2")])
+        self.assertEqual(edited["id"]["description"], "Line 1\nLine 2")
+
+    def test_changed_fields_only(self):
+        edited = self.edit([
+            ("___description: Primary key", "___description: Row id"),
+            ("(text)\n___description: \n", "(text)\n___description: State\n"),
+        ])
+        self.assertEqual(doc_col.get_batch_changes(self.rows, edited),
+                         [(1, {"description": "Row id"}), (2, {"description": "State"})])
+
+    def test_blank_clears(self):
+        edited = self.edit([("___description: Primary key", "___description: ")])
+        self.assertEqual(doc_col.get_batch_changes(self.rows, edited), [(1, {"description": None})])
+
+    def test_unknown_column(self):
+        edited = self.edit([("#### column status", "#### column state")])
+        with self.assertRaisesRegex(ValueError, "Unknown columns in file: state"):
+            doc_col.get_batch_changes(self.rows, edited)
+
+    def test_uneditable_field(self):
+        with self.assertRaisesRegex(ValueError, "Can't edit field data_type of column id"):
+            doc_col.get_batch_changes(self.rows, {"id": {"data_type": "int"}})
+
+    def test_unknown_field(self):
+        with self.assertRaisesRegex(ValueError, "Can't edit field nope of column id"):
+            doc_col.get_batch_changes(self.rows, {"id": {"nope": "x"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
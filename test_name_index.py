@@ -0,0 +1,93 @@
+"""
+Tests for resolving and completing names from the in-memory index, which don't need a database
+"""
+
+import unittest
+from unittest import mock
+
+import local_cache
+import name_index
+
+TABLES = [
+    ("public", "users", 1),
+    ("sales", "users", 2),
+    ("sales", "orders", 3),
+    ("sales2", "orders", 4),
+]
+COLUMNS = [
+    ("public", "users", "id", 11),
+    ("public", "users", "email", 12),
+    ("sales", "users", "id", 13),
+    ("sales", "orders", "id", 14),
+    ("sales", "orders", "user_id", 15),
+]
+
+
+def fetch(query):
+    """Stand-in for util.fetch_all over the docs tables above"""
+    if "column_name" in query:
+        return [{"table_schema": schema, "table_name": table, "column_name": column, "id": row_id}
+                for schema, table, column, row_id in COLUMNS]
+    return [{"table_schema": schema, "table_name": table, "id": row_id}
+            for schema, table, row_id in TABLES]
+
+
+class NameIndexTest(unittest.TestCase):
+    """resolve and complete, on an index built from the rows above"""
+
+    def setUp(self):
+        patchers = [
+            mock.patch.object(local_cache, "is_enabled", return_value=False),
+            mock.patch.object(name_index, "_index", name_index.build(fetch)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_keys_sorted_with_ids(self):
+        index = name_index.get_index()
+        self.assertEqual(index["table_keys"],
+                         ["public.users", "sales.orders", "sales.users", "sales2.orders"])
+        self.assertEqual(index["table_ids"], [1, 3, 2, 4])
+
+    def test_table_name_public_first(self):
+        self.assertEqual(name_index.resolve("users"),
+                         [("table", "public.users", 1), ("table", "sales.users", 2)])
+
+    def test_schema_and_table(self):
+        self.assertEqual(name_index.resolve("sales.orders"), [("table", "sales.orders", 3)])
+
+    def test_table_and_column_in_any_schema(self):
+        self.assertEqual(name_index.resolve("users.id"),
+                         [("column", "public.users.id", 11), ("column", "sales.users.id", 13)])
+
+    def test_full_column_name(self):
+        self.assertEqual(
+            name_index.resolve("sales.orders.user_id"), [("column", "sales.orders.user_id", 15)])
+
+    def test_no_match(self):
+        self.assertEqual(name_index.resolve("nope"), [])
+        self.assertEqual(name_index.resolve("sales.nope"), [])
+        self.assertEqual(name_index.resolve("sales.orders.nope"), [])
+        self.assertEqual(name_index.resolve("a.b.c.d"), [])
+
+    def test_complete_schemas_and_tables(self):
+        self.assertEqual(name_index.complete("sa"), ["sales.", "sales2."])
+        self.assertEqual(name_index.complete("u"), ["users"])
+        self.assertEqual(name_index.complete("o"), ["orders"])
+
+    def test_complete_tables_in_schema(self):
+        self.assertEqual(name_index.complete("sales."), ["sales.orders", "sales.users"])
+        self.assertEqual(name_index.complete("sales.o"), ["sales.orders"])
+
+    def test_complete_columns(self):
+        self.assertEqual(
+            name_index.complete("sales.orders."), ["sales.orders.id", "sales.orders.user_id"])
+        self.assertEqual(name_index.complete("public.users.e"), ["public.users.email"])
+
+    def test_complete_nothing(self):
+        self.assertEqual(name_index.complete("zzz"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+Tests for reading orphan resolution plan files, which don't need a database
+"""
+
+import os
+import tempfile
+import unittest
+
+import orphan_plan
+
+
+class ReadPlanTest(unittest.TestCase):
+    """read_plan keeps rows with an action, and rejects ones it couldn't apply"""
+
+    def setUp(self):
+        plan_f = tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False)
+        plan_f.close()
+        self.file_path = plan_f.name
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def read(self, *rows):
+        """Write a plan file with the header, comments and the given rows, and read it back"""
+        with open(self.file_path, "w", newline="") as plan_f:
+            plan_f.write(orphan_plan.PLAN_HEADER)
+            plan_f.write("\t".join(orphan_plan.PLAN_FIELDS) + "\n")
+            for row in rows:
+                plan_f.write("\t".join(row) + "\n")
+        return orphan_plan.read_plan(self.file_path)
+
+    def test_rows_without_action_skipped(self):
+        plan = self.read(
+            ("table", "s", "old_a", "", "rename", "new_a", "0.93"),
+            ("table", "s", "old_b", "", "", "", ""),
+            ("column", "s", "t", "old_col", "delete", "", ""))
+        self.assertEqual(
+            [(row["table_name"], row["action"], row["target"]) for row in plan],
+            [("old_a", "rename", "new_a"), ("t", "delete", "")])
+
+    def test_whitespace_stripped(self):
+        plan = self.read(("table", "s", "old", "", " transfer ", " other_schema ", ""))
+        self.assertEqual((plan[0]["action"], plan[0]["target"]), ("transfer", "other_schema"))
+
+    def test_bad_object_type(self):
+        with self.assertRaisesRegex(ValueError, "object_type 'index' on plan row 1"):
+            self.read(("index", "s", "t", "", "delete", "", ""))
+
+    def test_bad_action(self):
+        with self.assertRaisesRegex(ValueError, "action 'drop' on plan row 2"):
+            self.read(("table", "s", "a", "", "", "", ""), ("table", "s", "b", "", "drop", "", ""))
+
+    def test_rename_needs_target(self):
+        with self.assertRaisesRegex(ValueError, "needs a target for rename"):
+            self.read(("column", "s", "t", "c", "rename", "", ""))
+
+    def test_only_tables_transferred(self):
+        with self.assertRaisesRegex(ValueError, "only tables can be transferred"):
+            self.read(("column", "s", "t", "c", "transfer", "other_schema", ""))
+
+
+if __name__ == "__main__":
+    unittest.main()
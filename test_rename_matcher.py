@@ -0,0 +1,76 @@
+"""
+Tests for scoring and pairing up likely table renames, which don't need a database
+"""
+
+import unittest
+from unittest import mock
+
+import rename_matcher
+import util
+
+
+class ScorePairTest(unittest.TestCase):
+    """score_pair mixes column overlap with table name similarity"""
+
+    def test_same_columns_and_name(self):
+        cols = {"id", "name"}
+        score = rename_matcher.score_pair(("a", "users"), cols, ("b", "users"), cols, 2)
+        self.assertAlmostEqual(score, 1)
+
+    def test_same_columns_new_name(self):
+        cols = {"id", "name"}
+        score = rename_matcher.score_pair(("a", "abc"), cols, ("a", "xyz"), cols, 2)
+        self.assertAlmostEqual(score, rename_matcher.COLUMN_WEIGHT)
+
+    def test_partial_overlap(self):
+        # 2 shared out of 4 distinct columns
+        score = rename_matcher.score_pair(
+            ("a", "abc"), {"id", "name", "x"}, ("a", "xyz"), {"id", "name", "y"}, 2)
+        self.assertAlmostEqual(score, rename_matcher.COLUMN_WEIGHT * 0.5)
+
+    def test_name_breaks_ties(self):
+        cols = {"id", "name"}
+        close = rename_matcher.score_pair(("a", "orders"), cols, ("a", "orders_v2"), cols, 2)
+        far = rename_matcher.score_pair(("a", "orders"), cols, ("a", "invoices"), cols, 2)
+        self.assertGreater(close, far)
+
+
+class ProposeRenamesTest(unittest.TestCase):
+    """propose_renames pairs each orphan with at most one candidate, best first"""
+
+    def propose(self, orphans, candidates, min_confidence=0.5):
+        """Run propose_renames on the given {(schema, table): cols} instead of the docs tables"""
+        # pylint: disable=protected-access
+        with mock.patch.object(
+                rename_matcher, "get_tables_with_cols", side_effect=[orphans, candidates]), \
+                mock.patch.dict(util._shared, {"db_conn": mock.Mock()}):
+            return rename_matcher.propose_renames(min_confidence)
+
+    def test_best_match_wins(self):
+        orphans = {("s", "orders"): {"id", "total", "placed_at"}}
+        candidates = {
+            ("s", "orders_new"): {"id", "total", "placed_at"},
+            ("s", "order_items"): {"id", "total", "sku"},
+        }
+        proposals = self.propose(orphans, candidates)
+        self.assertEqual([proposal[1:] for proposal in proposals],
+                         [(("s", "orders"), ("s", "orders_new"))])
+
+    def test_candidate_used_once(self):
+        orphans = {("s", "a"): {"id", "x"}, ("s", "b"): {"id", "x"}}
+        candidates = {("s", "c"): {"id", "x"}}
+        self.assertEqual(len(self.propose(orphans, candidates)), 1)
+
+    def test_below_min_confidence(self):
+        orphans = {("s", "orders"): {"id", "a", "b", "c"}}
+        candidates = {("s", "users"): {"id", "d", "e", "f"}}
+        self.assertEqual(self.propose(orphans, candidates), [])
+
+    def test_no_shared_columns(self):
+        orphans = {("s", "orders"): {"a"}}
+        candidates = {("s", "orders"): {"b"}}
+        self.assertEqual(self.propose(orphans, candidates, min_confidence=0), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
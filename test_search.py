@@ -0,0 +1,59 @@
+"""
+Tests for laying out search results, which don't need a database
+"""
+
+import unittest
+
+import search
+
+
+class GetWrappedWidthsTest(unittest.TestCase):
+    """get_wrapped_widths shrinks the widest columns to fit"""
+
+    def test_fits_already(self):
+        self.assertEqual(search.get_wrapped_widths([10, 20], 40), [10, 20])
+
+    def test_widest_shrunk_first(self):
+        # Three columns take 3 * 3 - 1 = 8 characters of separators
+        self.assertEqual(search.get_wrapped_widths([10, 50, 20], 80), [10, 42, 20])
+
+    def test_shrinks_evenly(self):
+        self.assertEqual(search.get_wrapped_widths([40, 40], 63), [29, 29])
+
+    def test_not_below_ten(self):
+        self.assertEqual(search.get_wrapped_widths([30, 30, 30], 20), [10, 10, 10])
+
+    def test_input_unchanged(self):
+        widths = [100]
+        search.get_wrapped_widths(widths, 50)
+        self.assertEqual(widths, [100])
+
+
+class SplitCellTest(unittest.TestCase):
+    """split_cell gives psql's continuation markers: "+" for newlines, "." for wrapping"""
+
+    def test_single_line(self):
+        self.assertEqual(search.split_cell("abc", 10, False), [("abc", " ")])
+
+    def test_empty(self):
+        self.assertEqual(search.split_cell("", 10, True), [("", " ")])
+
+    def test_newlines(self):
+        self.assertEqual(
+            search.split_cell("a\n\nb", 10, False), [("a", "+"), ("", "+"), ("b", " ")])
+
+    def test_long_line_not_wrapped(self):
+        self.assertEqual(search.split_cell("aaa bbb ccc", 5, False), [("aaa bbb ccc", " ")])
+
+    def test_wrapped(self):
+        self.assertEqual(
+            search.split_cell("aaa bbb ccc", 7, True), [("aaa bbb", "."), ("ccc", " ")])
+
+    def test_wrapped_then_newline(self):
+        self.assertEqual(
+            search.split_cell("aaa bbb\nccc", 3, True),
+            [("aaa", "."), ("bbb", "+"), ("ccc", " ")])
+
+
+if __name__ == "__main__":
+    unittest.main()
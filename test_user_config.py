@@ -4,8 +4,9 @@ Just a short script you can use to reassure yourself that your options/env are s
 
 import util
 
-print("Parsed options file:")
-print(util.parse_options_file())
+if __name__ == "__main__":
+    print("Parsed options file:")
+    print(util.parse_options_file())
 
-print("Final config:")
-print(util.get_user_config())
+    print("Final config:")
+    print(util.get_user_config())
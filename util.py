@@ -1,15 +1,32 @@
 """
-import sys
 Utils, database connection stuff
+
+Nothing here touches the database or config files at import time. The shared connection
+(`util.db_conn`, `util.cursor`) and config (`util.USER_CONFIG`, `util.TABLE_IGNORE_STRING`) are
+set up on first use, so things like `se --help` start instantly and work without PGHOST.
 """
 
 import json
 import os
 import re
 import subprocess
+import sys
+import threading
+
+import local_cache
+import name_index
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMP_DIR = os.path.join(THIS_DIR, "temp_files")
+# Module attributes that are only set up when first used, see get_shared
+LAZY_ATTRIBUTES = ("db_conn", "cursor", "USER_CONFIG", "TABLE_IGNORE_STRING")
 
-import psycopg2
-import psycopg2.extras
+_shared = {}
+
+# Set to False to print instead of opening `less`
+USE_PAGER = True
+# Set to False to connect without checking the docs schema is migrated (e.g. for `se migrate`)
+CHECK_SCHEMA_VERSION = True
 
 
 class NoSuchTableOrColError(Exception):
@@ -19,44 +36,71 @@ class NoSuchTableOrColError(Exception):
     pass # pylint: disable=unnecessary-pass
 
 
-def get_record_from_name(name):
+def fetch_all(query, params=()):
+    """
+    Run a query on the server and return all rows
+    """
+    get_shared("cursor").execute(query, params)
+    return list(get_shared("cursor").fetchall())
+
+
+def get_fetch_func(fresh=False):
+    """
+    Where lookups should be answered from: the local cache, unless it's disabled or `fresh`
+    """
+    if not fresh and local_cache.is_enabled():
+        return local_cache.fetch_all
+    return fetch_all
+
+
+def get_record_from_name(name, fresh=False):
     """
     Get record from tables table or columns table, depending on where we find matches.
+    Answered from the local cache unless `fresh` is set.
     """
     results = []
     object_type = None
+    fetch = get_fetch_func(fresh)
+
+    if fetch is local_cache.fetch_all:
+        # Resolve the name in memory, then it's one lookup by id
+        matches = name_index.resolve(name)
+        if not matches:
+            raise NoSuchTableOrColError("Couldn't find any object using name %s" % name)
+        object_type, full_name, row_id = matches[0]
+        if len(matches) > 1:
+            sys.stderr.write("%s is ambiguous, using %s (also: %s)\n" % (
+                name, full_name, ", ".join(match[1] for match in matches[1:])))
+        table = "tables" if object_type == "table" else "columns"
+        return fetch("SELECT * FROM " + table + " WHERE id = %s", (row_id,))[0], object_type
 
     if name.count(".") == 0:
         # Must be a table
         object_type = "table"
-        cursor.execute("SELECT * FROM tables WHERE table_name = %s", (name,))
-        results = list(cursor.fetchall())
+        results = fetch("SELECT * FROM tables WHERE table_name = %s", (name,))
     elif name.count(".") == 2:
         # Must be a column
         object_type = "column"
         left, middle, right = name.split(".")
-        cursor.execute("""
+        results = fetch("""
             SELECT * FROM columns
             WHERE table_schema = %s
             AND table_name = %s
             AND column_name = %s
         """, (left, middle, right))
-        results = list(cursor.fetchall())
     elif name.count(".") == 1:
         # Could be a table or column
         left, right = name.split(".")
         # Check for tables
-        cursor.execute(
+        results = fetch(
             "SELECT * FROM tables WHERE table_schema = %s and table_name = %s", (left, right))
-        results = list(cursor.fetchall())
         if results:
             object_type = "table"
         else:
             # Check for columns
             object_type = "column"
-            cursor.execute(
+            results = fetch(
                 "SELECT * FROM columns WHERE table_name = %s and column_name = %s", (left, right))
-            results = list(cursor.fetchall())
 
     if not results:
         raise NoSuchTableOrColError("Couldn't find any object using name %s" % name)
@@ -66,15 +110,14 @@ def get_record_from_name(name):
     return to_return, object_type
 
 
-def get_cols_for_table(table_schema, table_name):
+def get_cols_for_table(table_schema, table_name, fresh=False):
     """
     Get all records from schemadoc.columns for a given table
     """
-    cursor.execute("""
+    return get_fetch_func(fresh)("""
         SELECT * FROM columns
         WHERE table_schema = %s AND table_name = %s
     """, (table_schema, table_name))
-    return list(cursor.fetchall())
 
 
 def prep_editable_file(row, uneditable_fields, file_path):
@@ -102,7 +145,14 @@ def parse_editable_file(file_path):
     Take the "key: value" pairs from the text file and get them into a dict.
     Ignores comments, and allowed multiline values.
     """
-    lines = open(file_path).read().splitlines()
+    return parse_editable_text(open(file_path).read())
+
+
+def parse_editable_text(text):
+    """
+    Parse "___key: value" pairs like parse_editable_file, from a string
+    """
+    lines = text.splitlines()
     lines = [x for x in lines if not x.startswith("#")]
     remaining_text = "\n".join(lines)
     splitup = [x.strip() for x in remaining_text.split("___") if x.strip()]
@@ -129,33 +179,88 @@ def update_db_from_dict(row_id, update_data, table):
             value = None if not value.strip() else value
         update_query = "UPDATE " + table + " SET " + field + " = %s WHERE id = %s"
         update_params = (value, row_id)
-        cursor.execute(update_query, update_params)
+        get_shared("cursor").execute(update_query, update_params)
 
-    db_conn.commit()
+    get_shared("db_conn").commit()
+    local_cache.invalidate(table, row_id)
 
 
-def call_less(text):
+def stream_query(query, params=None, name="se_stream", itersize=2000):
+    """
+    Run a query on a server-side (named) cursor, yielding rows as they arrive instead of
+    fetching them all first. Rows come in batches of `itersize` per round trip.
     """
-    Render a string in `less`
+    conn = get_shared("db_conn")
+    named_cursor = conn.cursor(name=name, cursor_factory=get_cursor_factory())
+    named_cursor.itersize = itersize
+    try:
+        named_cursor.execute(query, params)
+        yield from named_cursor
+    except GeneratorExit:
+        # The caller stopped reading early
+        named_cursor.close()
+        conn.commit()
+        raise
+    except Exception:
+        conn.rollback()
+        raise
+    named_cursor.close()
+    conn.commit()
+
+
+def call_less(lines):
     """
-    process = subprocess.Popen(["less", "-r"], stdin=subprocess.PIPE)
-    process.stdin.write(text.encode("utf-8"))
-    process.communicate()
+    Render a string, or an iterable of lines, in `less`. Lines are written as they're produced,
+    so a generator's first lines show before the rest is ready.
+    Just prints if paging is turned off (e.g. in the daemon, where the client does the paging).
+    """
+    if isinstance(lines, str):
+        lines = [lines]
+    try:
+        if not USE_PAGER:
+            for line in lines:
+                print(line)
+            return
+        process = subprocess.Popen(["less", "-r"], stdin=subprocess.PIPE)
+        try:
+            for line in lines:
+                process.stdin.write(line.encode("utf-8") + b"\n")
+            process.stdin.close()
+        except BrokenPipeError:
+            # Quit before the end
+            pass
+        process.wait()
+    finally:
+        # Stop a generator that wasn't used up, e.g. to close its server-side cursor
+        if hasattr(lines, "close"):
+            lines.close()
+
+
+def open_editor(file_path):
+    """Open a file in $EDITOR (vim by default) and wait for it to close"""
+    import instrumentation # pylint: disable=import-outside-toplevel
+
+    with instrumentation.span("editor", os.environ.get("EDITOR", "vim")):
+        subprocess.call([os.environ.get("EDITOR", "vim"), file_path])
 
 
 def edit_loop(obj_name, uneditable_fields, update_func, file_path):
     """Call update_func with row_id as an arg, retrying if errors hit, or if user cancels"""
-    row, _ = get_record_from_name(obj_name)
+    row, object_type = get_record_from_name(obj_name)
     row_id = row["id"]
     assert isinstance(row_id, int)
+    # The name may have been resolved from the local cache, but edit the latest values
+    table = "tables" if object_type == "table" else "columns"
+    row = fetch_all("SELECT * FROM " + table + " WHERE id = %s", (row_id,))[0]
 
+    make_temp_dir()
     prep_editable_file(row, uneditable_fields, file_path)
     while True:
         try:
             update_func(row_id, file_path)
         except Exception as e: # pylint: disable=broad-except
             print("oops, hit a problem:")
-            db_conn.rollback()
+            get_shared("db_conn").rollback()
             print(str(e))
             user_response = input("Try again? (y/n)")
             if user_response == "n":
@@ -191,6 +296,8 @@ def get_user_config():
     table_ignore_patterns = {"^pg"}
     schemas_to_ignore = {"information_schema", "schemadoc"}
     schema = "schemadoc"
+    local_cache_string = "true"
+    cache_max_age = 60
 
     table_ignore_patterns_string = os.environ.get("SE_TABLE_IGNORE_PATTERNS")
     if not table_ignore_patterns_string:
@@ -211,10 +318,22 @@ def get_user_config():
     elif options_from_file.get("SCHEMA"):
         schema = options_from_file["SCHEMA"]
 
+    if os.environ.get("SE_LOCAL_CACHE"):
+        local_cache_string = os.environ["SE_LOCAL_CACHE"]
+    elif options_from_file.get("LOCAL_CACHE"):
+        local_cache_string = options_from_file["LOCAL_CACHE"]
+
+    if os.environ.get("SE_CACHE_MAX_AGE"):
+        cache_max_age = float(os.environ["SE_CACHE_MAX_AGE"])
+    elif options_from_file.get("CACHE_MAX_AGE"):
+        cache_max_age = float(options_from_file["CACHE_MAX_AGE"])
+
     return {
         "schemas_to_ignore": schemas_to_ignore,
         "table_ignore_patterns": table_ignore_patterns,
         "schema": schema,
+        "local_cache": local_cache_string.lower() not in ("0", "false", "no"),
+        "cache_max_age": cache_max_age,
     }
 
 
@@ -229,45 +348,93 @@ def get_table_ignore_sql_string():
     return table_ignore_string
 
 
-def print_table_stats():
-    psql_command = "psql -q << EOF\n"
-    psql_command += f"SET SEARCH_PATH = { USER_CONFIG['schema'] },public;\n"
-    psql_command += """
-        \C 'Table Stats'
-        SELECT
-        table_schema,
-        count(1) AS num_tables,
-        round(avg(description IS NOT NULL :: int), 2) AS prop_with_desc,
-        round(avg(last_approval_at IS NOT NULL :: int), 2) AS prop_with_approval,
-        sum(orphaned::int) AS num_orphaned
-        FROM schemadoc.tables
-        GROUP BY table_schema;
-
-        \C 'Column Stats'
-        SELECT
-        table_schema,
-        count(1) AS num_columns,
-        round(avg(description IS NOT NULL :: int), 2) AS prop_with_desc,
-        round(avg(example_vals IS NOT NULL :: int), 2) AS prop_with_example_vals,
-        sum(orphaned::int) AS num_orphaned
-        FROM schemadoc.columns
-        GROUP BY table_schema;
-    """
-    psql_command += "\nEOF"
-    subprocess.call(psql_command, shell=True)
-
-
-USER_CONFIG = get_user_config()
-TABLE_IGNORE_STRING = get_table_ignore_sql_string()
-
-db_conn = psycopg2.connect(
-    "postgresql://%s@%s:5432/%s" % \
-        (os.environ["PGUSER"], os.environ["PGHOST"], os.environ["PGDATABASE"]))
-cursor = db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-cursor.execute(f"SET SEARCH_PATH = { USER_CONFIG['schema'] },public")
-db_conn.commit()
+def make_temp_dir():
+    """
+    Create temp_files/ if needed, and return its path
+    """
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    return TEMP_DIR
 
-THIS_DIR = os.path.dirname(os.path.abspath(__file__))
-TEMP_DIR = os.path.join(THIS_DIR, "temp_files")
-if not os.path.isdir(TEMP_DIR):
-    os.mkdir("temp_files")
+
+def connect():
+    """
+    Open a new connection with the search path pointed at the docs schema
+    """
+    # psycopg2 is imported here rather than at the top, so that commands which never
+    # connect don't pay for loading it
+    import psycopg2 # pylint: disable=import-outside-toplevel
+    import instrumentation # pylint: disable=import-outside-toplevel
+
+    with instrumentation.span("connect", "connect"):
+        conn = psycopg2.connect(
+            "postgresql://%s@%s:5432/%s" % \
+                (os.environ["PGUSER"], os.environ["PGHOST"], os.environ["PGDATABASE"]),
+            connection_factory=(
+                instrumentation.ProfilingConnection if instrumentation.ENABLED else None))
+    setup_cursor = conn.cursor(cursor_factory=get_cursor_factory())
+    setup_cursor.execute(f"SET SEARCH_PATH = { get_shared('USER_CONFIG')['schema'] },public")
+    conn.commit()
+    return conn
+
+
+def get_cursor_factory():
+    """
+    DictCursor, or a subclass that records each statement when profiling (`se --profile`)
+    """
+    import psycopg2.extras # pylint: disable=import-outside-toplevel
+    import instrumentation # pylint: disable=import-outside-toplevel
+
+    if instrumentation.ENABLED:
+        return instrumentation.ProfilingCursor
+    return psycopg2.extras.DictCursor
+
+
+_thread_state = threading.local()
+
+
+def thread_cursor():
+    """
+    Get a cursor on a connection owned by the calling thread, e.g. for worker pools.
+    The connection is opened on first use and reused for the life of the thread.
+    """
+    if not hasattr(_thread_state, "cursor"):
+        _thread_state.cursor = connect().cursor(cursor_factory=get_cursor_factory())
+    return _thread_state.cursor
+
+
+def get_shared(name):
+    """
+    Get one of the LAZY_ATTRIBUTES, setting it up the first time it's asked for
+    """
+    if name not in _shared:
+        if name in ("db_conn", "cursor"):
+            db_conn = connect()
+            cursor = db_conn.cursor(cursor_factory=get_cursor_factory())
+            if CHECK_SCHEMA_VERSION:
+                import migrate # pylint: disable=import-outside-toplevel
+                migrate.check_schema_version(cursor)
+            _shared["db_conn"], _shared["cursor"] = db_conn, cursor
+        elif name == "USER_CONFIG":
+            _shared[name] = get_user_config()
+        elif name == "TABLE_IGNORE_STRING":
+            _shared[name] = get_table_ignore_sql_string()
+    return _shared[name]
+
+
+def reset_connection():
+    """
+    Drop the shared connection (e.g. after the server closed it), so the next use reconnects
+    """
+    db_conn = _shared.pop("db_conn", None)
+    _shared.pop("cursor", None)
+    if db_conn is not None and not db_conn.closed:
+        db_conn.close()
+
+
+def __getattr__(name):
+    """
+    Makes `util.cursor` etc. work as before, while only connecting on first use
+    """
+    if name in LAZY_ATTRIBUTES:
+        return get_shared(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))